@@ -1,5 +1,5 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -8,6 +8,9 @@ import os
 import pandas as pd
 import json
 from csv_enhancer import CSVEnhancer, generate_config_from_description
+from backend.app.core.config import STORAGE_MAX_BYTES, STORAGE_MAX_AGE_HOURS
+from backend.app.services.retention import RetentionManager, touch, compress_file, compressed_path_for, iter_decompressed
+from backend.app.utils.async_utils import run_blocking
 
 # Create FastAPI app
 app = FastAPI(title="CSV Enhancer API")
@@ -27,6 +30,35 @@ RESULT_FOLDER = "results"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULT_FOLDER, exist_ok=True)
 
+# Uploads and results of running jobs, which retention must keep
+active_files = set()
+
+# Keep the upload and result folders within their size and age quotas
+retention = RetentionManager(
+    {"uploads": UPLOAD_FOLDER, "results": RESULT_FOLDER},
+    compressed=("results",),
+    max_bytes=STORAGE_MAX_BYTES,
+    max_age_seconds=STORAGE_MAX_AGE_HOURS * 3600,
+    referenced=lambda: set(active_files),
+)
+
+@app.on_event("startup")
+async def start_retention():
+    retention.start()
+
+@app.on_event("shutdown")
+async def stop_retention():
+    retention.stop()
+
+def run_enhancer(enhancer: CSVEnhancer, filepath: str, result_path: str):
+    """Process a file, keeping it and its result from retention until the result is compressed"""
+    active_files.update((filepath, result_path))
+    try:
+        enhancer.process_file(filepath, result_path)
+        compress_file(result_path)
+    finally:
+        active_files.difference_update((filepath, result_path))
+
 # Define request models
 class ConfigRequest(BaseModel):
     description: str
@@ -36,21 +68,28 @@ class ProcessRequest(BaseModel):
     filename: str
     config: Dict[str, Any]
 
+def save_upload(file: UploadFile, file_path: str):
+    with open(file_path, "wb") as buffer:
+        while chunk := file.file.read(1 << 20):
+            buffer.write(chunk)
+
+def read_columns(file_path: str) -> List[str]:
+    # Parses the whole file, so malformed CSV files are rejected at upload
+    return pd.read_csv(file_path).columns.tolist()
+
 # API routes
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...)):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file format. Only CSV files are accepted.")
     
-    # Save the uploaded file
+    # Save the uploaded file (off the event loop)
     file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    await run_blocking("data", save_upload, file, file_path)
     
     # Read CSV headers
     try:
-        df = pd.read_csv(file_path)
-        columns = df.columns.tolist()
+        columns = await run_blocking("data", read_columns, file_path)
     except Exception as e:
         os.remove(file_path)  # Clean up on error
         raise HTTPException(status_code=400, detail=f"Error reading CSV file: {str(e)}")
@@ -64,7 +103,7 @@ async def upload_file(file: UploadFile = File(...)):
 @app.post("/api/generate-config")
 async def generate_config(request: ConfigRequest):
     try:
-        config = generate_config_from_description(request.description, request.columns)
+        config = await run_blocking("model", generate_config_from_description, request.description, request.columns)
         return {"config": config}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating configuration: {str(e)}")
@@ -76,13 +115,14 @@ async def process_file(request: ProcessRequest, background_tasks: BackgroundTask
     
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found")
+    touch(filepath)
     
     try:
         # Initialize the enhancer with the configuration
-        enhancer = CSVEnhancer(request.config)
+        enhancer = await run_blocking("data", CSVEnhancer, request.config)
         
         # Process the file in the background
-        background_tasks.add_task(enhancer.process_file, filepath, result_path)
+        background_tasks.add_task(run_enhancer, enhancer, filepath, result_path)
         
         return {
             "success": True,
@@ -92,17 +132,38 @@ async def process_file(request: ProcessRequest, background_tasks: BackgroundTask
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 @app.get("/api/download/{filename}")
-async def download_file(filename: str):
+async def download_file(filename: str, request: Request):
     file_path = os.path.join(RESULT_FOLDER, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+    if os.path.exists(file_path):
+        touch(file_path)
+        return FileResponse(
+            path=file_path,
+            filename=filename,
+            media_type="text/csv"
+        )
     
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type="text/csv"
+    # Results are stored gzip-compressed
+    compressed_path = compressed_path_for(file_path)
+    if not os.path.exists(compressed_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    touch(compressed_path)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return FileResponse(
+            path=compressed_path,
+            filename=filename,
+            media_type="text/csv",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+    return StreamingResponse(
+        iter_decompressed(compressed_path),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
     )
 
+@app.get("/api/admin/storage")
+async def storage_usage():
+    return await run_blocking("data", retention.usage)
+
 # Mount static files for production
 # Uncomment these lines when deploying to production
 # @app.on_event("startup")
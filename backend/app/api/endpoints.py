@@ -1,29 +1,75 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Depends
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Depends, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
+import hashlib
 import os
-import pandas as pd
+import time
+from typing import Dict, List, Any, Iterator, Optional
 
 from backend.app.core.config import UPLOAD_DIR, RESULT_DIR
-from backend.app.models.schemas import ConfigRequest, ProcessRequest, UploadResponse, ConfigResponse, ProcessResponse
+from backend.app.models.schemas import ConfigRequest, ProcessRequest, UploadResponse, ConfigResponse, ProcessResponse, JobStatusResponse, PreviewRequest, PreviewResponse
 from backend.app.services.csv_enhancer import CSVEnhancer, generate_config_from_description
+from backend.app.services.column_store import ColumnStore, StaleStoreError
+from backend.app.services.config_validation import validate_config
+from backend.app.services.jobs import job_registry, run_job
+from backend.app.services.job_profiler import PROFILE_FORMATS, ProfileActiveError, profile_registry
+from backend.app.services.output_writer import read_progress, iter_completed_bytes, partial_path_for
+from backend.app.services.scheduler import get_scheduler
+from backend.app.services.profiler import get_profile
+from backend.app.services.retention import get_retention_manager, touch, compressed_path_for, iter_decompressed
+from backend.app.utils.async_utils import run_blocking
 
 router = APIRouter()
 
+# Blocking model calls, file reads and DataFrame work go through run_blocking,
+# so a slow request never stalls the event loop (and every other endpoint)
+
+def _save_upload(file: UploadFile, file_path: str) -> str:
+    """Save an uploaded file in chunks and return the SHA-256 of its content"""
+    digest = hashlib.sha256()
+    with open(file_path, "wb") as buffer:
+        while chunk := file.file.read(1 << 20):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
+
+def _select_columns(config: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+    """Limit a configuration to some of its columns, e.g. to re-run one column of a result"""
+    unknown = [column for column in columns if column not in config.get("column_context", {})]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Columns not in the configuration: {', '.join(unknown)}")
+    return {**config, "column_context": {column: context for column, context in config["column_context"].items()
+                                         if column in columns}}
+
+async def _checked_profile(config: Dict[str, Any], filepath: str) -> Dict[str, Any]:
+    """Return the profile of an upload, rejecting a configuration that doesn't fit it before any work starts"""
+    profile = await run_blocking("data", get_profile, filepath)
+    errors = validate_config(config, list(profile["columns"]))
+    if errors:
+        raise HTTPException(status_code=400, detail=f"Invalid configuration: {'; '.join(errors)}")
+    return profile
+
+def _prepend(first: bytes, rest: Iterator[bytes]) -> Iterator[bytes]:
+    yield first
+    yield from rest
+
+def _run_preview(request: PreviewRequest, filepath: str) -> Dict[str, Any]:
+    # Previews run at interactive priority, ahead of bulk jobs
+    enhancer = CSVEnhancer(request.config, tenant=request.tenant, priority="interactive")
+    return enhancer.preview(filepath, request.sample_size)
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_file(file: UploadFile = File(...)):
-    """Upload a CSV file and return its columns"""
+    """Upload a CSV file and return its columns and column profile"""
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file format. Only CSV files are accepted.")
     
-    # Save the uploaded file
+    # Save the uploaded file in chunks, hashing the content on the way
     file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    content_hash = await run_blocking("data", _save_upload, file, file_path)
     
-    # Read CSV headers
+    # Profile the columns in one chunked pass (cached by content hash)
     try:
-        df = pd.read_csv(file_path)
-        columns = df.columns.tolist()
+        profile = await run_blocking("data", get_profile, file_path, content_hash)
     except Exception as e:
         os.remove(file_path)  # Clean up on error
         raise HTTPException(status_code=400, detail=f"Error reading CSV file: {str(e)}")
@@ -31,50 +77,241 @@ async def upload_file(file: UploadFile = File(...)):
     return {
         "success": True,
         "filename": file.filename,
-        "columns": columns
+        "columns": list(profile["columns"]),
+        "profile": profile
     }
 
 @router.post("/generate-config", response_model=ConfigResponse)
 async def generate_config(request: ConfigRequest):
     """Generate a configuration based on a natural language description"""
     try:
-        config = generate_config_from_description(request.description, request.columns)
+        profile = None
+        if request.filename:
+            filepath = os.path.join(UPLOAD_DIR, request.filename)
+            if os.path.exists(filepath):
+                touch(filepath)
+                profile = await run_blocking("data", get_profile, filepath)
+        config = await run_blocking("model", generate_config_from_description,
+                                    request.description, request.columns, profile)
         return {"config": config}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating configuration: {str(e)}")
 
 @router.post("/process", response_model=ProcessResponse)
 async def process_file(request: ProcessRequest, background_tasks: BackgroundTasks):
-    """Process a CSV file with a configuration"""
+    """Process a CSV file with a configuration
+    
+    Only the enhanced columns are stored, so running the same file again
+    with `columns` (or a configuration with fewer columns) only rewrites
+    those columns of the result.
+    """
     filepath = os.path.join(UPLOAD_DIR, request.filename)
     result_path = os.path.join(RESULT_DIR, f"enhanced_{request.filename}")
     
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found")
+    touch(filepath)
+    config = _select_columns(request.config, request.columns) if request.columns else request.config
+    profile = await _checked_profile(config, filepath)
     
+    job = None
     try:
+        job = job_registry.create(request.filename, f"enhanced_{request.filename}",
+                                  tenant=request.tenant, priority=request.priority)
+        
         # Initialize the enhancer with the configuration
-        enhancer = CSVEnhancer(request.config)
+        enhancer = await run_blocking("data", CSVEnhancer, config, job_id=job["job_id"],
+                                      tenant=request.tenant, priority=request.priority, profile=profile)
         
         # Process the file in the background
-        background_tasks.add_task(enhancer.process_file, filepath, result_path)
+        background_tasks.add_task(run_job, job["job_id"], enhancer, filepath, result_path, request.mode)
         
         return {
             "success": True,
-            "result_file": f"enhanced_{request.filename}"
+            "result_file": f"enhanced_{request.filename}",
+            "job_id": job["job_id"]
         }
     except Exception as e:
+        # A job that never started must not stay queued (and pin its files against retention)
+        if job is not None:
+            job_registry.update(job["job_id"], status="failed", finished_at=time.time(), error=str(e))
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+@router.post("/preview", response_model=PreviewResponse)
+async def preview_file(request: PreviewRequest):
+    """Run a configuration on a small stratified sample and return the changed cells"""
+    filepath = os.path.join(UPLOAD_DIR, request.filename)
+    
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="File not found")
+    touch(filepath)
+    await _checked_profile(request.config, filepath)
+    
+    try:
+        # Mostly waiting on the model, so it runs on the model pool
+        return await run_blocking("model", _run_preview, request, filepath)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error previewing file: {str(e)}")
+
 @router.get("/download/{filename}")
-async def download_file(filename: str):
-    """Download a processed CSV file"""
+async def download_file(filename: str, request: Request, partial: bool = False):
+    """Download a processed CSV file
+    
+    With `partial=true`, the rows completed so far are streamed while the job is
+    still running. The X-Rows-Complete, X-Total-Rows and X-Complete headers tell
+    how much of the file is included and whether it is final. Results are
+    stored as their enhanced columns and merged with the upload on the first
+    download, which is streamed and cached as the result file. Cached
+    results are compressed at rest and sent as is with `Content-Encoding:
+    gzip` to clients that accept it.
+    """
     file_path = os.path.join(RESULT_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+    progress = read_progress(file_path)
+    store = ColumnStore(filename)
+    
+    # A running job (e.g. re-running one column) is served from its partial output,
+    # not from the previous run's result, which still exists until it commits
+    stored_partial = progress is not None and progress.get("store") == filename
+    if partial and progress is not None and not progress.get("complete") and (
+            stored_partial or os.path.exists(partial_path_for(file_path))):
+        stream = None
+        if stored_partial:
+            stream = store.iter_merged(partial=progress)
+            try:
+                # Fail here rather than halfway through the response if the upload or a column file is gone
+                stream = _prepend(await run_blocking("data", next, stream, b""), stream)
+            except StaleStoreError as e:
+                raise HTTPException(status_code=410, detail=str(e))
+        else:
+            try:
+                stream = iter_completed_bytes(file_path)
+            except FileNotFoundError:
+                # The job committed since its progress was read, so its result is served below
+                progress = read_progress(file_path)
+        if stream is not None:
+            return StreamingResponse(
+                stream,
+                media_type="text/csv",
+                headers={
+                    "Content-Disposition": f'attachment; filename="partial_{filename}"',
+                    "X-Complete": "false",
+                    "X-Rows-Complete": str(progress["rows_complete"]),
+                    "X-Total-Rows": str(progress["total_rows"]),
+                }
+            )
     
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type="text/csv"
-    ) 
\ No newline at end of file
+    headers = {"X-Complete": "true"}
+    if progress:
+        headers["X-Rows-Complete"] = str(progress["rows_complete"])
+        headers["X-Total-Rows"] = str(progress["total_rows"])
+    if os.path.exists(file_path):
+        touch(file_path)
+        return FileResponse(
+            path=file_path,
+            filename=filename,
+            media_type="text/csv",
+            headers=headers
+        )
+    
+    compressed_path = compressed_path_for(file_path)
+    if os.path.exists(compressed_path):
+        touch(compressed_path)
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return FileResponse(
+                path=compressed_path,
+                filename=filename,
+                media_type="text/csv",
+                headers={**headers, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+            )
+        return StreamingResponse(
+            iter_decompressed(compressed_path),
+            media_type="text/csv",
+            headers={**headers, "Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+        )
+    
+    # Merge the stored columns with the upload, caching the merged file for the next download
+    manifest = store.manifest()
+    if manifest is not None:
+        store.touch()
+        touch(manifest["source"]["path"])
+        stream = store.materialize(file_path)
+        try:
+            # Fail here rather than halfway through the response if the upload is gone
+            first = await run_blocking("data", next, stream, b"")
+        except StaleStoreError as e:
+            raise HTTPException(status_code=410, detail=str(e))
+        return StreamingResponse(
+            _prepend(first, stream),
+            media_type="text/csv",
+            headers={**headers, "Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    
+    raise HTTPException(status_code=404, detail="File not found")
+
+@router.get("/jobs", response_model=List[JobStatusResponse])
+async def list_jobs():
+    """List enhancement jobs with their queueing delay and share of the request budget"""
+    return job_registry.list()
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Get the status and scheduler stats of an enhancement job"""
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/scheduler")
+async def scheduler_status():
+    """Get the global request scheduler state"""
+    return get_scheduler().snapshot()
+
+@router.get("/admin/storage")
+async def storage_usage():
+    """Get the disk usage of uploads and results against the retention quotas"""
+    return await run_blocking("data", get_retention_manager().usage)
+
+@router.post("/admin/jobs/{job_id}/profile/start")
+async def start_profile(job_id: str, interval_ms: float = 10):
+    """Start sampling the stacks of a running job"""
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "running":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}, only running jobs can be profiled")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    try:
+        session = profile_registry.start(job_id, "sampling", interval_ms / 1000)
+    except ProfileActiveError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.summary()
+
+@router.post("/admin/jobs/{job_id}/profile/stop")
+async def stop_profile(job_id: str):
+    """Stop profiling a job and return the summary of its profile"""
+    session = await run_blocking("data", profile_registry.stop, job_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Job is not being profiled")
+    return session.summary()
+
+@router.get("/admin/jobs/{job_id}/profile")
+async def get_job_profile(job_id: str, format: Optional[str] = None):
+    """Get the summary of a job's running or latest profile, or download it as collapsed stacks or pstats"""
+    session = profile_registry.get(job_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profile of this job")
+    if format is None:
+        return session.summary()
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(PROFILE_FORMATS)}")
+    try:
+        data = await run_blocking("data", session.export, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    extension = "txt" if format == "collapsed" else "prof"
+    return Response(
+        content=data,
+        media_type="text/plain" if format == "collapsed" else "application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile_{job_id}.{extension}"'}
+    )
@@ -17,13 +17,58 @@ DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "t")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
+# LLM backend: "openai", or "fake" for the local stand-in used in development and benchmarks
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+# Fraction of fake calls that are stragglers and how long they take
+FAKE_LLM_SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+FAKE_LLM_SLOW_MS = float(os.getenv("FAKE_LLM_SLOW_MS", "0"))
+# Fraction of fake batch replies wrapped in prose, as models do when the reply format isn't enforced
+FAKE_LLM_PROSE_RATE = float(os.getenv("FAKE_LLM_PROSE_RATE", "0"))
+
+# Request scheduler settings (0 disables a limit)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))
+REQUESTS_PER_MINUTE = int(os.getenv("REQUESTS_PER_MINUTE", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("TOKENS_PER_MINUTE", "200000"))
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "4"))
+
+# Request deadlines, retries and hedging
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+REQUEST_MAX_RETRIES = int(os.getenv("REQUEST_MAX_RETRIES", "2"))
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+
+# Offline batch mode: "openai" uses the Batch API, "local" runs request files in-process
+BATCH_BACKEND = os.getenv("BATCH_BACKEND", "local" if LLM_BACKEND == "fake" else "openai").lower()
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "30"))
+
+# Number of single-entry model answers kept in the in-process response cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "100000"))
+
+# Threads running blocking work for the API off the event loop: model calls
+# (e.g. config generation) and file/DataFrame work (profiling, previews)
+API_MODEL_WORKERS = int(os.getenv("API_MODEL_WORKERS", "8"))
+API_DATA_WORKERS = int(os.getenv("API_DATA_WORKERS", "4"))
+
+# Storage retention: total size quota of uploads plus results (0 disables), age
+# limit in hours (0 disables) and seconds between sweeps
+STORAGE_MAX_BYTES = int(float(os.getenv("STORAGE_MAX_GB", "20")) * 1024 ** 3)
+STORAGE_MAX_AGE_HOURS = float(os.getenv("STORAGE_MAX_AGE_HOURS", "168"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "600"))
+
 # File storage settings
-UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")
-RESULT_DIR = os.path.join(BASE_DIR, "data", "results")
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+RESULT_DIR = os.path.join(DATA_DIR, "results")
+BATCH_DIR = os.path.join(DATA_DIR, "batches")
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+# Enhanced columns of API results, merged into RESULT_DIR on download
+COLUMN_STORE_DIR = os.path.join(DATA_DIR, "columns")
 
-# Create directories if they don't exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(RESULT_DIR, exist_ok=True)
+def ensure_storage_dirs() -> None:
+    """Create the upload, result and column store directories if they don't exist"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    os.makedirs(COLUMN_STORE_DIR, exist_ok=True)
 
 # CORS settings
 CORS_ORIGINS = [
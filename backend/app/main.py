@@ -5,7 +5,10 @@ import os
 from pathlib import Path
 
 from backend.app.api.router import api_router
-from backend.app.core.config import PROJECT_NAME, API_PREFIX, CORS_ORIGINS
+from backend.app.core.config import PROJECT_NAME, API_PREFIX, CORS_ORIGINS, ensure_storage_dirs
+from backend.app.services.retention import get_retention_manager
+
+ensure_storage_dirs()
 
 # Create FastAPI app
 app = FastAPI(title=PROJECT_NAME)
@@ -25,10 +28,17 @@ app.include_router(api_router, prefix=API_PREFIX)
 # Mount static files for production
 @app.on_event("startup")
 async def startup_event():
+    # Keep uploads and results within their size and age quotas
+    get_retention_manager().start()
+    
     frontend_path = Path(__file__).resolve().parent.parent.parent / "frontend" / "dist"
     if frontend_path.exists():
         app.mount("/", StaticFiles(directory=str(frontend_path), html=True), name="static")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    get_retention_manager().stop()
+
 # Root endpoint
 @app.get("/")
 async def root():
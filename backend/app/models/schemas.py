@@ -1,21 +1,37 @@
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, Literal
 
 class ConfigRequest(BaseModel):
     """Request model for generating configuration from description"""
     description: str
     columns: List[str]
+    # Uploaded file whose profile is used to tune the configuration
+    filename: Optional[str] = None
 
 class ProcessRequest(BaseModel):
     """Request model for processing a CSV file with a configuration"""
     filename: str
     config: Dict[str, Any]
+    tenant: str = "default"
+    priority: Literal["interactive", "bulk"] = "bulk"
+    # "batch" sends the requests through the offline batch backend (cheaper, slower)
+    mode: Literal["online", "batch"] = "online"
+    # Only (re)run these columns of the configuration; the stored results of the others are kept
+    columns: Optional[List[str]] = None
+
+class PreviewRequest(BaseModel):
+    """Request model for previewing a configuration on a sample of a CSV file"""
+    filename: str
+    config: Dict[str, Any]
+    sample_size: int = Field(20, ge=1, le=500)
+    tenant: str = "default"
 
 class UploadResponse(BaseModel):
     """Response model for file upload"""
     success: bool
     filename: str
     columns: List[str]
+    profile: Optional[Dict[str, Any]] = None
 
 class ConfigResponse(BaseModel):
     """Response model for configuration generation"""
@@ -25,6 +41,40 @@ class ProcessResponse(BaseModel):
     """Response model for file processing"""
     success: bool
     result_file: str
+    job_id: Optional[str] = None
+
+class PreviewChange(BaseModel):
+    """A cell changed by a preview run"""
+    row: int
+    column: str
+    before: Any = None
+    after: Any = None
+
+class PreviewResponse(BaseModel):
+    """Response model for a preview run"""
+    job_id: str
+    rows: int
+    sample_rows: List[int]
+    processed_columns: List[str]
+    changes: List[PreviewChange]
+    elapsed_seconds: float
+    stats: Dict[str, Any]
+    scheduler: Optional[Dict[str, Any]] = None
+
+class JobStatusResponse(BaseModel):
+    """Response model for the status of an enhancement job"""
+    job_id: str
+    filename: str
+    result_file: str
+    tenant: str
+    priority: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    summary: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    scheduler: Optional[Dict[str, Any]] = None
 
 class ErrorResponse(BaseModel):
     """Response model for errors"""
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional
+
+from backend.app.core.config import BATCH_BACKEND, BATCH_DIR
+from backend.app.utils.file_utils import write_json_atomic
+
+# Endpoint every request line of a batch file is sent to
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+# How long the Batch API may take to finish a file
+COMPLETION_WINDOW = "24h"
+
+# Batch states after which polling stops
+FINISHED_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def request_line(custom_id: str, body: Dict[str, Any]) -> str:
+    """Render one chat completion request as a line of a batch request file"""
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body})
+
+
+class BatchBackend(ABC):
+    """Runs a JSONL file of chat completion requests offline
+
+    Request lines follow the OpenAI Batch API format (`custom_id`, `method`,
+    `url`, `body`) and so do result lines (`custom_id`, `response.body`,
+    `error`). Results may come back in any order.
+    """
+
+    @abstractmethod
+    def submit(self, requests_path: str) -> str:
+        """Submit a request file and return the batch id"""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        """Return {"status", "completed", "failed", "total"} for a batch"""
+
+    @abstractmethod
+    def download(self, batch_id: str, results_path: str) -> None:
+        """Write the result lines of a finished batch to `results_path`"""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Batch backend using the OpenAI Files and Batch APIs"""
+
+    def __init__(self, client: Any = None):
+        if client is None:
+            from openai import OpenAI
+            from backend.app.core.config import OPENAI_API_KEY
+            client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = client
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        # The batch endpoints are called directly as the pinned client has no wrapper for them
+        batch = self.client.post("/batches", cast_to=Dict[str, Any], body={
+            "input_file_id": uploaded.id,
+            "endpoint": CHAT_COMPLETIONS_URL,
+            "completion_window": COMPLETION_WINDOW,
+        })
+        return batch["id"]
+
+    def _batch(self, batch_id: str) -> Dict[str, Any]:
+        return self.client.get(f"/batches/{batch_id}", cast_to=Dict[str, Any])
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self._batch(batch_id)
+        counts = batch.get("request_counts") or {}
+        return {
+            "status": batch["status"],
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "total": counts.get("total", 0),
+        }
+
+    def download(self, batch_id: str, results_path: str) -> None:
+        import httpx
+
+        batch = self._batch(batch_id)
+        with open(results_path, "wb") as out:
+            # Requests that failed validation are reported in a separate error file
+            for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+                if file_id:
+                    response = self.client.get(f"/files/{file_id}/content", cast_to=httpx.Response)
+                    out.write(response.content)
+
+
+class LocalBatchBackend(BatchBackend):
+    """File-based stand-in for the Batch API that runs request files in a background thread
+
+    Every batch gets a directory under `root` holding the submitted requests,
+    a status file and the results, so it can be inspected after the run.
+    Requests are sent one at a time through `create_client()`, which makes it
+    usable with the fake LLM backend for development and tests.
+    """
+
+    def __init__(self, root: str = BATCH_DIR, client: Any = None):
+        self.root = root
+        self.client = client
+
+    def _dir(self, batch_id: str) -> str:
+        return os.path.join(self.root, batch_id)
+
+    def _write_status(self, batch_id: str, status: Dict[str, Any]) -> None:
+        write_json_atomic(os.path.join(self._dir(batch_id), "status.json"), status)
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(self._dir(batch_id))
+        with open(requests_path) as src:
+            lines = [line for line in src if line.strip()]
+        with open(os.path.join(self._dir(batch_id), "input.jsonl"), "w") as dst:
+            dst.writelines(lines)
+        self._write_status(batch_id, {"status": "in_progress", "completed": 0, "failed": 0, "total": len(lines)})
+        threading.Thread(target=self._run, args=(batch_id, lines), daemon=True).start()
+        return batch_id
+
+    def _run(self, batch_id: str, lines: list) -> None:
+        from backend.app.services.llm_client import client_request, create_client
+
+        client = self.client or create_client()
+        status = {"status": "in_progress", "completed": 0, "failed": 0, "total": len(lines)}
+        try:
+            with open(os.path.join(self._dir(batch_id), "output.jsonl.tmp"), "w") as out:
+                for line in lines:
+                    request = json.loads(line)
+                    result: Dict[str, Any] = {"id": uuid.uuid4().hex, "custom_id": request["custom_id"],
+                                              "response": None, "error": None}
+                    try:
+                        create = client.chat.completions.create
+                        response = create(**client_request(create, request["body"]))
+                        result["response"] = {"status_code": 200, "body": _response_body(response)}
+                        status["completed"] += 1
+                    except Exception as e:
+                        result["error"] = {"code": type(e).__name__, "message": str(e)}
+                        status["failed"] += 1
+                    out.write(json.dumps(result) + "\n")
+            os.replace(os.path.join(self._dir(batch_id), "output.jsonl.tmp"),
+                       os.path.join(self._dir(batch_id), "output.jsonl"))
+            status["status"] = "completed"
+        except Exception as e:
+            print(f"Local batch {batch_id} failed. Error: {e}")
+            status["status"] = "failed"
+        self._write_status(batch_id, status)
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self._dir(batch_id), "status.json")) as f:
+            return json.load(f)
+
+    def download(self, batch_id: str, results_path: str) -> None:
+        with open(os.path.join(self._dir(batch_id), "output.jsonl"), "rb") as src, open(results_path, "wb") as dst:
+            dst.write(src.read())
+
+
+def _response_body(response: Any) -> Dict[str, Any]:
+    """Convert a chat completion response to the JSON body the Batch API returns"""
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    return {
+        "model": response.model,
+        "choices": [{"index": choice.index, "finish_reason": choice.finish_reason,
+                     "message": {"role": choice.message.role, "content": choice.message.content},
+                     "logprobs": _logprobs_body(getattr(choice, "logprobs", None))}
+                    for choice in response.choices],
+        "usage": _usage_body(response.usage) if getattr(response, "usage", None) else None,
+    }
+
+
+def _usage_body(usage: Any) -> Dict[str, Any]:
+    # Token details (e.g. cached prompt tokens) are nested objects
+    return {key: vars(value) if hasattr(value, "__dict__") else value for key, value in vars(usage).items()}
+
+
+def _logprobs_body(logprobs: Any) -> Optional[Dict[str, Any]]:
+    if logprobs is None:
+        return None
+    return {"content": [{"token": token.token, "logprob": token.logprob} for token in logprobs.content]}
+
+
+def create_batch_backend(name: Optional[str] = None) -> BatchBackend:
+    """Create the batch backend configured by BATCH_BACKEND (or `name`)"""
+    name = (name or BATCH_BACKEND).lower()
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unknown batch backend '{name}'. Expected 'openai' or 'local'")
@@ -0,0 +1,153 @@
+import json
+import math
+import threading
+from typing import Dict, List, Any, Optional
+
+# Entries answered with less confidence than this by a tier are escalated to the next one
+DEFAULT_MIN_CONFIDENCE = 0.7
+
+# Ways a tier can report how confident it is of each answer
+CONFIDENCE_SOURCES = ("self", "logprobs")
+
+
+def cascade_tiers(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the model tiers of a config, cheapest first
+
+    Without a `model_cascade` there is one tier using OPENAI_MODEL. Every tier
+    but the last reports a confidence per entry; the last tier's answers are
+    always accepted.
+    """
+    from backend.app.core.config import OPENAI_MODEL
+
+    tiers = []
+    for tier in config.get("model_cascade") or [{"model": OPENAI_MODEL}]:
+        tiers.append({
+            "model": tier["model"],
+            "min_confidence": float(tier.get("min_confidence", DEFAULT_MIN_CONFIDENCE)),
+            "confidence": tier.get("confidence", "self"),
+            # Optional prices in dollars per million tokens, used for the cost report
+            "input_cost_per_million": tier.get("input_cost_per_million"),
+            "output_cost_per_million": tier.get("output_cost_per_million"),
+        })
+    return tiers
+
+
+def item_spans(text: str, key: Optional[str] = None) -> List[tuple]:
+    """Return the (start, end) character span of each item of a JSON array
+
+    The array is the first one in the text, or the first one after the
+    object key `key` (e.g. "values" of a structured outputs reply).
+    """
+    decoder = json.JSONDecoder()
+    spans = []
+    position = text.find(f'"{key}"') if key else 0
+    if position < 0:
+        return spans
+    position = text.find("[", position) + 1
+    if position == 0:
+        return spans
+    length = len(text)
+    while position < length:
+        # Skip the separators up to the next item or the end of the array
+        while position < length and text[position] in " \t\r\n,":
+            position += 1
+        if position >= length or text[position] == "]":
+            break
+        try:
+            _, end = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            break
+        spans.append((position, end))
+        position = end
+    return spans
+
+
+def logprob_confidences(text: str, tokens: List[Any], key: Optional[str] = None) -> List[Optional[float]]:
+    """Derive one confidence per answered entry from token log probabilities
+
+    The confidence of an entry is the probability of its least likely token,
+    taken over the tokens that make up the entry's item in the answer array
+    (see `item_spans`).
+    """
+    spans = item_spans(text, key)
+    lowest: List[Optional[float]] = [None] * len(spans)
+    offset = 0
+    for token in tokens:
+        piece, logprob = _token_field(token, "token"), _token_field(token, "logprob")
+        start, offset = offset, offset + len(piece)
+        for number, (span_start, span_end) in enumerate(spans):
+            if start < span_end and offset > span_start:
+                lowest[number] = logprob if lowest[number] is None else min(lowest[number], logprob)
+    return [math.exp(value) if value is not None else None for value in lowest]
+
+
+def response_logprobs(response: Any) -> Optional[List[Any]]:
+    """Return the token log probabilities of a chat completion, if it has them"""
+    logprobs = getattr(response.choices[0], "logprobs", None)
+    if logprobs is None:
+        return None
+    return _token_field(logprobs, "content")
+
+
+def _token_field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+class CascadeStats:
+    """Per-tier request, escalation, latency, token and cost counters of a job"""
+
+    def __init__(self, tiers: List[Dict[str, Any]]):
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self._counts = [{"model": tier["model"], "requests": 0, "entries": 0, "escalated": 0, "seconds": 0.0,
+                         "prompt_tokens": 0, "completion_tokens": 0} for tier in tiers]
+
+    def record(self, tier: int, entries: int, escalated: int, seconds: float, usage: Any = None) -> None:
+        with self._lock:
+            counts = self._counts[tier]
+            counts["requests"] += 1
+            counts["entries"] += entries
+            counts["escalated"] += escalated
+            counts["seconds"] += seconds
+            if usage is not None:
+                counts["prompt_tokens"] += _token_field(usage, "prompt_tokens") or 0
+                counts["completion_tokens"] += _token_field(usage, "completion_tokens") or 0
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            summary = []
+            for tier, counts in zip(self.tiers, self._counts):
+                report = dict(counts)
+                report["escalation_rate"] = counts["escalated"] / counts["entries"] if counts["entries"] else 0.0
+                report["avg_latency"] = counts["seconds"] / counts["requests"] if counts["requests"] else 0.0
+                if tier["input_cost_per_million"] is not None and tier["output_cost_per_million"] is not None:
+                    report["cost"] = (counts["prompt_tokens"] * tier["input_cost_per_million"]
+                                      + counts["completion_tokens"] * tier["output_cost_per_million"]) / 1e6
+                summary.append(report)
+            return summary
+
+
+def validate_cascade(config: Dict[str, Any]) -> List[str]:
+    """Check the `model_cascade` of a config and return a list of problems"""
+    tiers = config.get("model_cascade")
+    if tiers is None:
+        return []
+    if not isinstance(tiers, list) or not tiers:
+        return ["'model_cascade' must be a non-empty list of tiers"]
+
+    errors = []
+    for number, tier in enumerate(tiers):
+        name = f"model_cascade[{number}]"
+        if not isinstance(tier, dict) or not isinstance(tier.get("model"), str):
+            errors.append(f"'{name}' must be an object with a 'model' name")
+            continue
+        threshold = tier.get("min_confidence", DEFAULT_MIN_CONFIDENCE)
+        if not isinstance(threshold, (int, float)) or isinstance(threshold, bool) or not 0 <= threshold <= 1:
+            errors.append(f"'{name}.min_confidence' must be a number between 0 and 1")
+        if tier.get("confidence", "self") not in CONFIDENCE_SOURCES:
+            errors.append(f"'{name}.confidence' must be one of: {', '.join(CONFIDENCE_SOURCES)}")
+        for key in ("input_cost_per_million", "output_cost_per_million"):
+            value = tier.get(key)
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0):
+                errors.append(f"'{name}.{key}' must be a non-negative number")
+    return errors
@@ -0,0 +1,353 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Any, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+from backend.app.core.config import COLUMN_STORE_DIR
+from backend.app.services.output_writer import progress_path_for, read_progress
+from backend.app.services.retention import compressed_path_for, touch
+from backend.app.utils.file_utils import write_json_atomic
+from backend.app.utils.frame_utils import write_frame
+
+# A result is stored as the columns a job enhanced, one Arrow IPC file per
+# column with the text of each row of the upload in the upload's row order,
+# next to a manifest:
+#   <COLUMN_STORE_DIR>/<result name>/manifest.json
+#   <COLUMN_STORE_DIR>/<result name>/<column>-<hash>.arrow
+# Column files are memory-mapped when merging, so only the upload itself is
+# parsed. While a job runs, its columns are appended as CSV text to
+# <column>-<hash>.csv.partial instead, which can be streamed as it grows and
+# truncated to the last complete row range when resuming; they are converted
+# when the job finishes. The merged file (the upload with the enhanced columns
+# swapped in) is only written when it is downloaded, and kept in RESULT_DIR as
+# a cache until a column changes. Re-running one column rewrites only that
+# column's file.
+
+# Rows of the upload and the column files read at a time when merging
+MERGE_CHUNK_ROWS = 50000
+
+PARTIAL_SUFFIX = ".partial"
+
+_manifest_lock = threading.Lock()
+
+
+class StaleStoreError(FileNotFoundError):
+    """Raised when the upload a stored result belongs to, or one of its column files, was removed or replaced"""
+
+
+def _column_stem(column: str) -> str:
+    """Return a file name stem for a column that is safe on disk and unique per column name"""
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", column)[:64]
+    return f"{safe}-{hashlib.sha1(column.encode('utf-8')).hexdigest()[:8]}"
+
+
+def source_fingerprint(path: str) -> Dict[str, Any]:
+    """Identify an upload by path, size and modification time"""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_text(path: str, chunk_rows: int, as_text: bool = True) -> Iterator[pd.DataFrame]:
+    if as_text:
+        # Cells are passed through exactly as they are in the file
+        return pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    return pd.read_csv(path, float_precision="round_trip", chunksize=chunk_rows)
+
+
+def _chunk_bytes(chunk: pd.DataFrame, output_format: str, first: bool) -> bytes:
+    if output_format == "jsonl":
+        if not len(chunk):
+            return b""
+        return (chunk.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n").encode("utf-8")
+    return chunk.to_csv(index=False, header=first).encode("utf-8")
+
+
+def _column_chunks(path: str, chunk_rows: int) -> Iterator[pd.Series]:
+    """Yield the text values of a column file, `chunk_rows` at a time"""
+    if path.endswith(".arrow"):
+        with pa.memory_map(path) as source:
+            values = pa.ipc.open_file(source).read_all().column(0)
+            for start in range(0, len(values), chunk_rows):
+                yield values.slice(start, chunk_rows).to_pandas()
+    else:
+        # Partial files of running jobs (and columns stored before Arrow files were used) are CSV text
+        for chunk in _read_text(path, chunk_rows):
+            yield chunk.iloc[:, 0]
+
+
+def _convert_partial(partial_path: str, path: str, column: str) -> None:
+    """Write the CSV text of a finished column to `path` as an Arrow IPC file and remove the CSV"""
+    schema = pa.schema([(column, pa.string())])
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        if os.path.getsize(partial_path):
+            for chunk in _read_text(partial_path, MERGE_CHUNK_ROWS):
+                writer.write_batch(pa.record_batch([pa.array(chunk.iloc[:, 0], type=pa.string())], schema=schema))
+    os.replace(tmp_path, path)
+    os.remove(partial_path)
+
+
+class ColumnStore:
+    """Enhanced columns of one result, stored apart from the upload they belong to"""
+
+    def __init__(self, name: str, root: str = COLUMN_STORE_DIR):
+        self.name = name
+        self.directory = os.path.join(root, name)
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """Return the manifest of the stored columns, or None if nothing was stored yet"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def column_path(self, column: str) -> str:
+        return os.path.join(self.directory, f"{_column_stem(column)}.arrow")
+
+    def partial_path(self, column: str) -> str:
+        return os.path.join(self.directory, f"{_column_stem(column)}.csv{PARTIAL_SUFFIX}")
+
+    def writer(self, output_path: str, source_path: str, columns: List[str], total_rows: int,
+               output_format: str = "csv", run_key: Optional[Dict[str, Any]] = None,
+               job_id: Optional[str] = None) -> "ColumnStoreWriter":
+        """Return a writer storing the `columns` of a run instead of the whole output"""
+        return ColumnStoreWriter(self, output_path, source_path, columns, total_rows, output_format, run_key, job_id)
+
+    def record(self, columns: List[str], source_path: str, rows: int, output_format: str,
+               job_id: Optional[str]) -> Dict[str, Any]:
+        """Add freshly written column files to the manifest and return it
+
+        Columns stored for a different upload (or version of it) are dropped.
+        """
+        source = source_fingerprint(source_path)
+        with _manifest_lock:
+            manifest = self.manifest()
+            if manifest is None or manifest["source"] != source or manifest["rows"] != rows:
+                for entry in (manifest or {}).get("columns", {}).values():
+                    if entry["column"] not in columns:
+                        try:
+                            os.remove(os.path.join(self.directory, entry["file"]))
+                        except OSError:
+                            pass
+                manifest = {"result": self.name, "source": source, "rows": rows, "columns": {}, "version": 0}
+            now = time.time()
+            for column in columns:
+                file = os.path.basename(self.column_path(column))
+                previous = manifest["columns"].get(column)
+                if previous is not None and previous["file"] != file:
+                    # Stored in an earlier format
+                    try:
+                        os.remove(os.path.join(self.directory, previous["file"]))
+                    except OSError:
+                        pass
+                manifest["columns"][column] = {"column": column, "file": file, "job_id": job_id, "updated_at": now}
+            manifest["format"] = output_format
+            manifest["version"] += 1
+            manifest["updated_at"] = now
+            write_json_atomic(self.manifest_path, manifest)
+        return manifest
+
+    def iter_merged(self, partial: Optional[Dict[str, Any]] = None,
+                    output_format: Optional[str] = None) -> Iterator[bytes]:
+        """Yield the upload with the stored columns swapped in, as CSV or JSON lines
+
+        With the progress marker of a running job as `partial`, the columns it
+        is writing are read from their partial files and only its completed
+        rows are included. The format is the job's unless `output_format` is given.
+        """
+        manifest = self.manifest()
+        if partial is not None:
+            source_path = partial["run_key"]["input_path"]
+            rows = partial["rows_complete"]
+            output_format = output_format or partial["format"]
+        elif manifest is not None:
+            source_path = manifest["source"]["path"]
+            rows = manifest["rows"]
+            output_format = output_format or manifest.get("format", "csv")
+        else:
+            raise FileNotFoundError(f"No stored columns for '{self.name}'")
+
+        if not os.path.exists(source_path):
+            raise StaleStoreError(f"The upload of '{self.name}' was removed or replaced")
+        paths: Dict[str, str] = {}
+        if manifest is not None:
+            if not os.path.exists(source_path) or source_fingerprint(source_path) != manifest["source"]:
+                if partial is None:
+                    raise StaleStoreError(f"The upload of '{self.name}' was removed or replaced")
+            else:
+                paths.update({entry["column"]: os.path.join(self.directory, entry["file"])
+                              for entry in manifest["columns"].values()})
+        if partial is not None:
+            paths.update({column: self.partial_path(column) for column in partial["columns"]})
+        # E.g. removed by retention, or a run that crashed before writing them
+        missing = [column for column, path in paths.items() if not os.path.exists(path)]
+        if missing:
+            raise StaleStoreError(f"Stored columns of '{self.name}' are missing: {', '.join(missing)}")
+
+        output_format = "csv" if output_format == "parquet" else output_format or "csv"
+        as_text = output_format == "csv"
+        # Partial files of a job that hasn't finished a row range yet are still empty
+        readers = {column: _column_chunks(path, MERGE_CHUNK_ROWS) for column, path in paths.items()
+                   if os.path.getsize(path)}
+        offset = 0
+        for chunk in _read_text(source_path, MERGE_CHUNK_ROWS, as_text):
+            if offset and offset >= rows:
+                break
+            chunk = chunk.iloc[:rows - offset]
+            for column, reader in readers.items():
+                values = next(reader, None)
+                if values is None or column not in chunk.columns:
+                    continue
+                values = values.iloc[:len(chunk)]
+                if not as_text:
+                    values = values.where(values != "", None)
+                chunk[column] = values.to_numpy()
+            yield _chunk_bytes(chunk, output_format, offset == 0)
+            offset += len(chunk)
+
+    def materialize(self, output_path: str) -> Iterator[bytes]:
+        """Yield the merged result while writing it to `output_path`, which then serves as its cache
+
+        The cache is only kept if the whole file was produced and no column
+        changed in the meantime. Parquet can't be streamed while it is being
+        merged, so it is written completely before its bytes are yielded.
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            raise FileNotFoundError(f"No stored columns for '{self.name}'")
+        version = manifest["version"]
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if manifest.get("format") == "parquet":
+                csv_path = f"{tmp_path}.csv"
+                with open(csv_path, "wb") as f:
+                    for data in self.iter_merged(output_format="csv"):
+                        f.write(data)
+                write_frame(pd.read_csv(csv_path, float_precision="round_trip"), tmp_path, "parquet")
+                os.remove(csv_path)
+                with open(tmp_path, "rb") as f:
+                    while data := f.read(1 << 16):
+                        yield data
+            else:
+                with open(tmp_path, "wb") as f:
+                    for data in self.iter_merged():
+                        f.write(data)
+                        yield data
+            current = self.manifest()
+            if current is not None and current["version"] == version:
+                os.replace(tmp_path, output_path)
+        finally:
+            for path in (tmp_path, f"{tmp_path}.csv"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def touch(self) -> None:
+        """Mark the stored columns as used now, for least-recently-used eviction"""
+        touch(self.manifest_path)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def invalidate_cache(output_path: str) -> None:
+    """Remove the merged file cached for a result (plain or compressed)"""
+    for path in (output_path, compressed_path_for(output_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ColumnStoreWriter:
+    """Appends the processed columns of finished row ranges to the store and records them when done
+
+    Has the interface of IncrementalOutputWriter. Every column is appended
+    to its CSV partial file and the progress marker of the output records
+    how many rows (and bytes of each partial file) are complete, so partial
+    downloads and resuming an interrupted run work as with whole files.
+    Committing converts the partial files to the store's Arrow files.
+    """
+
+    def __init__(self, store: ColumnStore, output_path: str, source_path: str, columns: List[str],
+                 total_rows: int, output_format: str = "csv", run_key: Optional[Dict[str, Any]] = None,
+                 job_id: Optional[str] = None):
+        self.store = store
+        self.output_path = output_path
+        self.progress_path = progress_path_for(output_path)
+        self.source_path = source_path
+        self.columns = columns
+        self.total_rows = total_rows
+        self.output_format = output_format
+        self.run_key = run_key or {}
+        self.job_id = job_id
+        self.rows_complete = 0
+        self.column_bytes = {column: 0 for column in columns}
+
+    def _partial_path(self, column: str) -> str:
+        return self.store.partial_path(column)
+
+    def start(self, resume: bool = False) -> int:
+        """Prepare the partial column files and return the first row that still has to be written"""
+        os.makedirs(self.store.directory, exist_ok=True)
+        progress = read_progress(self.output_path)
+        if (resume and progress and not progress.get("complete") and progress.get("run_key") == self.run_key
+                and progress.get("columns") == self.columns
+                and all(os.path.exists(self._partial_path(column)) for column in self.columns)):
+            self.rows_complete = progress["rows_complete"]
+            self.column_bytes = dict(progress["column_bytes"])
+            # Drop anything written after the last complete row range
+            for column in self.columns:
+                with open(self._partial_path(column), "r+b") as f:
+                    f.truncate(self.column_bytes[column])
+        else:
+            self.rows_complete = 0
+            for column in self.columns:
+                open(self._partial_path(column), "wb").close()
+                self.column_bytes[column] = 0
+        self._write_progress(complete=False)
+        return self.rows_complete
+
+    def append(self, rows: pd.DataFrame) -> None:
+        """Append the processed columns of the next range of finished rows"""
+        for column in self.columns:
+            data = rows[[column]].to_csv(header=self.column_bytes[column] == 0, index=False)
+            with open(self._partial_path(column), "ab") as f:
+                f.write(data.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                self.column_bytes[column] = f.tell()
+        self.rows_complete += len(rows)
+        self._write_progress(complete=False)
+
+    def commit(self, df: pd.DataFrame) -> None:
+        """Convert the finished column files, record them and drop the stale merged file"""
+        for column in self.columns:
+            _convert_partial(self._partial_path(column), self.store.column_path(column), column)
+        self.store.record(self.columns, self.source_path, self.total_rows, self.output_format, self.job_id)
+        invalidate_cache(self.output_path)
+        self._write_progress(complete=True)
+
+    def _write_progress(self, complete: bool) -> None:
+        write_json_atomic(self.progress_path, {
+            "rows_complete": self.rows_complete,
+            "bytes_complete": 0,
+            "total_rows": self.total_rows,
+            "format": self.output_format,
+            "complete": complete,
+            "updated_at": time.time(),
+            "run_key": self.run_key,
+            "store": self.store.name,
+            "columns": self.columns,
+            "column_bytes": self.column_bytes,
+        })
@@ -0,0 +1,120 @@
+from typing import Dict, List, Any, Optional
+
+from backend.app.services.cascade import validate_cascade
+from backend.app.services.constraints import validate_constraints
+from backend.app.services.context_limits import validate_context_limits
+from backend.app.services.job_profiler import PROFILE_MODES
+from backend.app.services.prompts import REPLY_FORMATS
+from backend.app.services.row_filter import validate_row_filters
+
+# Top-level keys understood by CSVEnhancer
+KNOWN_KEYS = {
+    "column_context",
+    "batch_sizes",
+    "ignore_valued_columns",
+    "transformation_instructions",
+    "token_budget",
+    "concurrency",
+    "weight",
+    "compact_dtypes",
+    "output_format",
+    "chunk_rows",
+    "use_cache",
+    "request_timeout",
+    "max_retries",
+    "hedge_requests",
+    "hedge_max_ratio",
+    "output_constraints",
+    "constraint_retries",
+    "row_filters",
+    "model_cascade",
+    "reply_format",
+    "context_limits",
+    "profiling",
+}
+
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+
+def validate_config(config: Any, columns: Optional[List[str]] = None) -> List[str]:
+    """Check an enhancement configuration and return a list of problems (empty if valid)
+
+    When `columns` is given, context columns are also checked against the file's header.
+    """
+    if not isinstance(config, dict):
+        return ["Configuration must be a JSON object"]
+
+    errors = []
+    for key in config:
+        if key not in KNOWN_KEYS:
+            errors.append(f"Unknown configuration key '{key}'")
+
+    column_context = config.get("column_context")
+    if not isinstance(column_context, dict):
+        errors.append("'column_context' must be an object mapping columns to lists of context columns")
+        column_context = {}
+
+    for column, fields in column_context.items():
+        if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+            errors.append(f"Context of column '{column}' must be a list of column names")
+        elif columns is not None:
+            for field in fields:
+                if field not in columns:
+                    errors.append(f"Context column '{field}' of '{column}' is not in the file")
+
+    for key, expected in (("batch_sizes", int), ("ignore_valued_columns", bool),
+                          ("transformation_instructions", str)):
+        values = config.get(key, {})
+        if not isinstance(values, dict):
+            errors.append(f"'{key}' must be an object keyed by column")
+            continue
+        for column, value in values.items():
+            if column not in column_context:
+                errors.append(f"'{key}' has an entry for '{column}', which is not in 'column_context'")
+            if not isinstance(value, expected) or (expected is int and (isinstance(value, bool) or value < 1)):
+                errors.append(f"'{key}.{column}' must be a {'positive integer' if expected is int else expected.__name__}")
+
+    for key in ("token_budget", "concurrency", "chunk_rows"):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            errors.append(f"'{key}' must be a positive integer")
+
+    for key in ("max_retries", "constraint_retries"):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            errors.append(f"'{key}' must be a non-negative integer")
+
+    constraints = config.get("output_constraints", {})
+    if not isinstance(constraints, dict):
+        errors.append("'output_constraints' must be an object keyed by column")
+        constraints = {}
+    for column, spec in constraints.items():
+        if column not in column_context:
+            errors.append(f"'output_constraints' has an entry for '{column}', which is not in 'column_context'")
+        errors.extend(validate_constraints(column, spec))
+
+    for key in ("weight", "request_timeout"):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            errors.append(f"'{key}' must be a positive number")
+
+    ratio = config.get("hedge_max_ratio")
+    if ratio is not None and (not isinstance(ratio, (int, float)) or isinstance(ratio, bool) or not 0 <= ratio <= 1):
+        errors.append("'hedge_max_ratio' must be a number between 0 and 1")
+
+    for key in ("use_cache", "compact_dtypes", "hedge_requests"):
+        if key in config and not isinstance(config[key], bool):
+            errors.append(f"'{key}' must be true or false")
+
+    errors.extend(validate_row_filters(config, columns))
+    errors.extend(validate_cascade(config))
+    errors.extend(validate_context_limits(config, columns))
+
+    if config.get("output_format", "csv") not in OUTPUT_FORMATS:
+        errors.append(f"'output_format' must be one of: {', '.join(OUTPUT_FORMATS)}")
+    if config.get("reply_format", "objects") not in REPLY_FORMATS:
+        errors.append(f"'reply_format' must be one of: {', '.join(REPLY_FORMATS)}")
+    if config.get("profiling") is not None and config["profiling"] not in PROFILE_MODES:
+        errors.append(f"'profiling' must be one of: {', '.join(PROFILE_MODES)}")
+
+    return errors
@@ -0,0 +1,93 @@
+import re
+from typing import Dict, List, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Keys of a column's entry in `output_constraints`
+CONSTRAINT_KEYS = ("enum", "regex", "min", "max", "max_length", "dtype", "allow_empty")
+
+# Types a value can be required to parse as
+CONSTRAINT_DTYPES = ("int", "float", "bool", "str")
+
+# Re-queue rounds per column and row range when a config doesn't set `constraint_retries`
+DEFAULT_CONSTRAINT_RETRIES = 2
+
+BOOL_VALUES = ("true", "false")
+
+# Pandas is only imported when values are checked, so validating a config from
+# the command line stays fast
+
+
+def find_violations(values: "pd.Series", spec: Dict[str, Any]) -> "pd.Series":
+    """Return the first constraint each value breaks as a message, or None where it passes
+
+    All checks are vectorized over the whole series. Empty values fail unless
+    `allow_empty` is set; the other checks only apply to non-empty values.
+    """
+    import pandas as pd
+
+    text = values.astype(object).where(values.notna(), "").astype(str).str.strip()
+    present = text != ""
+    messages = pd.Series(None, index=values.index, dtype=object)
+
+    def flag(mask: "pd.Series", message: str) -> None:
+        messages[mask & messages.isna()] = message
+
+    if not spec.get("allow_empty", False):
+        flag(~present, "the value is empty")
+
+    dtype = spec.get("dtype")
+    numbers = pd.to_numeric(text.where(present), errors="coerce")
+    if dtype == "int":
+        flag(present & (numbers.isna() | (numbers % 1 != 0)), "the value must be a whole number")
+    elif dtype == "float":
+        flag(present & numbers.isna(), "the value must be a number")
+    elif dtype == "bool":
+        flag(present & ~text.str.lower().isin(BOOL_VALUES), "the value must be true or false")
+
+    if "enum" in spec:
+        allowed = [str(value) for value in spec["enum"]]
+        flag(present & ~text.isin(allowed), f"the value must be one of: {', '.join(allowed)}")
+    if "regex" in spec:
+        matches = text.str.fullmatch(spec["regex"]).fillna(False).astype(bool)
+        flag(present & ~matches, f"the value must match the pattern {spec['regex']}")
+    if "max_length" in spec:
+        flag(present & (text.str.len() > spec["max_length"]),
+             f"the value must be at most {spec['max_length']} characters long")
+    if "min" in spec or "max" in spec:
+        flag(present & numbers.isna(), "the value must be a number")
+        if "min" in spec:
+            flag(present & (numbers < spec["min"]), f"the value must be at least {spec['min']}")
+        if "max" in spec:
+            flag(present & (numbers > spec["max"]), f"the value must be at most {spec['max']}")
+    return messages
+
+
+def validate_constraints(column: str, spec: Any) -> List[str]:
+    """Check one column's `output_constraints` entry and return a list of problems"""
+    if not isinstance(spec, dict):
+        return [f"'output_constraints.{column}' must be an object"]
+
+    errors = []
+    for key in spec:
+        if key not in CONSTRAINT_KEYS:
+            errors.append(f"Unknown constraint '{key}' for column '{column}'")
+    if "enum" in spec and (not isinstance(spec["enum"], list) or not spec["enum"]):
+        errors.append(f"'output_constraints.{column}.enum' must be a non-empty list")
+    if "regex" in spec:
+        try:
+            re.compile(spec["regex"])
+        except (re.error, TypeError) as e:
+            errors.append(f"'output_constraints.{column}.regex' is not a valid pattern: {e}")
+    for key in ("min", "max"):
+        if key in spec and (not isinstance(spec[key], (int, float)) or isinstance(spec[key], bool)):
+            errors.append(f"'output_constraints.{column}.{key}' must be a number")
+    max_length = spec.get("max_length")
+    if max_length is not None and (not isinstance(max_length, int) or isinstance(max_length, bool) or max_length < 1):
+        errors.append(f"'output_constraints.{column}.max_length' must be a positive integer")
+    if "dtype" in spec and spec["dtype"] not in CONSTRAINT_DTYPES:
+        errors.append(f"'output_constraints.{column}.dtype' must be one of: {', '.join(CONSTRAINT_DTYPES)}")
+    if "allow_empty" in spec and not isinstance(spec["allow_empty"], bool):
+        errors.append(f"'output_constraints.{column}.allow_empty' must be true or false")
+    return errors
@@ -0,0 +1,149 @@
+import html
+import re
+from typing import Dict, List, Any, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Context limits compact the values of context fields before they go into prompts:
+#   "context_limits": {
+#       "Description": {"max_chars": 300, "strip_html": true},
+#       "Notes": {"max_tokens": 50, "truncate": "head"}
+#   }
+# Whitespace runs are collapsed to single spaces unless "strip_whitespace" is
+# false. Values longer than the limit keep their head and tail around an
+# ellipsis ("head_tail", the default) or only their head ("head"). The same
+# limit is applied vectorized to DataFrames and to single CSV values (for `plan`).
+
+# Pandas is only imported when limiting a DataFrame, so planning a CSV file
+# from the command line stays fast
+
+LIMIT_KEYS = {"max_chars", "max_tokens", "strip_html", "strip_whitespace", "truncate"}
+TRUNCATE_MODES = ("head_tail", "head")
+
+# Put between the head and tail of a value truncated in the middle
+ELLIPSIS = " … "
+
+# Share of a truncated value's characters taken from its head
+HEAD_SHARE = 2 / 3
+
+# ~4 characters per token
+CHARS_PER_TOKEN = 4
+
+_TAG_PATTERN = re.compile(r"<[^>]*>")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class ContextLimit:
+    """Compaction of the values of one context field"""
+
+    def __init__(self, field: str, spec: Dict[str, Any]):
+        self.field = field
+        max_chars = spec.get("max_chars")
+        if max_chars is None and spec.get("max_tokens") is not None:
+            max_chars = spec["max_tokens"] * CHARS_PER_TOKEN
+        self.max_chars: Optional[int] = max_chars
+        self.strip_html = spec.get("strip_html", False)
+        self.strip_whitespace = spec.get("strip_whitespace", True)
+        self.truncate = spec.get("truncate", "head_tail")
+        # Characters kept from the head and tail of values over the limit
+        self.head = self.tail = 0
+        if self.max_chars is not None:
+            if self.truncate == "head_tail" and self.max_chars > len(ELLIPSIS) + 1:
+                kept = self.max_chars - len(ELLIPSIS)
+                self.head = max(1, int(kept * HEAD_SHARE))
+                self.tail = kept - self.head
+            else:
+                self.head = self.max_chars
+
+    def apply(self, values: "pd.Series") -> "pd.Series":
+        """Return the limited values of a Series (missing values stay missing)"""
+        present = values.notna()
+        text = values[present].astype(str)
+        if self.strip_html:
+            text = text.str.replace(_TAG_PATTERN, " ", regex=True)
+            entities = text.str.contains("&", regex=False)
+            if entities.any():
+                text = text.where(~entities, text[entities].map(html.unescape))
+        if self.strip_whitespace:
+            text = text.str.replace(_WHITESPACE_PATTERN, " ", regex=True).str.strip()
+        if self.max_chars is not None:
+            over = text.str.len() > self.max_chars
+            if over.any():
+                long = text[over]
+                shortened = long.str[:self.head]
+                if self.tail:
+                    shortened = shortened + ELLIPSIS + long.str[-self.tail:]
+                text = text.where(~over, shortened)
+        result = values.astype(object)
+        result[present] = text
+        return result
+
+    def apply_text(self, value: str) -> str:
+        """Return one limited value"""
+        if self.strip_html:
+            value = _TAG_PATTERN.sub(" ", value)
+            if "&" in value:
+                value = html.unescape(value)
+        if self.strip_whitespace:
+            value = _WHITESPACE_PATTERN.sub(" ", value).strip()
+        if self.max_chars is not None and len(value) > self.max_chars:
+            value = value[:self.head] + (ELLIPSIS + value[-self.tail:] if self.tail else "")
+        return value
+
+    def limit_length(self, length: float) -> float:
+        """Cap an (average) value length at the limit, for planning from an upload profile"""
+        return min(length, self.max_chars) if self.max_chars is not None else length
+
+
+def parse_context_limits(config: Dict[str, Any]) -> Dict[str, ContextLimit]:
+    """Parse the `context_limits` of a config, keyed by the context field they compact"""
+    return {field: ContextLimit(field, spec) for field, spec in config.get("context_limits", {}).items()}
+
+
+def apply_context_limits(df: "pd.DataFrame", limits: Dict[str, ContextLimit], fields: List[str],
+                         index: Optional["pd.Index"] = None) -> None:
+    """Compact the `fields` of df that have a limit in place, only in the rows of `index` if given"""
+    for field in fields:
+        if field not in limits or field not in df.columns:
+            continue
+        if index is None:
+            df[field] = limits[field].apply(df[field])
+        else:
+            df[field] = df[field].astype(object)
+            df.loc[index, field] = limits[field].apply(df.loc[index, field])
+
+
+def validate_context_limits(config: Dict[str, Any], columns: Optional[List[str]] = None) -> List[str]:
+    """Check the `context_limits` of a config and return a list of problems"""
+    limits = config.get("context_limits", {})
+    if not isinstance(limits, dict):
+        return ["'context_limits' must be an object keyed by context column"]
+
+    column_context = config.get("column_context")
+    context_fields = {field for fields in (column_context.values() if isinstance(column_context, dict) else [])
+                      if isinstance(fields, list) for field in fields}
+    errors = []
+    for field, spec in limits.items():
+        name = f"context_limits.{field}"
+        if field not in context_fields:
+            errors.append(f"'context_limits' has an entry for '{field}', which is not a context column")
+        elif columns is not None and field not in columns:
+            errors.append(f"Context limit of '{field}' is for a column that is not in the file")
+        if not isinstance(spec, dict):
+            errors.append(f"'{name}' must be an object")
+            continue
+        for key in sorted(set(spec) - LIMIT_KEYS):
+            errors.append(f"Unknown key '{key}' in '{name}'")
+        if "max_chars" in spec and "max_tokens" in spec:
+            errors.append(f"'{name}' may set 'max_chars' or 'max_tokens', not both")
+        for key in ("max_chars", "max_tokens"):
+            value = spec.get(key)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                errors.append(f"'{name}.{key}' must be a positive integer")
+        for key in ("strip_html", "strip_whitespace"):
+            if key in spec and not isinstance(spec[key], bool):
+                errors.append(f"'{name}.{key}' must be true or false")
+        if spec.get("truncate", "head_tail") not in TRUNCATE_MODES:
+            errors.append(f"'{name}.truncate' must be one of: {', '.join(TRUNCATE_MODES)}")
+    return errors
@@ -1,49 +1,633 @@
 import pandas as pd
-from openai import OpenAI
 import json
+import os
+import threading
 import time
-from typing import Dict, List, Any
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Iterator, Tuple
 
-from backend.app.core.config import OPENAI_API_KEY, OPENAI_MODEL
+from backend.app.core.config import OPENAI_MODEL, BATCH_DIR, BATCH_POLL_SECONDS
+from backend.app.services.row_filter import parse_row_filters
+from backend.app.services.context_limits import apply_context_limits, parse_context_limits
+from backend.app.services.cascade import CascadeStats, cascade_tiers, logprob_confidences, response_logprobs
+from backend.app.services.constraints import DEFAULT_CONSTRAINT_RETRIES, find_violations
+from backend.app.services.batch_backend import BatchBackend, FINISHED_STATES, create_batch_backend, request_line
+from backend.app.services.llm_client import create_client
+from backend.app.services.planner import (
+    pending_mask, average_entry_chars, batch_size_for, dependency_stages, profile_entry_chars, is_complete,
+    DEFAULT_TOKEN_BUDGET
+)
+from backend.app.services.response_cache import ResponseCache, get_response_cache
+from backend.app.services.sampling import stratified_sample
+from backend.app.services.scheduler import FairShareScheduler, get_scheduler
+from backend.app.services.dispatch import RequestDispatcher
+from backend.app.services.output_writer import IncrementalOutputWriter
+from backend.app.services.column_store import ColumnStore
+from backend.app.services.pipeline import Pipeline, PipelineStats
+from backend.app.services.job_profiler import StageTimers, job_profile, profile_registry
+from backend.app.services.prompts import DEFAULT_REPLY_FORMAT, PromptTemplate, PromptCacheStats
+from backend.app.utils.frame_utils import read_csv_compact
+
+# Completion budget requested for every batch
+MAX_COMPLETION_TOKENS = 1000
+
+# Rows processed through all columns before they are appended to the output
+DEFAULT_CHUNK_ROWS = 2000
 
 class CSVEnhancer:
     """Service for enhancing CSV files using OpenAI"""
     
-    def __init__(self, config: Dict[str, Any]):
-        """Initialize the CSV enhancer with a configuration"""
+    def __init__(self, config: Dict[str, Any], job_id: Optional[str] = None, tenant: str = "default",
+                 priority: str = "bulk", scheduler: Optional[FairShareScheduler] = None,
+                 cache: Optional[ResponseCache] = None, profile: Optional[Dict[str, Any]] = None):
+        """Initialize the CSV enhancer with a configuration and, optionally, the input's upload profile"""
         self.config = config
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.profile = profile
+        self.client = create_client()
+        self.job_id = job_id or uuid.uuid4().hex
+        self.tenant = tenant
+        self.priority = priority
+        self.scheduler = scheduler or get_scheduler()
+        self.scheduler_stats = None
+        self.cache = cache or get_response_cache()
+        self.use_cache = config.get("use_cache", True)
+        # Per-job counters, updated from the batch threads
+        self.stats = {"requests": 0, "cache_hits": 0, "cache_misses": 0, "parse_errors": 0}
+        self._stats_lock = threading.Lock()
+        # Number of batches of this job that may wait for / hold a scheduler slot at once
+        self.concurrency = max(1, int(config.get("concurrency", 1)))
+        # Deadlines, retries and hedging of the model requests
+        self.dispatcher = RequestDispatcher(self.client, self.scheduler, self.job_id, config)
+        # Output constraints per column and the pass/fail counts of their checks
+        self.constraints = config.get("output_constraints", {})
+        self.constraint_retries = int(config.get("constraint_retries", DEFAULT_CONSTRAINT_RETRIES))
+        self.validation: Dict[str, Dict[str, int]] = {}
+        # Per-column row filters; masks are evaluated once per loaded frame
+        self.row_filters = parse_row_filters(config)
+        self._row_masks: Optional[Tuple[int, Dict[str, Any]]] = None
+        self.row_filter_matches: Dict[str, int] = {}
+        # Per-field compaction of context values (whitespace, HTML, length)
+        self.context_limits = parse_context_limits(config)
+        # Models tried cheapest first; answers below a tier's confidence threshold go to the next tier
+        self.tiers = cascade_tiers(config)
+        self.cascade_stats = CascadeStats(self.tiers)
+        self.cache_model = "+".join(tier["model"] for tier in self.tiers)
+        # Busy/starved/blocked time of the render, dispatch, parse and write stages
+        self.pipeline_stats = PipelineStats()
+        # Wall time of loading, planning, constraint checks and output, and the opt-in profile of the run
+        self.timers = StageTimers()
+        self.profiling = config.get("profiling")
+        # Batch prompts per (column, asks for confidence) and how much of them the provider served from its cache
+        self.reply_format = config.get("reply_format", DEFAULT_REPLY_FORMAT)
+        self._templates: Dict[Tuple[str, bool], PromptTemplate] = {}
+        self.prompt_cache = PromptCacheStats()
+        
+    @contextmanager
+    def scheduled(self):
+        """Register the job with the request scheduler for the duration of the block"""
+        self.scheduler.register_job(self.job_id, self.tenant, self.priority,
+                                    float(self.config.get("weight", 1.0)))
+        try:
+            yield
+        finally:
+            self.dispatcher.close()
+            self.scheduler_stats = self.scheduler.unregister_job(self.job_id)
+        
+    def profiled(self):
+        """Attribute the calling thread's work to the job for the duration of the block (see job_profiler)
+        
+        With the "profiling" config key, the job is profiled while the block runs.
+        """
+        return job_profile(self.job_id, self.profiling, self.stage_timings)
+        
+    def stage_timings(self) -> Dict[str, Dict[str, float]]:
+        """Return the calls and seconds of every stage of the job so far"""
+        timings = {name: {"calls": stage["items"], "seconds": stage["busy_seconds"]}
+                   for name, stage in self.pipeline_stats.summary()["stages"].items()}
+        timings.update(self.timers.summary())
+        return timings
+        
+    def process_file(self, input_path: str, output_path: str, resume: bool = False,
+                     store: Optional[ColumnStore] = None) -> Dict[str, Any]:
+        """Process the CSV file according to the configuration
+        
+        Rows are processed in chunks through every column and each finished
+        chunk is appended to `<output>.partial`, which is renamed to the output
+        at the end. With `resume`, a run with the same input and configuration
+        continues after the rows an interrupted run already wrote. With a
+        column `store`, only the processed columns are written, to the store;
+        the output is merged from it when it is needed.
+        """
+        with self.profiled():
+            # Load the dataset with compact dtypes; enhanced columns keep their default dtypes
+            df, memory = self.load_dataset(input_path)
+            print(f"Loaded {len(df)} rows using {memory['after_bytes'] / 1e6:.1f} MB "
+                  f"({memory['before_bytes'] / 1e6:.1f} MB with default dtypes)")
+            processed_columns = self._columns_to_process(df)
+            self._prepare_row_filters(df)
+        
+            writer = self._output_writer(input_path, output_path, processed_columns, len(df), store)
+            start_row = writer.start(resume)
+            if start_row:
+                print(f"Resuming after {start_row} rows already written")
+            chunk_rows = max(1, int(self.config.get("chunk_rows", DEFAULT_CHUNK_ROWS)))
+        
+            with self.scheduled():
+                for start in range(start_row, len(df), chunk_rows):
+                    stop = min(start + chunk_rows, len(df))
+                    # Process each column
+                    for column in processed_columns:
+                        self._process_column(df, column, start, stop)
+                    with self.timers.time("output"):
+                        writer.append(df.iloc[start:stop])
+                    print(f"Completed rows {start + 1}-{stop} of {len(df)}")
+        
+            # Move the complete output into place
+            with self.timers.time("output"):
+                writer.commit(df)
+            print(f"Processing complete. Saved {'the columns of' if store else 'as'} '{output_path}'")
+        
+        return {
+            "job_id": self.job_id,
+            "rows": len(df),
+            "resumed_from_row": start_row,
+            "processed_columns": processed_columns,
+            "memory": memory,
+            "row_filter_matches": self.row_filter_matches,
+            "stats": dict(self.stats),
+            "validation": self.validation,
+            "cascade": self.cascade_stats.summary(),
+            "prompt_cache": self.prompt_cache.summary(),
+            "pipeline": self.pipeline_stats.summary(),
+            "timings": self.timers.summary(),
+            "dispatch": self.dispatcher.summary(),
+            "scheduler": self.scheduler_stats,
+            "profile": self._profile_summary()
+        }
+        
+    def preview(self, input_path: str, sample_size: int = 20) -> Dict[str, Any]:
+        """Run the configured columns on a stratified sample and return the changed cells
+        
+        Answers go into the response cache, so a following full run with the
+        same configuration reuses them instead of asking the model again.
+        """
+        started = time.time()
+        df, _ = self.load_dataset(input_path)
+        sample = stratified_sample(df, self.config, sample_size)
+        before = sample.copy()
+        processed_columns = [c for c in self.config["column_context"] if c in sample.columns]
+        
+        with self.profiled(), self.scheduled():
+            for column in processed_columns:
+                self._process_column(sample, column)
+        
+        changes = []
+        for column in processed_columns:
+            old, new = before[column], sample[column]
+            changed = (old.astype(str) != new.astype(str)) & ~(old.isna() & new.isna())
+            for df_idx in sample.index[changed.to_numpy()]:
+                changes.append({
+                    "row": int(df.index.get_loc(df_idx)),
+                    "column": column,
+                    "before": _plain(old.at[df_idx]),
+                    "after": _plain(new.at[df_idx]),
+                })
+        
+        return {
+            "job_id": self.job_id,
+            "rows": len(df),
+            "sample_rows": [int(df.index.get_loc(df_idx)) for df_idx in sample.index],
+            "processed_columns": processed_columns,
+            "changes": changes,
+            "elapsed_seconds": time.time() - started,
+            "stats": dict(self.stats),
+            "validation": self.validation,
+            "cascade": self.cascade_stats.summary(),
+            "prompt_cache": self.prompt_cache.summary(),
+            "pipeline": self.pipeline_stats.summary(),
+            "timings": self.timers.summary(),
+            "dispatch": self.dispatcher.summary(),
+            "scheduler": self.scheduler_stats,
+            "profile": self._profile_summary()
+        }
+        
+    def process_file_batch(self, input_path: str, output_path: str, backend: Optional[BatchBackend] = None,
+                           poll_seconds: float = BATCH_POLL_SECONDS,
+                           store: Optional[ColumnStore] = None) -> Dict[str, Any]:
+        """Process the CSV file offline through a batch backend instead of live requests
+        
+        All batches of the columns in a stage are rendered to one JSONL request
+        file, submitted and polled until the backend is done; the results go
+        through the same parser and write-back as live answers. A column whose
+        context includes an earlier enhanced column runs in a later stage, so
+        it sees the enhanced values just like in `process_file`. Requests don't
+        take scheduler slots, so batch jobs don't compete with live traffic.
+        With a column `store`, the output is written as in `process_file`.
+        """
+        with self.profiled():
+            backend = backend or create_batch_backend()
+            df, memory = self.load_dataset(input_path)
+            print(f"Loaded {len(df)} rows using {memory['after_bytes'] / 1e6:.1f} MB "
+                  f"({memory['before_bytes'] / 1e6:.1f} MB with default dtypes)")
+            processed_columns = self._columns_to_process(df)
+            self._prepare_row_filters(df)
+        
+            os.makedirs(BATCH_DIR, exist_ok=True)
+            stages = []
+            for number, columns in enumerate(dependency_stages(processed_columns, self.config["column_context"])):
+                path_prefix = os.path.join(BATCH_DIR, f"{self.job_id}-stage{number + 1}")
+                stages.extend(self._run_batch_cascade(df, columns, backend, poll_seconds, path_prefix))
+            
+                # Send cells that break their column's constraints again, as one more batch per round
+                checked = [column for column in columns if column in self.constraints]
+                for attempt in range(self.constraint_retries):
+                    violations = {column: self._check_column(df, column, requeue=True) for column in checked}
+                    violations = {column: failing for column, failing in violations.items() if failing}
+                    if not violations:
+                        break
+                    stages.extend(self._run_batch_cascade(df, list(violations), backend, poll_seconds,
+                                                          f"{path_prefix}-retry{attempt + 1}", violations))
+                for column in checked:
+                    self._check_column(df, column, final=True)
+        
+            writer = self._output_writer(input_path, output_path, processed_columns, len(df), store)
+            with self.timers.time("output"):
+                writer.start(False)
+                writer.append(df)
+                writer.commit(df)
+            print(f"Processing complete. Saved {'the columns of' if store else 'as'} '{output_path}'")
         
-    def process_file(self, input_path: str, output_path: str) -> None:
-        """Process the CSV file according to the configuration"""
-        # Load the dataset
-        df = pd.read_csv(input_path)
+        return {
+            "job_id": self.job_id,
+            "rows": len(df),
+            "processed_columns": processed_columns,
+            "memory": memory,
+            "row_filter_matches": self.row_filter_matches,
+            "stats": dict(self.stats),
+            "validation": self.validation,
+            "cascade": self.cascade_stats.summary(),
+            "prompt_cache": self.prompt_cache.summary(),
+            "timings": self.timers.summary(),
+            "batch": stages,
+            "profile": self._profile_summary()
+        }
         
-        # Process each column
+    def _run_batch_cascade(self, df: pd.DataFrame, columns: List[str], backend: BatchBackend, poll_seconds: float,
+                           path_prefix: str, violations: Optional[Dict[str, Dict[Any, Optional[str]]]] = None
+                           ) -> List[Dict[str, Any]]:
+        """Run a batch stage through the model tiers, re-submitting escalated entries to the next tier"""
+        stages = []
+        fallbacks = None
+        for tier in range(len(self.tiers)):
+            suffix = f"-tier{tier + 1}" if tier else ""
+            stage, violations, fallbacks = self._run_batch_stage(df, columns, backend, poll_seconds,
+                                                                 path_prefix + suffix, violations, tier, fallbacks)
+            stages.append(stage)
+            if not violations:
+                break
+            columns = list(violations)
+        return stages
+        
+    def _run_batch_stage(self, df: pd.DataFrame, columns: List[str], backend: BatchBackend, poll_seconds: float,
+                         path_prefix: str, violations: Optional[Dict[str, Dict[Any, Optional[str]]]] = None,
+                         tier: int = 0, fallbacks: Optional[Dict[str, Dict[Any, Any]]] = None) -> Tuple[Any, ...]:
+        """Send the batches of one stage through the batch backend and write the results to df
+        
+        Returns the stage report and the entries escalated to the next model
+        tier, with the answers to fall back on, per column.
+        """
+        for column in columns:
+            if df[column].dtype != object:
+                df[column] = df[column].astype(object)
+        
+        requests_path = f"{path_prefix}-requests.jsonl"
+        rendered = {}
+        with open(requests_path, "w") as f:
+            for column in columns:
+                column_violations = violations.get(column) if violations else None
+                snapshot, batches = self._plan_batches(df, column, violations=column_violations)
+                for number, batch in enumerate(batches):
+                    batch_render = self._render_batch(snapshot, column, batch, column_violations, tier,
+                                                      fallbacks.get(column) if fallbacks else None)
+                    if batch_render.request is None:
+                        self._write_updates(df, column, batch_render.updates)
+                        continue
+                    custom_id = f"{column}:{number}"
+                    rendered[custom_id] = (column, snapshot, batch_render)
+                    f.write(request_line(custom_id, batch_render.request) + "\n")
+        
+        stage = {"columns": columns, "model": self.tiers[tier]["model"], "requests": len(rendered),
+                 "batch_id": None, "completed": 0, "failed": 0}
+        escalations: Dict[str, Dict[Any, Optional[str]]] = {}
+        next_fallbacks: Dict[str, Dict[Any, Any]] = {}
+        if not rendered:
+            return stage, escalations, next_fallbacks
+        
+        self._count("requests", len(rendered))
+        batch_id = backend.submit(requests_path)
+        stage["batch_id"] = batch_id
+        print(f"Submitted {len(rendered)} requests for {', '.join(columns)} as batch {batch_id}")
+        
+        # Poll quickly at first; long batches settle into the configured interval
+        delay = min(1.0, poll_seconds)
+        status = backend.status(batch_id)
+        while status["status"] not in FINISHED_STATES:
+            time.sleep(delay)
+            delay = min(delay * 2, poll_seconds)
+            status = backend.status(batch_id)
+            print(f"Batch {batch_id}: {status['completed']}/{status['total']} requests done")
+        if status["status"] != "completed":
+            raise RuntimeError(f"Batch {batch_id} ended with status '{status['status']}'")
+        
+        results_path = f"{path_prefix}-results.jsonl"
+        backend.download(batch_id, results_path)
+        with open(results_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                column, snapshot, batch_render = rendered.pop(result["custom_id"], (None, None, None))
+                if batch_render is None:
+                    continue
+                body = (result.get("response") or {}).get("body")
+                if result.get("error") or not body:
+                    stage["failed"] += 1
+                    print(f"Error processing {column} batch. Error: {result.get('error')}")
+                    self._write_updates(df, column, batch_render.with_fallback())
+                    continue
+                stage["completed"] += 1
+                choice = body["choices"][0]
+                result_text = choice["message"]["content"].strip()
+                logprobs = (choice.get("logprobs") or {}).get("content")
+                self._write_updates(df, column, self._apply_result(snapshot, column, batch_render, result_text, logprobs))
+                self.cascade_stats.record(tier, len(batch_render.prompted), len(batch_render.escalate), 0.0,
+                                          body.get("usage"))
+                self.prompt_cache.record(body.get("usage"), batch_render.prefix_chars)
+                if batch_render.escalate:
+                    escalations.setdefault(column, {}).update(batch_render.escalate)
+                    next_fallbacks.setdefault(column, {}).update(batch_render.next_fallback)
+        
+        # Requests without a result line keep their cache hits (and earlier tiers' answers) only
+        for column, _, batch_render in rendered.values():
+            stage["failed"] += 1
+            self._write_updates(df, column, batch_render.with_fallback())
+        return stage, escalations, next_fallbacks
+        
+    @staticmethod
+    def _write_updates(df: pd.DataFrame, column: str, updates: Dict[Any, Any]) -> None:
+        for df_idx, value in updates.items():
+            df.at[df_idx, column] = value
+        
+    def _prepare_row_filters(self, df: pd.DataFrame) -> None:
+        """Evaluate every column's row filter once over the whole frame"""
+        masks = {column: row_filter.mask(df).to_numpy() for column, row_filter in self.row_filters.items()}
+        self._row_masks = (id(df), masks)
+        for column, mask in masks.items():
+            self.row_filter_matches[column] = int(mask.sum())
+            print(f"Row filter of column {column} matches {self.row_filter_matches[column]} of {len(df)} rows")
+        
+    def _row_mask(self, df: pd.DataFrame, column: str, start: int = 0, stop: Optional[int] = None) -> Optional[Any]:
+        """Return the row filter mask of `column` for row positions [start, stop), or None without a filter"""
+        if column not in self.row_filters:
+            return None
+        if self._row_masks is not None and self._row_masks[0] == id(df):
+            return self._row_masks[1][column][start:stop]
+        return self.row_filters[column].mask(df.iloc[start:stop]).to_numpy()
+        
+    def _output_writer(self, input_path: str, output_path: str, columns: List[str], rows: int,
+                       store: Optional[ColumnStore] = None) -> Any:
+        """Return the writer of a run's output: the whole file, or only the processed columns to a store"""
+        output_format = self.config.get("output_format", "csv")
+        run_key = _run_key(input_path, self.config)
+        if store is not None:
+            return store.writer(output_path, input_path, columns, rows, output_format, run_key, self.job_id)
+        return IncrementalOutputWriter(output_path, rows, output_format, run_key=run_key)
+        
+    def _columns_to_process(self, df: pd.DataFrame) -> List[str]:
+        """Return the configured columns present in df, leaving out those the profile shows are complete"""
+        columns = []
         for column in self.config["column_context"]:
-            if column in df.columns:
-                print(f"Processing column: {column}")
-                batch_size = self.config["batch_sizes"].get(column, 10)
-                
-                for i in range(0, len(df), batch_size):
-                    batch = df.iloc[i:i + batch_size]
-                    self._process_batch(df, column, batch)
-                    print(f"Processed {i + len(batch)}/{len(df)} in column {column}")
+            if column not in df.columns:
+                continue
+            # Complete columns still go through their output constraints check
+            if is_complete(column, self.config, self.profile) and column not in self.constraints:
+                print(f"Column {column} has no missing values, skipped")
+                continue
+            columns.append(column)
+        return columns
+        
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += amount
+        
+    def _profile_summary(self) -> Optional[Dict[str, Any]]:
+        """Return the summary of the job's latest profile, if it was profiled"""
+        session = profile_registry.get(self.job_id)
+        return session.summary() if session is not None else None
+        
+    def load_dataset(self, input_path: str) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        """Load a CSV file for this configuration and report its memory use before/after compaction"""
+        with self.timers.time("load"):
+            return read_csv_compact(input_path, exclude=self.config.get("column_context", {}),
+                                    compact=self.config.get("compact_dtypes", True))
+        
+    def _process_column(self, df: pd.DataFrame, column: str, start: int = 0, stop: Optional[int] = None) -> None:
+        """Process every batch of a column in row positions [start, stop) and write the results back"""
+        # Model answers are text; an all-empty column is read as float and would reject them
+        if df[column].dtype != object:
+            df[column] = df[column].astype(object)
+        processed = set()
+        for batch, updates in self.iter_column_updates(df, column, start, stop):
+            self._write_updates(df, column, updates)
+            processed.update(batch.index)
+        if processed:
+            print(f"Processed {len(processed)} rows in column {column}")
+        
+        if column not in self.constraints:
+            return
+        # Re-queue only the cells that break the column's constraints, telling the model why
+        for _ in range(self.constraint_retries):
+            violations = self._check_column(df, column, start, stop, requeue=True)
+            if not violations:
+                break
+            for _, updates in self.iter_column_updates(df, column, start, stop, violations):
+                self._write_updates(df, column, updates)
+        self._check_column(df, column, start, stop, final=True)
+        
+    def _check_column(self, df: pd.DataFrame, column: str, start: int = 0, stop: Optional[int] = None,
+                      requeue: bool = False, final: bool = False) -> Dict[Any, str]:
+        """Check a column's output constraints in row positions [start, stop) and return the failing cells"""
+        values = df[column].iloc[start:stop]
+        # Rows outside the column's row filter pass through unchanged and are not checked
+        row_mask = self._row_mask(df, column, start, stop)
+        if row_mask is not None:
+            values = values[row_mask]
+        with self.timers.time("constraints"):
+            messages = find_violations(values, self.constraints[column])
+        failing = messages.dropna().to_dict()
+        with self._stats_lock:
+            counts = self.validation.setdefault(column, {"checked": 0, "passed": 0, "failed": 0, "requeued": 0})
+            if requeue:
+                counts["requeued"] += len(failing)
+            if final:
+                counts["checked"] += len(messages)
+                counts["passed"] += len(messages) - len(failing)
+                counts["failed"] += len(failing)
+        if final and failing:
+            print(f"{len(failing)} values in column {column} still break its output constraints")
+        return failing
+        
+    def iter_column_updates(self, df: pd.DataFrame, column: str, start: int = 0, stop: Optional[int] = None,
+                            violations: Optional[Dict[Any, str]] = None
+                            ) -> Iterator[Tuple[pd.DataFrame, Dict[Any, Any]]]:
+        """Yield each batch of `column` in row positions [start, stop) with its new values by index
+        
+        With `violations` (messages by index), only those cells are sent, each
+        with the reason its current value was rejected. Entries a model tier
+        escalates are re-batched and sent to the next tier after the pass; the
+        caller applies the values as the pipeline's write stage. Must be called
+        while the job is registered with the scheduler (see `scheduled`).
+        """
+        with self.timers.time("plan"):
+            snapshot, batches = self._plan_batches(df, column, start, stop, violations)
+        fallback: Dict[Any, Any] = {}
+        cache_keys: Dict[Any, str] = {}
+        
+        for tier in range(len(self.tiers)):
+            escalate: Dict[Any, Optional[str]] = {}
+            next_fallback: Dict[Any, Any] = {}
+            for batch, rendered in self._run_pipeline(snapshot, column, batches, violations, tier, fallback, cache_keys):
+                yield batch, rendered.with_fallback()
+                escalate.update(rendered.escalate)
+                next_fallback.update(rendered.next_fallback)
+                cache_keys.update(rendered.cache_keys)
+            if not escalate:
+                break
+            violations, fallback = escalate, next_fallback
+            with self.timers.time("plan"):
+                snapshot, batches = self._plan_batches(df, column, start, stop, escalate)
         
-        # Save the processed file
-        df.to_csv(output_path, index=False)
-        print(f"Processing complete. Saved as '{output_path}'")
+    def _run_pipeline(self, snapshot: pd.DataFrame, column: str, batches: List[pd.DataFrame],
+                      violations: Optional[Dict[Any, Optional[str]]], tier: int, fallback: Dict[Any, Any],
+                      cache_keys: Dict[Any, str]) -> Iterator[Tuple[pd.DataFrame, "RenderedBatch"]]:
+        """Run batches of one model tier through the render, dispatch and parse stages
         
-    def _process_batch(self, df: pd.DataFrame, column_name: str, batch: pd.DataFrame) -> None:
-        """Process a batch of rows for a specific column"""
+        Prompts are rendered ahead by one thread, `concurrency` threads wait on
+        the model and one thread parses the replies; bounded queues between the
+        stages keep only a few batches in memory at a time.
+        """
+        def render(batch: pd.DataFrame) -> Tuple[pd.DataFrame, RenderedBatch]:
+            return batch, self._render_batch(snapshot, column, batch, violations, tier, fallback, cache_keys)
+        
+        def dispatch(item: Tuple[pd.DataFrame, RenderedBatch]) -> Tuple[Any, ...]:
+            batch, rendered = item
+            return (batch, rendered) + self._dispatch_batch(column, rendered)
+        
+        def parse(item: Tuple[Any, ...]) -> Tuple[pd.DataFrame, RenderedBatch]:
+            batch, rendered, response, elapsed = item
+            self._parse_reply(snapshot, column, rendered, response, elapsed)
+            return batch, rendered
+        
+        pipeline = Pipeline([("render", render, 1), ("dispatch", dispatch, self.concurrency), ("parse", parse, 1)],
+                            self.pipeline_stats)
+        return pipeline.run(batches)
+        
+    def _plan_batches(self, df: pd.DataFrame, column: str, start: int = 0, stop: Optional[int] = None,
+                      violations: Optional[Dict[Any, str]] = None) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+        """Split the pending rows (or the rows in `violations`) of `column` in [start, stop) into batches"""
+        frame = df.iloc[start:stop]
+        
+        # Batches read from a snapshot so results can be written to df while others are in flight
+        context_fields = [f for f in self.config["column_context"].get(column, []) if f in df.columns]
+        snapshot = frame[list(dict.fromkeys([column] + context_fields))].copy()
+        if violations is not None:
+            pending = snapshot[snapshot.index.isin(list(violations))]
+        else:
+            mask = pending_mask(snapshot, column, self.config)
+            row_mask = self._row_mask(df, column, start, stop)
+            if row_mask is not None:
+                mask = mask & row_mask
+            pending = snapshot[mask]
+        
+        # Compact the context values of the rows to send, so batches are sized on what goes into the prompts
+        limited = [f for f in context_fields if f in self.context_limits and f != column]
+        if limited and len(pending):
+            apply_context_limits(snapshot, self.context_limits, limited, pending.index)
+            pending = snapshot.loc[pending.index]
+        
+        avg_chars = None
+        if self.config.get("token_budget"):
+            # The upload profile gives the same size for every chunk without measuring the rows
+            if self.profile and column in self.profile["columns"] and violations is None:
+                avg_chars = profile_entry_chars(column, self.config, self.profile)
+            else:
+                avg_chars = average_entry_chars(pending, column, self.config, limited=True)
+        batch_size = batch_size_for(column, self.config, avg_chars)
+        return snapshot, [pending.iloc[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        
+    def _dispatch_batch(self, column_name: str, rendered: "RenderedBatch") -> Tuple[Any, float]:
+        """Send the request of a rendered batch and return the response (None on failure) and its latency"""
+        if rendered.request is None:
+            return None, 0.0  # Skip if no relevant rows to process
+        try:
+            # Rough token estimate (~4 characters per token) used for fair sharing and rate limits
+            cost = len(rendered.prompt) // 4 + MAX_COMPLETION_TOKENS
+            self._count("requests")
+            started = time.monotonic()
+            response = self.dispatcher.create(column_name, cost, **rendered.request)
+            return response, time.monotonic() - started
+        except Exception as e:
+            print(f"Error processing {column_name} batch. Error: {e}")
+            return None, 0.0
+        
+    def _parse_reply(self, df: pd.DataFrame, column_name: str, rendered: "RenderedBatch", response: Any,
+                     elapsed: float) -> None:
+        """Parse the reply to a rendered batch, leaving the accepted values and escalations on it"""
+        if response is None:
+            return
+        try:
+            # Extract text response
+            result_text = response.choices[0].message.content.strip()
+            logprobs = response_logprobs(response)
+        except Exception as e:
+            print(f"Error processing {column_name} batch. Error: {e}")
+            return
+        try:
+            results = json.loads(result_text)
+        except Exception:
+            results = None  # Reported by _apply_result
+        self._apply_result(df, column_name, rendered, result_text, logprobs, results)
+        self.cascade_stats.record(rendered.tier, len(rendered.prompted), len(rendered.escalate), elapsed,
+                                  getattr(response, "usage", None))
+        self.prompt_cache.record(getattr(response, "usage", None), rendered.prefix_chars)
+        
+    def _render_batch(self, df: pd.DataFrame, column_name: str, batch: pd.DataFrame,
+                      violations: Optional[Dict[Any, Optional[str]]] = None, tier: int = 0,
+                      fallback: Optional[Dict[Any, Any]] = None,
+                      cache_keys: Optional[Dict[Any, str]] = None) -> "RenderedBatch":
+        """Build the model request of a batch for a model tier, answering cached entries directly
+        
+        Entries in `violations` are sent even when they have a value, with the
+        reason their last answer was rejected (if any). `fallback` holds the
+        answers of an earlier tier to keep when this tier gives none, and
+        `cache_keys` the keys to store this tier's accepted answers under.
+        """
         context_fields = self.config["column_context"].get(column_name, [])
-        ignore_valued = self.config["ignore_valued_columns"].get(column_name, False)
+        ignore_valued = self.config.get("ignore_valued_columns", {}).get(column_name, False)
+        transformation_instruction = self.config.get("transformation_instructions", {}).get(column_name, "")
+        model_tier = self.tiers[tier]
+        ask_confidence = tier < len(self.tiers) - 1
         
         prompt_parts = []
         index_mapping = list(batch.index)
+        updates = {}
+        prompted = []
+        cache_keys = {df_idx: cache_keys[df_idx] for df_idx in index_mapping if df_idx in cache_keys} if cache_keys else {}
         
-        for idx, df_idx in enumerate(index_mapping):
-            if ignore_valued and pd.notnull(df.at[df_idx, column_name]) and df.at[df_idx, column_name] != '':
+        for df_idx in index_mapping:
+            problem = violations.get(df_idx) if violations else None
+            if df_idx not in (violations or {}) and ignore_valued and pd.notnull(df.at[df_idx, column_name]) and df.at[df_idx, column_name] != '':
                 continue
                 
             context_values = " | ".join(f"{field}: {df.at[df_idx, field]}" 
@@ -51,61 +635,188 @@ class CSVEnhancer:
                                        if field in df.columns and pd.notnull(df.at[df_idx, field]))
                                        
             existing_value = df.at[df_idx, column_name] if pd.notnull(df.at[df_idx, column_name]) else "Missing"
-            prompt_parts.append(f"Entry {idx + 1}:\nContext: {context_values}\nCurrent {column_name}: {existing_value}\n")
+            entry = f"Context: {context_values}\nCurrent {column_name}: {existing_value}\n"
+            if problem:
+                entry += f"Rejected because {problem}\n"
+            
+            # Reuse answers for entries seen before (e.g. in a preview of the same configuration)
+            if self.use_cache and tier == 0:
+                key = ResponseCache.key(self.cache_model, column_name, transformation_instruction, entry)
+                found, value = self.cache.get(key)
+                if found:
+                    updates[df_idx] = value
+                    continue
+                cache_keys[df_idx] = key
+                
+            # Entries are numbered in the order they are sent, which is how compact replies list them
+            prompted.append(df_idx)
+            prompt_parts.append(f"Entry {len(prompted)}:\n{entry}")
         
+        if tier == 0:
+            self._count("cache_hits", len(updates))
+            self._count("cache_misses", len(prompted) if self.use_cache else 0)
+        rendered = RenderedBatch(index_mapping, updates, cache_keys, tier, prompted,
+                                 {df_idx: fallback[df_idx] for df_idx in prompted if fallback and df_idx in fallback})
         if not prompt_parts:
-            return  # Skip if no relevant rows to process
-            
-        # Build prompt
-        prompt = f"""
-        You are cleaning and enhancing a dataset. Each entry has various attributes that may need validation or filling in.
-        Your task is to assess and correct the {column_name} values using the given context.
-        
-        Here are multiple entries:
-        {''.join(prompt_parts)}
-        
-        Respond in the following format (not JSON):
-        [
-          {{"Index": 1, "{column_name}": "<Corrected Value>"}},
-          {{"Index": 2, ...}}
-        ]
-        """
+            return rendered
+        
+        # Build prompt: the column's static prefix, then the entries
+        template = self._prompt_template(column_name, ask_confidence and model_tier["confidence"] == "self")
+        messages = template.messages(prompt_parts)
+        rendered.prompt = "".join(message["content"] for message in messages)
+        rendered.prefix_chars = len(template.system)
+        rendered.template = template
+        rendered.request = {
+            "model": model_tier["model"],
+            "messages": messages,
+            "max_tokens": MAX_COMPLETION_TOKENS,
+            "temperature": 0.3,
+            **template.request_options,
+        }
+        if ask_confidence and model_tier["confidence"] == "logprobs":
+            rendered.request["logprobs"] = True
+        return rendered
+        
+    def _prompt_template(self, column_name: str, ask_confidence: bool) -> PromptTemplate:
+        """Return the prompt template of a column, built once per job so its prefix stays byte-identical"""
+        key = (column_name, ask_confidence)
+        if key not in self._templates:
+            instruction = self.config.get("transformation_instructions", {}).get(column_name, "")
+            self._templates[key] = PromptTemplate(column_name, instruction, ask_confidence, self.reply_format)
+        return self._templates[key]
+        
+    def _apply_result(self, df: pd.DataFrame, column_name: str, rendered: "RenderedBatch",
+                      result_text: str, logprobs: Optional[List[Any]] = None,
+                      results: Any = None) -> Dict[Any, Any]:
+        """Parse the model answer of a rendered batch and return the accepted values by index
         
+        `results` is the answer already parsed, if any. Below the last model
+        tier, entries without an answer, with too little confidence or
+        breaking the column's constraints are not accepted but listed in
+        `rendered.escalate` for the next tier.
+        """
+        updates = rendered.updates
+        template = rendered.template
+        model_tier = self.tiers[rendered.tier]
+        escalating = rendered.tier < len(self.tiers) - 1
         try:
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.3
-            )
+            # Try parsing it as JSON
+            if results is None:
+                results = template.load_reply(result_text)
+            answers = template.read_reply(results)
+            if escalating and model_tier["confidence"] == "logprobs" and logprobs:
+                key = "values" if template.reply_format == "json_schema" else None
+                confidences = logprob_confidences(result_text, logprobs, key)
+            else:
+                confidences = [reported for _, _, _, reported in answers]
             
-            # Extract text response
-            result_text = response.choices[0].message.content.strip()
+            # Collect the answers for the batch, by entry number
+            answered = {}
+            confidence = {}
+            for number, (entry, has_value, value, _) in enumerate(answers):
+                if isinstance(entry, int) and 0 < entry <= len(rendered.prompted):
+                    df_idx = rendered.prompted[entry - 1]
+                    answered[df_idx] = value if has_value else df.at[df_idx, column_name]
+                    if has_value:
+                        confidence[df_idx] = confidences[number] if number < len(confidences) else None
             
-            # Try parsing it as JSON
-            results = json.loads(result_text)
+            failing = {}
+            if column_name in self.constraints and answered:
+                messages = find_violations(pd.Series(answered, dtype=object), self.constraints[column_name])
+                failing = messages.dropna().to_dict()
             
-            # Update the batch
-            for result in results:
-                index = result.get("Index") - 1
-                if 0 <= index < len(index_mapping):
-                    df.at[index_mapping[index], column_name] = result.get(column_name, df.at[index_mapping[index], column_name])
+            if escalating:
+                for df_idx in rendered.prompted:
+                    score = confidence.get(df_idx)
+                    if df_idx in failing or not isinstance(score, (int, float)) or score < model_tier["min_confidence"]:
+                        rendered.escalate[df_idx] = failing.get(df_idx)
+                        rendered.next_fallback[df_idx] = answered.get(df_idx, rendered.fallback.get(df_idx))
+                        answered.pop(df_idx, None)
+            
+            updates.update(answered)
+            # Only cache answers that meet the column's constraints
+            for df_idx in answered:
+                if df_idx in confidence and df_idx not in failing and df_idx in rendered.cache_keys:
+                    self.cache.put(rendered.cache_keys[df_idx], answered[df_idx])
                     
         except json.JSONDecodeError:
+            self._count("parse_errors")
             print(f"JSON parsing error for {column_name} batch. GPT response: {result_text}")
         except Exception as e:
             print(f"Error processing {column_name} batch. Error: {e}")
+        
+        return rendered.with_fallback()
+
 
+class RenderedBatch:
+    """Model request of one batch plus what is needed to map its answer back to rows"""
 
-def generate_config_from_description(description: str, columns: List[str]) -> Dict[str, Any]:
-    """Generate configuration based on natural language description"""
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    def __init__(self, index_mapping: List[Any], updates: Dict[Any, Any], cache_keys: Dict[Any, str],
+                 tier: int = 0, prompted: Optional[List[Any]] = None, fallback: Optional[Dict[Any, Any]] = None):
+        self.index_mapping = index_mapping
+        # Values already known before asking the model (cache hits), then the accepted answers
+        self.updates = updates
+        self.cache_keys = cache_keys
+        self.tier = tier
+        # Rows sent to the model
+        self.prompted = prompted or []
+        # Answers of an earlier model tier, kept when this tier gives none
+        self.fallback = fallback or {}
+        # Rows to send to the next model tier (with the constraint they broke, if any)
+        self.escalate: Dict[Any, Optional[str]] = {}
+        self.next_fallback: Dict[Any, Any] = {}
+        self.prompt: Optional[str] = None
+        # Length of the static part of the prompt (the system message)
+        self.prefix_chars = 0
+        self.request: Optional[Dict[str, Any]] = None
+        # Prompt the request was built from, which also reads the reply
+        self.template: Optional[PromptTemplate] = None
+
+    def with_fallback(self) -> Dict[Any, Any]:
+        """Return the accepted values plus earlier tiers' answers for rows neither accepted nor escalated"""
+        values = {df_idx: value for df_idx, value in self.fallback.items() if df_idx not in self.escalate}
+        values.update(self.updates)
+        return values
+
+
+def _plain(value: Any) -> Any:
+    """Convert a cell value to a plain Python value for JSON responses"""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _run_key(input_path: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Identify a run by its input file and configuration, so only matching runs are resumed"""
+    stat = os.stat(input_path)
+    return {
+        "input_path": os.path.abspath(input_path),
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime,
+        "config": json.dumps(config, sort_keys=True),
+    }
+
+
+def generate_config_from_description(description: str, columns: List[str],
+                                     profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Generate configuration based on natural language description
+    
+    With the file's upload profile, the model sees how complete each column
+    is, batch sizes are derived from the column sizes and columns with
+    nothing to fill are dropped.
+    """
+    client = create_client()
+    
+    profile_lines = ""
+    if profile:
+        profile_lines = "Column statistics (rows: {}):\n".format(profile["rows"]) + "\n".join(
+            f"    - {column}: {stats['fill_rate']:.0%} filled, ~{stats['approx_distinct']} distinct values, "
+            f"average length {stats['avg_length']:.0f}"
+            for column, stats in profile["columns"].items() if column in columns)
     
     prompt = f"""
     I have a CSV file with the following columns: {', '.join(columns)}
+    {profile_lines}
     
     The user wants to: {description}
     
@@ -143,7 +854,7 @@ def generate_config_from_description(description: str, columns: List[str]) -> Di
         if start_idx >= 0 and end_idx > start_idx:
             config_json = config_text[start_idx:end_idx]
             config = json.loads(config_json)
-            return config
+            return tune_config_with_profile(config, profile) if profile else config
         else:
             # Default configuration if JSON extraction fails
             return create_default_config(columns)
@@ -152,6 +863,20 @@ def generate_config_from_description(description: str, columns: List[str]) -> Di
         return create_default_config(columns)
 
 
+def tune_config_with_profile(config: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Size batches from the profile and drop columns that have nothing to fill"""
+    for column in list(config.get("column_context", {})):
+        if is_complete(column, config, profile):
+            for key in ("column_context", "batch_sizes", "ignore_valued_columns", "transformation_instructions"):
+                config.get(key, {}).pop(column, None)
+            continue
+        if column in profile["columns"]:
+            budget = {"token_budget": config.get("token_budget", DEFAULT_TOKEN_BUDGET)}
+            config.setdefault("batch_sizes", {})[column] = batch_size_for(
+                column, budget, profile_entry_chars(column, config, profile))
+    return config
+
+
 def create_default_config(columns: List[str]) -> Dict[str, Any]:
     """Create a default configuration based on columns"""
     config = {
@@ -0,0 +1,224 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Tuple
+
+from backend.app.core.config import REQUEST_TIMEOUT, REQUEST_MAX_RETRIES, HEDGE_MAX_RATIO
+from backend.app.services.llm_client import client_request
+from backend.app.services.scheduler import FairShareScheduler, SlotUnavailable
+
+# Latencies kept per (model, column)
+LATENCY_WINDOW = 200
+
+# Samples needed before the tail of the distribution is trusted for hedging
+MIN_HEDGE_SAMPLES = 20
+
+# Quantile of the latency distribution after which a request is hedged
+HEDGE_QUANTILE = 0.95
+
+# First retry backoff in seconds; doubled on every further attempt
+RETRY_BACKOFF = 1.0
+
+
+class LatencyTracker:
+    """Rolling window of request latencies per model and column"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: Tuple[str, str], seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, key: Tuple[str, str], q: float, min_samples: int = MIN_HEDGE_SAMPLES) -> Optional[float]:
+        """Return the q-quantile of recent latencies, or None with too few samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+_tracker = LatencyTracker()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """Return the process-wide latency tracker"""
+    return _tracker
+
+
+class RequestDispatcher:
+    """Sends chat completions for one job with deadlines, retries and hedging
+
+    Every attempt runs under a hard deadline (`request_timeout`). Timeouts,
+    rate limits and server errors are retried with exponential backoff up to
+    `max_retries` times; other client errors (4xx) are not. Once enough
+    latencies are known for a model and column, a request that is still
+    running after the p95 latency gets a hedged duplicate; the first answer
+    wins. The other one gives up if it is still queued for a slot, otherwise
+    it can't be interrupted: it keeps its slot until it ends (or reaches its
+    deadline) and is counted as "abandoned". Hedges only use idle scheduler
+    capacity and are capped at `hedge_max_ratio` of the job's requests.
+    """
+
+    def __init__(self, client: Any, scheduler: FairShareScheduler, job_id: str, config: Dict[str, Any],
+                 tracker: Optional[LatencyTracker] = None):
+        # Retries are done here, under the scheduler, not inside the client
+        self.client = client.with_options(max_retries=0) if hasattr(client, "with_options") else client
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.tracker = tracker or get_latency_tracker()
+        self.timeout = float(config.get("request_timeout", REQUEST_TIMEOUT))
+        self.max_retries = int(config.get("max_retries", REQUEST_MAX_RETRIES))
+        self.hedging = bool(config.get("hedge_requests", True))
+        self.hedge_max_ratio = float(config.get("hedge_max_ratio", HEDGE_MAX_RATIO))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "timeouts": 0, "errors": 0,
+                      "hedges": 0, "hedge_wins": 0, "abandoned": 0}
+        self._columns = set()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the dispatch counters and the latest p95 latency per column"""
+        with self._lock:
+            summary: Dict[str, Any] = dict(self.stats)
+            columns = list(self._columns)
+        summary["p95_seconds"] = {column: self.tracker.quantile(key, HEDGE_QUANTILE, min_samples=1)
+                                  for column, key in columns}
+        return summary
+
+    def close(self) -> None:
+        """Stop the hedging threads; running attempts finish at their own deadline"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix=f"dispatch-{self.job_id[:8]}")
+            return self._executor
+
+    def create(self, column: str, cost: float, **request: Any) -> Any:
+        """Send one chat completion request and return the first successful response"""
+        key = (request.get("model", ""), column)
+        with self._lock:
+            self.stats["requests"] += 1
+            self._columns.add((column, key))
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1) * (0.5 + random.random()))
+            try:
+                return self._hedged(key, cost, request)
+            except Exception as e:
+                last_error = e
+                if _is_timeout(e):
+                    self._count("timeouts")
+                else:
+                    self._count("errors")
+                if not _is_retryable(e):
+                    break
+        raise last_error
+
+    def _attempt(self, key: Tuple[str, str], cost: float, request: Dict[str, Any],
+                 cancel: Optional[threading.Event] = None) -> Any:
+        try:
+            with self.scheduler.slot(self.job_id, cost, cancel=cancel):
+                return self._send(key, request, cancel)
+        except SlotUnavailable:
+            # The other request of a hedged pair answered while this one was queued
+            return _NOT_SENT
+
+    def _hedge_attempt(self, key: Tuple[str, str], cost: float, request: Dict[str, Any],
+                       cancel: threading.Event) -> Any:
+        # Hedges never queue: they only run on capacity nobody else is waiting for
+        try:
+            with self.scheduler.slot(self.job_id, cost, nowait=True):
+                self._count("hedges")
+                return self._send(key, request, cancel)
+        except SlotUnavailable:
+            return _NOT_SENT
+
+    def _send(self, key: Tuple[str, str], request: Dict[str, Any], cancel: Optional[threading.Event] = None) -> Any:
+        if cancel is not None and cancel.is_set():
+            return _NOT_SENT
+        self._count("attempts")
+        started = time.monotonic()
+        create = self.client.chat.completions.create
+        response = create(timeout=self.timeout, **client_request(create, request))
+        self.tracker.record(key, time.monotonic() - started)
+        if cancel is not None and cancel.is_set():
+            # Lost the race: the answer is dropped, but the request held its slot (and tokens) until now
+            self._count("abandoned")
+        return response
+
+    def _hedge_allowed(self) -> bool:
+        with self._lock:
+            return self.stats["hedges"] < self.hedge_max_ratio * self.stats["requests"]
+
+    def _hedged(self, key: Tuple[str, str], cost: float, request: Dict[str, Any]) -> Any:
+        hedge_after = self.tracker.quantile(key, HEDGE_QUANTILE) if self.hedging else None
+        if hedge_after is None or self.hedge_max_ratio <= 0:
+            return self._attempt(key, cost, request)
+
+        pool = self._pool()
+        # Set once one request of the pair has answered (or failed for good)
+        cancel = threading.Event()
+        primary = pool.submit(self._attempt, key, cost, request, cancel)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done or not self._hedge_allowed():
+            return primary.result()
+        hedge = pool.submit(self._hedge_attempt, key, cost, request, cancel)
+
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    if _is_retryable(error):
+                        continue
+                    # The other request would fail the same way (e.g. a 400): don't wait for it
+                    cancel.set()
+                    raise error
+                if future.result() is _NOT_SENT:
+                    continue
+                # First answer wins. A loser still queued for a slot gives up; one that was
+                # already sent can't be interrupted and is abandoned (counted when it ends)
+                cancel.set()
+                for other in pending:
+                    other.cancel()
+                if future is hedge:
+                    self._count("hedge_wins")
+                return future.result()
+        raise error
+
+
+# Returned by a hedge that found no idle capacity
+_NOT_SENT = object()
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """Return False for errors another attempt would get as well (client errors other than 408, 409 and 429)"""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return status in (408, 409, 429)
+    return True
+
+
+def _is_timeout(error: Exception) -> bool:
+    return isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower() \
+        or "timed out" in str(error).lower()
@@ -0,0 +1,157 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Dict, List, Any, Optional
+
+from backend.app.core.config import FAKE_LLM_LATENCY_MS, FAKE_LLM_SLOW_RATE, FAKE_LLM_SLOW_MS, FAKE_LLM_PROSE_RATE
+
+ENTRY_PATTERN = re.compile(r"Entry (\d+):\s*\nContext: (.*?)\nCurrent (.+?): (.*?)\n(?:Rejected because (.*?)\n)?", re.S)
+ALLOWED_PATTERN = re.compile(r"must be one of: (.*)")
+COLUMN_PATTERN = re.compile(r"correct the (.+?) values")
+COLUMNS_PATTERN = re.compile(r"following columns: (.*)")
+CONFIDENCE_PROMPT = "give your confidence"
+POSITIONAL_PROMPT = "one value per entry, in the order of the entries"
+
+# Text around replies wrapped in prose
+PROSE_BEFORE = "Here are the corrected values:\n"
+PROSE_AFTER = "\nLet me know if you need anything else."
+
+# Confidence of the fake's answers: one entry in four (by its context) is answered unsure
+SURE_CONFIDENCE = 0.9
+UNSURE_CONFIDENCE = 0.3
+
+
+class FakeChatClient:
+    """Local stand-in for the OpenAI client used for development, tests and benchmarks
+
+    It mimics `client.chat.completions.create(...)` closely enough for the
+    enhancer: batch prompts are answered with one value per entry (the current
+    value when there is one, otherwise a value derived from the entry) and
+    configuration prompts with a default configuration. No network access is
+    needed and the latency of every call can be set with `FAKE_LLM_LATENCY_MS`;
+    `FAKE_LLM_SLOW_RATE` of the calls take `FAKE_LLM_SLOW_MS` instead, which
+    simulates the slow tail of a real API. A `timeout` shorter than the
+    latency raises TimeoutError after waiting for the timeout.
+
+    Confidences (asked for in the prompt, or as token log probabilities with
+    `logprobs=True`) are deterministic per entry, so model
+    cascades can be exercised locally. Like a provider's prompt cache, a
+    system message seen before is reported as cached prompt tokens.
+
+    Batch replies follow the reply format of the prompt: objects with an
+    "Index", a positional array or, with a json_schema `response_format`, a
+    {"values": [...]} object. `FAKE_LLM_PROSE_RATE` of the replies not
+    enforced by a schema (picked by prompt, so reruns get the same) are
+    wrapped in prose like a chatty model's.
+    """
+
+    def __init__(self, latency_ms: float = FAKE_LLM_LATENCY_MS, slow_rate: float = FAKE_LLM_SLOW_RATE,
+                 slow_ms: float = FAKE_LLM_SLOW_MS, prose_rate: float = FAKE_LLM_PROSE_RATE):
+        self.latency = latency_ms / 1000.0
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_ms / 1000.0
+        self.prose_rate = prose_rate
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.calls = 0
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+
+    def create(self, model: str, messages: List[Dict[str, str]], max_tokens: int = 1000,
+               temperature: float = 1.0, timeout: Optional[float] = None, **kwargs: Any) -> SimpleNamespace:
+        """Answer a chat completion request"""
+        if "extra_body" in kwargs:
+            # Requests carry API fields; extra_body only exists in the openai client (see client_request)
+            raise TypeError("create() got an unexpected keyword argument 'extra_body'")
+        self.calls += 1
+        latency = self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Request timed out after {timeout:.1f}s")
+        if latency:
+            time.sleep(latency)
+
+        prompt = "\n".join(message["content"] for message in messages)
+        tokens = None
+        if "Generate a configuration" in prompt:
+            content = self._config_reply(prompt)
+        else:
+            schema = (kwargs.get("response_format") or {}).get("type") == "json_schema"
+            content, tokens = self._batch_reply(prompt, schema)
+        logprobs = None
+        if kwargs.get("logprobs") and tokens is not None:
+            logprobs = SimpleNamespace(content=[SimpleNamespace(token=token, logprob=logprob) for token, logprob in tokens])
+
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        prefix = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        with self._lock:
+            cached = len(prefix) // 4 if prefix in self._seen_prefixes else 0
+            self._seen_prefixes.add(prefix)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=content),
+                                     logprobs=logprobs)],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                  total_tokens=prompt_tokens + completion_tokens,
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=cached)),
+        )
+
+    def _batch_reply(self, prompt: str, schema: bool = False) -> tuple:
+        """Return the answer to a batch prompt and its (token, logprob) pieces, one per entry"""
+        column_match = COLUMN_PATTERN.search(prompt)
+        column = column_match.group(1) if column_match else "value"
+        with_confidence = CONFIDENCE_PROMPT in prompt
+        positional = POSITIONAL_PROMPT in prompt
+        results = []
+        confidences = []
+        for number, context, _, current, rejected in ENTRY_PATTERN.findall(prompt):
+            value = current.strip()
+            allowed = ALLOWED_PATTERN.search(rejected)
+            if allowed:
+                # A rejected value is replaced with the first allowed one
+                value = allowed.group(1).split(", ")[0]
+            elif value == "Missing" or not value:
+                first_context = context.split(" | ")[0].split(": ", 1)[-1].strip()
+                value = f"{column} for {first_context}" if first_context else f"{column} {number}"
+            confidence = UNSURE_CONFIDENCE if zlib.crc32(context.encode()) % 4 == 0 else SURE_CONFIDENCE
+            if schema:
+                result = value
+            elif positional:
+                result = [value, confidence] if with_confidence else value
+            else:
+                result = {"Index": int(number), column: value}
+                if with_confidence:
+                    result["confidence"] = confidence
+            results.append(json.dumps(result))
+            confidences.append(confidence)
+
+        tokens = [('{"values": [' if schema else "[", 0.0)]
+        for number, (result, confidence) in enumerate(zip(results, confidences)):
+            tokens.append((result, math.log(confidence)))
+            if number < len(results) - 1:
+                tokens.append((", ", 0.0))
+        tokens.append(("]", 0.0))
+        if schema:
+            if with_confidence:
+                tokens.append((', "confidences": ' + json.dumps(confidences), 0.0))
+            tokens.append(("}", 0.0))
+        elif self.prose_rate and zlib.crc32(prompt.encode()) % 1000 < self.prose_rate * 1000:
+            tokens = [(PROSE_BEFORE, 0.0)] + tokens + [(PROSE_AFTER, 0.0)]
+        return "".join(token for token, _ in tokens), tokens
+
+    def _config_reply(self, prompt: str) -> str:
+        columns_match = COLUMNS_PATTERN.search(prompt)
+        columns = [c.strip() for c in columns_match.group(1).split(",")] if columns_match else []
+        target = columns[-1] if columns else "value"
+        config = {
+            "column_context": {target: columns[:3]},
+            "batch_sizes": {target: 10},
+            "ignore_valued_columns": {target: True},
+        }
+        return json.dumps(config)
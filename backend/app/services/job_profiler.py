@@ -0,0 +1,354 @@
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Any, Callable, Iterator, Optional, Tuple
+
+# Profiles show where the threads of one job spend their time. The threads
+# working for a job (the one running `process_file` and the pipeline stage
+# threads it starts) are bound to the job id while they run:
+#   - "sampling" takes the stacks of the job's threads every `interval`
+#     seconds. It can be started and stopped while a job runs and exports
+#     collapsed stacks (for flame graphs) or pstats.
+#   - "cprofile" runs cProfile in every thread of the job, so it is only
+#     available for a whole run (the "profiling" config key). It exports pstats.
+# Without a profile, binding a thread costs two dictionary operations.
+
+# cProfile and pstats are only imported when a profile is taken or exported, so
+# validating a configuration from the command line stays fast
+
+PROFILE_MODES = ("sampling", "cprofile")
+PROFILE_FORMATS = ("collapsed", "pstats")
+
+# Seconds between two samples of a job's stacks
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# Frames kept per sampled stack, innermost first
+MAX_STACK_DEPTH = 128
+
+# Finished profiles kept for download
+KEEP_PROFILES = 20
+
+# Functions listed in the summary of a profile
+TOP_FUNCTIONS = 15
+
+# pstats key of a function: (file name, first line, function name)
+FunctionKey = Tuple[str, int, str]
+
+# Ids of the threads working for a job, by thread ident
+_thread_jobs: Dict[int, str] = {}
+
+
+class ProfileActiveError(RuntimeError):
+    """Raised when a job that is already being profiled is profiled again"""
+
+
+def current_job() -> Optional[str]:
+    """Return the id of the job the calling thread works for"""
+    return _thread_jobs.get(threading.get_ident())
+
+
+@contextmanager
+def bound_thread(job_id: Optional[str]) -> Iterator[None]:
+    """Attribute the work of the calling thread to a job for the duration of the block"""
+    ident = threading.get_ident()
+    previous = _thread_jobs.get(ident)
+    if job_id is None or previous == job_id:
+        yield
+        return
+    _thread_jobs[ident] = job_id
+    session = profile_registry.active(job_id)
+    profiler = session.enable_thread() if session is not None else None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            session.disable_thread(profiler)
+        if previous is None:
+            _thread_jobs.pop(ident, None)
+        else:
+            _thread_jobs[ident] = previous
+
+
+def run_in_job(job_id: Optional[str], func: Callable[..., Any], *args: Any) -> Any:
+    """Call `func(*args)` with the calling thread bound to a job (a thread target for job threads)"""
+    with bound_thread(job_id):
+        return func(*args)
+
+
+def _function_key(code: Any) -> FunctionKey:
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _function_label(key: FunctionKey) -> str:
+    filename, line, name = key
+    # The last two path components are enough to tell the modules of this app and its libraries apart
+    short = os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+    return f"{name} ({short}:{line})"
+
+
+class StageTimers:
+    """Calls and wall time of the phases of a job outside its pipelines (loading, checks, output)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stage = self._stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+                stage["calls"] += 1
+                stage["seconds"] += elapsed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(stage) for name, stage in self._stages.items()}
+
+
+class ProfileSession:
+    """A profile of the threads of one job"""
+
+    def __init__(self, job_id: str, mode: str = "sampling", interval: float = DEFAULT_SAMPLE_INTERVAL,
+                 stages: Callable[[], Optional[Dict[str, Any]]] = lambda: None):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'")
+        self.job_id = job_id
+        self.mode = mode
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped_at: Optional[float] = None
+        self.ticks = 0
+        # Sampled stacks (thread name, frames outermost first) and how often they were seen
+        self._stacks: Counter = Counter()
+        self._stats: Any = None
+        self._stages = stages
+        self._final_stages: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.stopped_at is None
+
+    def start(self) -> None:
+        if self.mode == "sampling":
+            self._thread = threading.Thread(target=self._sample, name=f"profiler-{self.job_id[:8]}", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.freeze_stages()
+        self.stopped_at = time.time()
+
+    def freeze_stages(self) -> None:
+        """Keep the job's current stage timers, before the job that provides them goes away"""
+        if self._final_stages is None:
+            self._final_stages = self._stages()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            idents = [ident for ident, job_id in list(_thread_jobs.items()) if job_id == self.job_id]
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident in idents:
+                frame = frames.get(ident)
+                stack: List[FunctionKey] = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_function_key(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    stacks.append((names.get(ident, str(ident)), tuple(reversed(stack))))
+            with self._lock:
+                self.ticks += 1
+                self._stacks.update(stacks)
+
+    def enable_thread(self) -> Optional[Any]:
+        """Start cProfile in the calling thread if this is a cProfile session"""
+        if self.mode != "cprofile" or not self.running:
+            return None
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ profiles all threads with the first profiler that was enabled
+            return None
+        return profiler
+
+    def disable_thread(self, profiler: Any) -> None:
+        """Stop cProfile in the calling thread and add what it measured to the session"""
+        import pstats
+
+        profiler.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def function_stats(self) -> Dict[FunctionKey, Tuple[Any, ...]]:
+        """Return the measured functions in the layout of `pstats.Stats.stats`
+
+        For sampled profiles, a function's own and total time are the samples
+        with the function innermost and anywhere on the stack, times the interval.
+        """
+        with self._lock:
+            if self.mode == "cprofile":
+                return dict(self._stats.stats) if self._stats is not None else {}
+            stacks = list(self._stacks.items())
+        stats: Dict[FunctionKey, List[Any]] = {}
+        for (_, stack), count in stacks:
+            seconds = count * self.interval
+            for key in set(stack):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                entry[0] += count
+                entry[1] += count
+                entry[3] += seconds
+            stats[stack[-1]][2] += seconds
+            for caller, callee in set(zip(stack, stack[1:])):
+                calls = stats[callee][4].get(caller, (0, 0, 0.0, 0.0))
+                stats[callee][4][caller] = (calls[0] + count, calls[1] + count, calls[2], calls[3] + seconds)
+        return {key: tuple(entry) for key, entry in stats.items()}
+
+    def export(self, profile_format: str) -> bytes:
+        """Return the profile as collapsed stacks (one "thread;outer;...;inner count" line per stack) or pstats"""
+        if profile_format == "pstats":
+            # Same layout as `pstats.Stats.dump_stats`, readable with `pstats.Stats(path)` or snakeviz
+            return marshal.dumps(self.function_stats())
+        if profile_format != "collapsed":
+            raise ValueError(f"Unknown profile format '{profile_format}'")
+        if self.mode != "sampling":
+            raise ValueError("Collapsed stacks are only available for sampling profiles")
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: -item[1])
+        lines = [";".join([thread] + [_function_label(key).replace(";", ":") for key in stack]) + f" {count}"
+                 for (thread, stack), count in stacks]
+        return ("\n".join(lines) + "\n" if lines else "").encode("utf-8")
+
+    def summary(self) -> Dict[str, Any]:
+        stats = self.function_stats()
+        top = sorted(stats.items(), key=lambda item: -item[1][2])[:TOP_FUNCTIONS]
+        stopped_at = self.stopped_at or time.time()
+        return {
+            "job_id": self.job_id,
+            "mode": self.mode,
+            "running": self.running,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "seconds": stopped_at - self.started_at,
+            "interval": self.interval if self.mode == "sampling" else None,
+            "samples": self.ticks if self.mode == "sampling" else None,
+            "formats": list(PROFILE_FORMATS) if self.mode == "sampling" else ["pstats"],
+            "stages": self._final_stages if self._final_stages is not None else self._stages(),
+            "top_functions": [{"function": _function_label(key), "self_seconds": entry[2],
+                               "total_seconds": entry[3]} for key, entry in top],
+        }
+
+
+class ProfileRegistry:
+    """Running profiles by job and the latest finished ones, for download"""
+
+    def __init__(self, keep: int = KEEP_PROFILES):
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active: Dict[str, ProfileSession] = {}
+        self._finished: "OrderedDict[str, ProfileSession]" = OrderedDict()
+        # Stage timers of the running jobs, included in their profiles
+        self._stages: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def active(self, job_id: str) -> Optional[ProfileSession]:
+        return self._active.get(job_id)
+
+    def get(self, job_id: str) -> Optional[ProfileSession]:
+        """Return the running or latest finished profile of a job"""
+        with self._lock:
+            return self._active.get(job_id) or self._finished.get(job_id)
+
+    def attach(self, job_id: str, stages: Callable[[], Dict[str, Any]]) -> None:
+        with self._lock:
+            self._stages[job_id] = stages
+
+    def detach(self, job_id: str) -> None:
+        with self._lock:
+            session = self._active.get(job_id)
+        if session is not None:
+            session.freeze_stages()
+        with self._lock:
+            self._stages.pop(job_id, None)
+
+    def stage_timings(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the stage timers of a running job, or None if it isn't running in this process"""
+        stages = self._stages.get(job_id)
+        return stages() if stages is not None else None
+
+    def start(self, job_id: str, mode: str = "sampling",
+              interval: float = DEFAULT_SAMPLE_INTERVAL) -> ProfileSession:
+        """Start profiling a job; raises ProfileActiveError if it is already being profiled"""
+        with self._lock:
+            if job_id in self._active:
+                raise ProfileActiveError(f"Job {job_id} is already being profiled")
+            session = ProfileSession(job_id, mode, interval, lambda: self.stage_timings(job_id))
+            self._active[job_id] = session
+        session.start()
+        return session
+
+    def stop(self, job_id: str, session: Optional[ProfileSession] = None) -> Optional[ProfileSession]:
+        """Stop the running profile of a job (only if it is `session`, when given) and keep it for download"""
+        with self._lock:
+            current = self._active.get(job_id)
+            if current is None or (session is not None and current is not session):
+                return None
+            del self._active[job_id]
+        current.stop()
+        with self._lock:
+            self._finished[job_id] = current
+            self._finished.move_to_end(job_id)
+            while len(self._finished) > self.keep:
+                self._finished.popitem(last=False)
+        return current
+
+
+profile_registry = ProfileRegistry()
+
+
+@contextmanager
+def job_profile(job_id: str, mode: Optional[str] = None,
+                stages: Optional[Callable[[], Dict[str, Any]]] = None) -> Iterator[None]:
+    """Bind the calling thread to a job for the duration of the block, profiling the job if `mode` is given
+
+    `stages` returns the job's stage timers; they are added to any profile
+    taken while the block runs. Any profile of the job still running at the
+    end of the block (also one started from the admin API) is stopped then.
+    """
+    if stages is not None:
+        profile_registry.attach(job_id, stages)
+    if mode is not None:
+        try:
+            profile_registry.start(job_id, mode)
+        except ProfileActiveError:
+            pass
+    try:
+        with bound_thread(job_id):
+            yield
+    finally:
+        profile_registry.stop(job_id)
+        if stages is not None:
+            profile_registry.detach(job_id)
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, List
+
+from backend.app.services.column_store import ColumnStore
+from backend.app.services.scheduler import get_scheduler
+
+
+class JobRegistry:
+    """In-memory registry of enhancement jobs started through the API"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename: str, result_file: str, tenant: str = "default",
+               priority: str = "bulk") -> Dict[str, Any]:
+        """Create a new queued job record"""
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "filename": filename,
+            "result_file": result_file,
+            "tenant": tenant,
+            "priority": priority,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "summary": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+        return dict(job)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """Update fields of an existing job"""
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job record together with its scheduler stats"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job else None
+        if job is not None:
+            job["scheduler"] = get_scheduler().job_stats(job_id)
+        return job
+
+    def active(self) -> List[Dict[str, Any]]:
+        """Return the jobs that are queued or running"""
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["status"] in ("queued", "running")]
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Return all known jobs, newest first"""
+        with self._lock:
+            job_ids = sorted(self._jobs, key=lambda j: self._jobs[j]["created_at"], reverse=True)
+        return [self.get(job_id) for job_id in job_ids]
+
+
+job_registry = JobRegistry()
+
+
+def run_job(job_id: str, enhancer: Any, input_path: str, output_path: str, mode: str = "online") -> None:
+    """Run an enhancer for a registered job and record its outcome
+
+    In "batch" mode the requests go through the offline batch backend. Only
+    the processed columns are stored (see ColumnStore); the result file is
+    merged from them when it is downloaded.
+    """
+    job_registry.update(job_id, status="running", started_at=time.time())
+    store = ColumnStore(os.path.basename(output_path))
+    try:
+        if mode == "batch":
+            summary = enhancer.process_file_batch(input_path, output_path, store=store)
+        else:
+            summary = enhancer.process_file(input_path, output_path, store=store)
+        job_registry.update(job_id, status="completed", finished_at=time.time(), summary=summary)
+    except Exception as e:
+        print(f"Job {job_id} failed. Error: {e}")
+        job_registry.update(job_id, status="failed", finished_at=time.time(), error=str(e))
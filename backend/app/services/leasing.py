@@ -0,0 +1,466 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Any, Optional
+
+from backend.app.utils.file_utils import write_json_atomic
+
+# Seconds a claimed unit stays leased without a heartbeat
+LEASE_SECONDS = 120
+
+# Seconds between heartbeats of a worker holding a lease
+HEARTBEAT_SECONDS = 20
+
+# Number of times a unit is handed out before it is marked as failed
+MAX_ATTEMPTS = 3
+
+# Worker processes `Coordinator.run` starts again, per worker, when they exit while units are left
+MAX_RESTARTS = 3
+
+# Seconds `Coordinator.run` gives its workers to exit after a terminate before killing them
+WORKER_STOP_SECONDS = 10
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS lease_jobs (
+        job_id TEXT PRIMARY KEY,
+        input_path TEXT NOT NULL,
+        output_path TEXT NOT NULL,
+        work_dir TEXT NOT NULL,
+        config TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lease_units (
+        job_id TEXT NOT NULL,
+        unit_id INTEGER NOT NULL,
+        column_name TEXT NOT NULL,
+        stage INTEGER NOT NULL DEFAULT 0,
+        start_row INTEGER NOT NULL,
+        stop_row INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        owner TEXT,
+        lease_expires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result_path TEXT,
+        error TEXT,
+        PRIMARY KEY (job_id, unit_id)
+    )
+    """,
+]
+
+
+class LeaseStore:
+    """Lease table of batch units shared by a coordinator and any number of workers
+
+    Backed by a SQLite file, which is enough for several worker processes on
+    one host or on hosts sharing a filesystem.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            # Lease tables created before units had dependency stages
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(lease_units)")]
+            if "stage" not in columns:
+                conn.execute("ALTER TABLE lease_units ADD COLUMN stage INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_job(self, job_id: str, input_path: str, output_path: str, work_dir: str,
+                   config: Dict[str, Any], units: List[Dict[str, Any]]) -> None:
+        """Store a job and its batch units as pending"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO lease_jobs (job_id, input_path, output_path, work_dir, config, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, input_path, output_path, work_dir, json.dumps(config), time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO lease_units (job_id, unit_id, column_name, stage, start_row, stop_row, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'pending')",
+                [(job_id, unit_id, unit["column"], unit.get("stage", 0), unit["start"], unit["stop"])
+                 for unit_id, unit in enumerate(units)],
+            )
+            conn.execute("COMMIT")
+
+    def claim(self, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        """Lease the next pending (or expired) unit to `worker_id`
+
+        Units of a dependency stage are only handed out once every unit of the
+        job's earlier stages is done (or failed), so they see their results.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT u.job_id, u.unit_id, u.column_name, u.stage, u.start_row, u.stop_row, u.attempts, "
+                "j.input_path, j.work_dir, j.config "
+                "FROM lease_units u JOIN lease_jobs j ON j.job_id = u.job_id "
+                "WHERE (u.status = 'pending' OR (u.status = 'leased' AND u.lease_expires < ?)) "
+                "AND NOT EXISTS (SELECT 1 FROM lease_units p WHERE p.job_id = u.job_id AND p.stage < u.stage "
+                "AND p.status IN ('pending', 'leased')) "
+                "ORDER BY j.created_at, u.stage, u.unit_id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            if row["attempts"] >= MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE lease_units SET status = 'failed', owner = NULL, error = 'lease expired too often' "
+                    "WHERE job_id = ? AND unit_id = ?",
+                    (row["job_id"], row["unit_id"]),
+                )
+                conn.execute("COMMIT")
+                return self.claim(worker_id, lease_seconds)
+
+            conn.execute(
+                "UPDATE lease_units SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND unit_id = ?",
+                (worker_id, now + lease_seconds, row["job_id"], row["unit_id"]),
+            )
+            conn.execute("COMMIT")
+
+        return {
+            "job_id": row["job_id"],
+            "unit_id": row["unit_id"],
+            "column": row["column_name"],
+            "stage": row["stage"],
+            "start": row["start_row"],
+            "stop": row["stop_row"],
+            "input_path": row["input_path"],
+            "work_dir": row["work_dir"],
+            "config": json.loads(row["config"]),
+        }
+
+    def heartbeat(self, job_id: str, unit_id: int, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+        """Extend a lease; returns False if the worker no longer holds it"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE lease_units SET lease_expires = ? "
+                "WHERE job_id = ? AND unit_id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + lease_seconds, job_id, unit_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, unit_id: int, worker_id: str, result_path: str) -> bool:
+        """Mark a leased unit as done; returns False if the lease was lost meanwhile"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE lease_units SET status = 'done', result_path = ?, lease_expires = NULL "
+                "WHERE job_id = ? AND unit_id = ? AND owner = ? AND status = 'leased'",
+                (result_path, job_id, unit_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, job_id: str, unit_id: int, worker_id: str, error: str) -> None:
+        """Give a unit back after an error so another worker can retry it"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE lease_units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_expires = NULL, error = ? "
+                "WHERE job_id = ? AND unit_id = ? AND owner = ? AND status = 'leased'",
+                (MAX_ATTEMPTS, error, job_id, unit_id, worker_id),
+            )
+
+    def open_units(self) -> int:
+        """Count the units of all jobs that are pending or leased (including expired leases)"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n FROM lease_units WHERE status IN ('pending', 'leased')").fetchone()
+        return row["n"]
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the stored job definition"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM lease_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["config"] = json.loads(job["config"])
+        return job
+
+    def units(self, job_id: str) -> List[Dict[str, Any]]:
+        """Return all units of a job"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM lease_units WHERE job_id = ? ORDER BY unit_id", (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        """Count the units of a job by status"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM lease_units WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+class Coordinator:
+    """Plans a job into batch units, waits for workers to finish them and merges the results"""
+
+    def __init__(self, store: LeaseStore):
+        self.store = store
+
+    def submit(self, input_path: str, output_path: str, config: Dict[str, Any],
+               rows_per_unit: Optional[int] = None, job_id: Optional[str] = None) -> str:
+        """Plan a job and store its units in the lease table"""
+        import pandas as pd
+        from backend.app.services.planner import plan_units, DEFAULT_UNIT_ROWS
+
+        job_id = job_id or uuid.uuid4().hex
+        df = pd.read_csv(input_path)
+        units = plan_units(df, config, rows_per_unit or DEFAULT_UNIT_ROWS)
+
+        # Workers write their unit results next to the output, so hosts need a shared filesystem
+        work_dir = os.path.abspath(f"{output_path}.units-{job_id}")
+        os.makedirs(work_dir, exist_ok=True)
+
+        self.store.create_job(job_id, os.path.abspath(input_path), os.path.abspath(output_path),
+                              work_dir, config, units)
+        print(f"Submitted job {job_id} with {len(units)} units")
+        return job_id
+
+    def wait(self, job_id: str, poll_interval: float = 1.0, timeout: Optional[float] = None) -> Dict[str, int]:
+        """Block until no unit of the job is pending or leased"""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            progress = self.store.progress(job_id)
+            if progress["pending"] == 0 and progress["leased"] == 0:
+                return progress
+            if deadline and time.time() > deadline:
+                raise TimeoutError(f"Job {job_id} did not finish in time: {progress}")
+            time.sleep(poll_interval)
+
+    def merge(self, job_id: str) -> Dict[str, Any]:
+        """Apply the results of all finished units and write the final output file"""
+        from backend.app.utils.frame_utils import read_csv_compact
+
+        job = self.store.job(job_id)
+        df, _ = read_csv_compact(job["input_path"], exclude=job["config"].get("column_context", {}),
+                                 compact=job["config"].get("compact_dtypes", True))
+        units = self.store.units(job_id)
+
+        for unit in units:
+            if unit["status"] != "done":
+                print(f"Unit {unit['unit_id']} ({unit['column_name']} rows {unit['start_row']}-{unit['stop_row']}) "
+                      f"{unit['status']}: {unit['error']}")
+                continue
+            column = unit["column_name"]
+            # Model answers are text; an all-empty column is read as float and would reject them
+            if df[column].dtype != object:
+                df[column] = df[column].astype(object)
+            _apply_results(df, column, unit["result_path"])
+
+        # Write to a temporary file first so readers never see a partial output
+        tmp_path = f"{job['output_path']}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, job["output_path"])
+
+        failed = [unit["unit_id"] for unit in units if unit["status"] != "done"]
+        print(f"Merged {len(units) - len(failed)}/{len(units)} units into '{job['output_path']}'")
+        return {
+            "job_id": job_id,
+            "rows": len(df),
+            "units": len(units),
+            "failed_units": failed,
+        }
+
+    def run(self, input_path: str, output_path: str, config: Dict[str, Any], workers: int = 2,
+            rows_per_unit: Optional[int] = None) -> Dict[str, Any]:
+        """Submit a job, run local worker processes against the store and merge the result"""
+        job_id = self.submit(input_path, output_path, config, rows_per_unit)
+        processes = [self._start_worker() for _ in range(workers)]
+        restarts = 0
+        try:
+            while True:
+                progress = self.store.progress(job_id)
+                if progress["pending"] == 0 and progress["leased"] == 0:
+                    break
+                # A worker that died (possibly holding a lease) is replaced, so expired leases are picked up again
+                for number, process in enumerate(processes):
+                    if process.poll() is None:
+                        continue
+                    if restarts >= MAX_RESTARTS * workers:
+                        raise RuntimeError(f"Worker processes of job {job_id} keep exiting: {progress}")
+                    print(f"Worker process {process.pid} exited with code {process.returncode}, starting another")
+                    processes[number] = self._start_worker()
+                    restarts += 1
+                time.sleep(1.0)
+        except BaseException:
+            # Workers only exit once no unit of any job is open, so don't wait for them on errors
+            self._stop_workers(processes)
+            raise
+        for process in processes:
+            process.wait()
+        return self.merge(job_id)
+
+    def _start_worker(self) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, "-m", "backend.app.services.leasing", "worker",
+                                 "--db", self.store.db_path, "--exit-when-idle"])
+
+    def _stop_workers(self, processes: List[subprocess.Popen]) -> None:
+        """Terminate worker processes, killing those that don't exit in time; their leases expire"""
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=WORKER_STOP_SECONDS)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+class LeaseWorker:
+    """Claims batch units from the lease table and processes them with CSVEnhancer"""
+
+    def __init__(self, store: LeaseStore, worker_id: Optional[str] = None,
+                 lease_seconds: float = LEASE_SECONDS, heartbeat_seconds: float = HEARTBEAT_SECONDS):
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._frames: Dict[str, Any] = {}
+
+    def run(self, exit_when_idle: bool = False, poll_interval: float = 1.0) -> int:
+        """Process units until none are left (or forever); returns the number of units processed
+
+        With `exit_when_idle`, the worker only exits when no unit is pending
+        or leased: units of later stages and units whose worker died become
+        available while others are still leased.
+        """
+        processed = 0
+        while True:
+            unit = self.store.claim(self.worker_id, self.lease_seconds)
+            if unit is None:
+                if exit_when_idle and self.store.open_units() == 0:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+            self.process_unit(unit)
+            processed += 1
+
+    def _load(self, input_path: str, config: Dict[str, Any]) -> Any:
+        from backend.app.utils.frame_utils import read_csv_compact
+
+        if input_path not in self._frames:
+            df, _ = read_csv_compact(input_path, exclude=config.get("column_context", {}),
+                                     compact=config.get("compact_dtypes", True))
+            self._frames = {input_path: df}
+        return self._frames[input_path]
+
+    def _apply_upstream(self, frame: Any, unit: Dict[str, Any]) -> None:
+        """Put the results of the earlier stages' units for the unit's rows into its frame"""
+        context = unit["config"]["column_context"].get(unit["column"], [])
+        for upstream in self.store.units(unit["job_id"]):
+            column = upstream["column_name"]
+            if (upstream["stage"] >= unit["stage"] or upstream["status"] != "done" or column not in context
+                    or upstream["stop_row"] <= unit["start"] or upstream["start_row"] >= unit["stop"]):
+                continue
+            if frame[column].dtype != object:
+                frame[column] = frame[column].astype(object)
+            _apply_results(frame, column, upstream["result_path"], unit["start"])
+
+    def process_unit(self, unit: Dict[str, Any]) -> None:
+        """Process one leased unit, heartbeating while the model requests run"""
+        from backend.app.services.csv_enhancer import CSVEnhancer, _plain
+
+        job_id, unit_id = unit["job_id"], unit["unit_id"]
+        print(f"Worker {self.worker_id} processing unit {unit_id} of job {job_id} "
+              f"({unit['column']} rows {unit['start']}-{unit['stop']})")
+
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(self.heartbeat_seconds):
+                if not self.store.heartbeat(job_id, unit_id, self.worker_id, self.lease_seconds):
+                    print(f"Worker {self.worker_id} lost the lease on unit {unit_id} of job {job_id}")
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            df = self._load(unit["input_path"], unit["config"])
+            enhancer = CSVEnhancer(unit["config"], job_id=f"{job_id}:{unit_id}")
+            column, start = unit["column"], unit["start"]
+            # Work on a copy so the cached frame keeps the input values for later units
+            frame = df.iloc[start:unit["stop"]].copy()
+            if unit["stage"]:
+                self._apply_upstream(frame, unit)
+            before = frame[column].astype(object)
+            with enhancer.scheduled():
+                # Same path as a local run, including re-queueing values that break output constraints
+                enhancer._process_column(frame, column)
+            after = frame[column]
+            changed = (before.astype(str) != after.astype(str)) | (before.isna() != after.isna())
+            results = [[start + offset, _plain(after.iat[offset])] for offset in changed.to_numpy().nonzero()[0]]
+
+            result_path = os.path.join(unit["work_dir"], f"unit-{unit_id}.json")
+            write_json_atomic(result_path, results, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+            if not self.store.complete(job_id, unit_id, self.worker_id, result_path):
+                print(f"Worker {self.worker_id} finished unit {unit_id} of job {job_id} after losing its lease")
+        except Exception as e:
+            print(f"Worker {self.worker_id} failed on unit {unit_id} of job {job_id}. Error: {e}")
+            self.store.release(job_id, unit_id, self.worker_id, str(e))
+        finally:
+            stop_heartbeat.set()
+
+
+def _apply_results(df: Any, column: str, result_path: str, start: int = 0) -> None:
+    """Write the (row position, value) results of a unit into `column` of df, whose first row is `start`"""
+    with open(result_path) as f:
+        results = json.load(f)
+    position = df.columns.get_loc(column)
+    for row, value in results:
+        if start <= row < start + len(df):
+            df.iat[row - start, position] = value
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Distributed batch processing for Data Smith")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = subparsers.add_parser("worker", help="Claim and process batch units")
+    worker_parser.add_argument("--db", required=True, help="Path of the lease database")
+    worker_parser.add_argument("--exit-when-idle", action="store_true", help="Exit when no unit is left")
+
+    run_parser = subparsers.add_parser("run", help="Split a file into units and process it with local workers")
+    run_parser.add_argument("--db", required=True, help="Path of the lease database")
+    run_parser.add_argument("--input", required=True, help="Input CSV file")
+    run_parser.add_argument("--output", required=True, help="Output CSV file")
+    run_parser.add_argument("--config", required=True, help="Configuration JSON file")
+    run_parser.add_argument("--workers", type=int, default=2, help="Number of local worker processes")
+    run_parser.add_argument("--rows-per-unit", type=int, default=None, help="Rows per batch unit")
+
+    args = parser.parse_args(argv)
+    store = LeaseStore(args.db)
+
+    if args.command == "worker":
+        processed = LeaseWorker(store).run(exit_when_idle=args.exit_when_idle)
+        print(f"Worker done after {processed} units")
+    else:
+        with open(args.config) as f:
+            config = json.load(f)
+        summary = Coordinator(store).run(args.input, args.output, config, args.workers, args.rows_per_unit)
+        print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import inspect
+from functools import lru_cache
+from typing import Dict, Any, Callable, Optional, FrozenSet
+
+from backend.app.core.config import OPENAI_API_KEY, LLM_BACKEND
+
+
+def create_client() -> Any:
+    """Create the chat client for the configured LLM backend"""
+    if LLM_BACKEND == "fake":
+        from backend.app.services.fake_llm import FakeChatClient
+        return FakeChatClient()
+
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+
+@lru_cache(maxsize=None)
+def _parameters(function: Callable[..., Any]) -> Optional[FrozenSet[str]]:
+    """Return the keyword parameters of a function, or None if it takes any keyword"""
+    parameters = inspect.signature(function).parameters
+    if any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values()):
+        return None
+    return frozenset(parameters)
+
+
+def client_request(create: Callable[..., Any], request: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the keyword arguments for a client's `chat.completions.create` for an API request body
+
+    Request bodies use the fields of the API (they are also written to batch
+    files as they are). Fields the installed client has no parameter for yet,
+    such as `logprobs` with the pinned openai release, are sent in `extra_body`.
+    """
+    parameters = _parameters(getattr(create, "__func__", create))
+    if parameters is None:
+        return request
+    extra = {key: value for key, value in request.items() if key not in parameters}
+    if not extra:
+        return request
+    kwargs = {key: value for key, value in request.items() if key in parameters}
+    kwargs["extra_body"] = {**(request.get("extra_body") or {}), **extra}
+    return kwargs
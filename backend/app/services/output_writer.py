@@ -0,0 +1,133 @@
+import json
+import os
+import time
+from typing import Dict, Any, Optional, Iterator, BinaryIO
+
+import pandas as pd
+
+from backend.app.utils.file_utils import write_json_atomic
+from backend.app.utils.frame_utils import write_frame
+
+# Formats that can be appended to row range by row range
+APPENDABLE_FORMATS = ("csv", "jsonl")
+
+
+def partial_path_for(output_path: str) -> str:
+    return f"{output_path}.partial"
+
+
+def progress_path_for(output_path: str) -> str:
+    return f"{output_path}.progress.json"
+
+
+def read_progress(output_path: str) -> Optional[Dict[str, Any]]:
+    """Return the progress marker of an output that is being written, if any"""
+    try:
+        with open(progress_path_for(output_path)) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def iter_completed_bytes(output_path: str, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    """Return an iterator over the part of a partial output that holds complete rows only
+
+    The partial file is opened right away, so reading it keeps working when the
+    job commits (renames it) meanwhile. Raises FileNotFoundError if the job
+    already committed.
+    """
+    progress = read_progress(output_path) or {}
+    f = open(partial_path_for(output_path), "rb")
+    return _iter_prefix(f, progress.get("bytes_complete", 0), chunk_size)
+
+
+def _iter_prefix(f: BinaryIO, remaining: int, chunk_size: int) -> Iterator[bytes]:
+    with f:
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class IncrementalOutputWriter:
+    """Appends finished row ranges to `<output>.partial` and renames it into place when done
+
+    After every append a progress marker (`<output>.progress.json`) records how
+    many rows and bytes of the partial file are complete, so readers can
+    stream the finished head of the file while the job runs and an
+    interrupted run can resume after the last complete row range.
+    """
+
+    def __init__(self, output_path: str, total_rows: int, output_format: str = "csv",
+                 run_key: Optional[Dict[str, Any]] = None):
+        self.output_path = output_path
+        self.partial_path = partial_path_for(output_path)
+        self.progress_path = progress_path_for(output_path)
+        self.total_rows = total_rows
+        self.output_format = output_format
+        self.run_key = run_key or {}
+        self.rows_complete = 0
+        self.bytes_complete = 0
+
+    @property
+    def appendable(self) -> bool:
+        return self.output_format in APPENDABLE_FORMATS
+
+    def start(self, resume: bool = False) -> int:
+        """Prepare the partial output and return the first row that still has to be written"""
+        progress = read_progress(self.output_path)
+        if (resume and self.appendable and progress and not progress.get("complete")
+                and progress.get("run_key") == self.run_key and os.path.exists(self.partial_path)):
+            self.rows_complete = progress["rows_complete"]
+            self.bytes_complete = progress["bytes_complete"]
+            # Drop anything written after the last complete row range
+            with open(self.partial_path, "r+b") as f:
+                f.truncate(self.bytes_complete)
+        else:
+            self.rows_complete = 0
+            self.bytes_complete = 0
+            if self.appendable:
+                open(self.partial_path, "wb").close()
+        self._write_progress(complete=False)
+        return self.rows_complete
+
+    def append(self, rows: pd.DataFrame) -> None:
+        """Append the next range of finished rows"""
+        if self.appendable:
+            if self.output_format == "csv":
+                data = rows.to_csv(header=self.bytes_complete == 0, index=False)
+            else:
+                data = rows.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n" if len(rows) else ""
+            with open(self.partial_path, "ab") as f:
+                f.write(data.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                self.bytes_complete = f.tell()
+        self.rows_complete += len(rows)
+        self._write_progress(complete=False)
+
+    def commit(self, df: pd.DataFrame) -> None:
+        """Move the finished output into place atomically"""
+        if self.appendable:
+            if self.bytes_complete == 0:
+                # Nothing appended (empty input): still write the header
+                self.append(df.iloc[0:0])
+            os.replace(self.partial_path, self.output_path)
+        else:
+            tmp_path = f"{self.output_path}.tmp"
+            write_frame(df, tmp_path, self.output_format)
+            os.replace(tmp_path, self.output_path)
+        self._write_progress(complete=True)
+
+    def _write_progress(self, complete: bool) -> None:
+        write_json_atomic(self.progress_path, {
+            "rows_complete": self.rows_complete,
+            "bytes_complete": self.bytes_complete,
+            "total_rows": self.total_rows,
+            "format": self.output_format,
+            "complete": complete,
+            "updated_at": time.time(),
+            "run_key": self.run_key,
+        })
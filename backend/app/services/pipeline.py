@@ -0,0 +1,195 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from backend.app.services.job_profiler import current_job, run_in_job
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class _Failure:
+    """An exception raised by a stage worker, handed on to the consumer"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class PipelineStats:
+    """Busy, starved and blocked time of every stage of a job's pipelines
+
+    A stage is busy while it works on an item, starved while it waits for
+    input and blocked while its output queue is full. Utilization is the busy
+    share of the stage's worker time; the stage with the highest utilization
+    is the bottleneck.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self.runs = 0
+        self.seconds = 0.0
+
+    def stage(self, name: str, workers: int) -> None:
+        with self._lock:
+            self._stages.setdefault(name, {"workers": workers, "items": 0, "busy": 0.0, "starved": 0.0,
+                                           "blocked": 0.0, "worker_seconds": 0.0})
+
+    def add(self, name: str, **amounts: float) -> None:
+        with self._lock:
+            counts = self._stages[name]
+            for key, amount in amounts.items():
+                counts[key] += amount
+
+    def finish_run(self, seconds: float) -> None:
+        with self._lock:
+            self.runs += 1
+            self.seconds += seconds
+            for counts in self._stages.values():
+                counts["worker_seconds"] += seconds * counts["workers"]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for name, counts in self._stages.items():
+                worker_seconds = counts["worker_seconds"]
+                stages[name] = {
+                    "workers": counts["workers"],
+                    "items": counts["items"],
+                    "busy_seconds": counts["busy"],
+                    "starved_seconds": counts["starved"],
+                    "blocked_seconds": counts["blocked"],
+                    "utilization": counts["busy"] / worker_seconds if worker_seconds else 0.0,
+                }
+            bottleneck = max(stages, key=lambda name: stages[name]["utilization"]) if stages else None
+            return {"runs": self.runs, "seconds": self.seconds, "bottleneck": bottleneck, "stages": stages}
+
+
+class Pipeline:
+    """Runs items through stages of worker threads connected by bounded queues
+
+    Every stage is (name, function, workers). A stage's workers take items
+    from its input queue, apply the function and put the result on the next
+    stage's queue, so stages work on different items at the same time. Queues
+    hold at most `queue_size` items, which makes a fast stage wait for a slow
+    one instead of piling up results (backpressure). The consumer of `run` is
+    the last stage: it gets the results in completion order and its time
+    between results is reported as the "write" stage.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Any], int]], stats: Optional[PipelineStats] = None,
+                 queue_size: Optional[int] = None, sink_name: str = "write"):
+        self.stages = [(name, func, max(1, workers)) for name, func, workers in stages]
+        self.stats = stats or PipelineStats()
+        self.queue_size = queue_size
+        self.sink_name = sink_name
+        for name, _, workers in self.stages:
+            self.stats.stage(name, workers)
+        self.stats.stage(sink_name, 1)
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Yield the result of every item after the last stage"""
+        started = time.monotonic()
+        stop = threading.Event()
+        # One queue in front of every stage plus the output queue read by the consumer
+        queues = [queue.Queue(maxsize=self.queue_size or 2 * workers) for _, _, workers in self.stages]
+        queues.append(queue.Queue(maxsize=self.queue_size or 2))
+
+        # Stage threads work for the job of the thread running the pipeline (see job_profiler)
+        job_id = current_job()
+        threads = [threading.Thread(target=run_in_job, name="pipeline-feed", daemon=True,
+                                    args=(job_id, self._feed, items, queues[0], self.stages[0][2], stop))]
+        for number, (name, func, workers) in enumerate(self.stages):
+            remaining = [workers]
+            lock = threading.Lock()
+            downstream = self.stages[number + 1][2] if number + 1 < len(self.stages) else 1
+            for _ in range(workers):
+                threads.append(threading.Thread(target=run_in_job, name=f"pipeline-{name}", daemon=True, args=(
+                    job_id, self._work, name, func, queues[number], queues[number + 1], stop, remaining, lock,
+                    downstream)))
+        for thread in threads:
+            thread.start()
+
+        output = queues[-1]
+        try:
+            while True:
+                waited = time.monotonic()
+                item = output.get()
+                resumed = time.monotonic()
+                self.stats.add(self.sink_name, starved=resumed - waited)
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+                self.stats.add(self.sink_name, items=1, busy=time.monotonic() - resumed)
+        finally:
+            stop.set()
+            # Unblock workers waiting on full queues so they see the stop flag
+            for q in queues:
+                _drain(q)
+            for thread in threads:
+                thread.join()
+            self.stats.finish_run(time.monotonic() - started)
+
+    @staticmethod
+    def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, items: Iterable[Any], q: queue.Queue, consumers: int, stop: threading.Event) -> None:
+        try:
+            for item in items:
+                if not self._put(q, item, stop):
+                    return
+        except BaseException as e:
+            self._put(q, _Failure(e), stop)
+        for _ in range(consumers):
+            self._put(q, _DONE, stop)
+
+    def _work(self, name: str, func: Callable[[Any], Any], inbox: queue.Queue, outbox: queue.Queue,
+              stop: threading.Event, remaining: List[int], lock: threading.Lock, downstream: int) -> None:
+        while not stop.is_set():
+            waited = time.monotonic()
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                self.stats.add(name, starved=time.monotonic() - waited)
+                continue
+            started = time.monotonic()
+            self.stats.add(name, starved=started - waited)
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                result = item
+            else:
+                try:
+                    result = func(item)
+                except BaseException as e:
+                    result = _Failure(e)
+            finished = time.monotonic()
+            if not self._put(outbox, result, stop):
+                return
+            self.stats.add(name, items=1, busy=finished - started, blocked=time.monotonic() - finished)
+
+        # The last worker of a stage to finish closes the next stage's input
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(downstream):
+                self._put(outbox, _DONE, stop)
+
+
+def _drain(q: queue.Queue) -> None:
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
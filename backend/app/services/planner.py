@@ -0,0 +1,231 @@
+import csv
+from typing import Dict, List, Any, Optional, Sequence, TYPE_CHECKING
+
+from backend.app.services.context_limits import parse_context_limits
+from backend.app.services.row_filter import parse_row_filters
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Batch size used when a column has no explicit size and no token budget is configured
+DEFAULT_BATCH_SIZE = 10
+
+# Number of rows covered by one batch unit when a job is split across workers
+DEFAULT_UNIT_ROWS = 1000
+
+# Fixed prompt overhead (instructions and response format) in tokens
+PROMPT_OVERHEAD_TOKENS = 150
+
+# Completion tokens budgeted per entry in a batch
+COMPLETION_TOKENS_PER_ENTRY = 30
+
+# Token budget used to size batches from an upload profile when the config has none
+DEFAULT_TOKEN_BUDGET = 2000
+
+# Pandas is only imported by the functions working on DataFrames, so planning a
+# CSV file from the command line stays fast
+
+
+def pending_mask(df: "pd.DataFrame", column: str, config: Dict[str, Any]) -> "pd.Series":
+    """Return a boolean mask of the rows of `column` that need to be sent to the model"""
+    import pandas as pd
+
+    if config.get("ignore_valued_columns", {}).get(column, False):
+        values = df[column]
+        return values.isna() | values.astype(str).eq('')
+    return pd.Series(True, index=df.index)
+
+
+def _entry_overhead(column: str) -> int:
+    return len(f"Entry 0:\nContext: \nCurrent {column}: \n")
+
+
+def average_entry_chars(df: "pd.DataFrame", column: str, config: Dict[str, Any], limited: bool = False) -> float:
+    """Estimate the average rendered size of one entry of `column` in characters
+
+    Context values are measured after their `context_limits`, unless df's
+    context fields are `limited` already.
+    """
+    import pandas as pd
+
+    if len(df) == 0:
+        return 0.0
+    fields = [f for f in config.get("column_context", {}).get(column, []) if f in df.columns]
+    limits = {} if limited else parse_context_limits(config)
+    total = pd.Series(_entry_overhead(column), index=df.index)
+    for field in fields + [column]:
+        values = df[field].astype(object)
+        if field in limits and field != column:
+            values = limits[field].apply(values)
+        total = total + values.where(values.notna(), "").astype(str).str.len() + len(field) + 5
+    return float(total.mean())
+
+
+def profile_entry_chars(column: str, config: Dict[str, Any], profile: Dict[str, Any]) -> float:
+    """Estimate the average rendered size of one entry of `column` from an upload profile"""
+    stats = profile["columns"]
+    fields = [f for f in config.get("column_context", {}).get(column, []) if f in stats]
+    limits = parse_context_limits(config)
+    total = float(_entry_overhead(column))
+    for field in fields + [column]:
+        if field in stats:
+            length = stats[field]["avg_length"]
+            if field in limits and field != column:
+                length = limits[field].limit_length(length)
+            total += length * stats[field]["fill_rate"] + len(field) + 5
+    return total
+
+
+def is_complete(column: str, config: Dict[str, Any], profile: Optional[Dict[str, Any]]) -> bool:
+    """Return True if the profile shows that no row of `column` would be sent to the model"""
+    if not profile or not config.get("ignore_valued_columns", {}).get(column, False):
+        return False
+    stats = profile["columns"].get(column)
+    return stats is not None and stats["filled"] == profile["rows"]
+
+
+def batch_size_for(column: str, config: Dict[str, Any], avg_entry_chars: Optional[float] = None) -> int:
+    """Pick the batch size of a column
+
+    An explicit entry in `batch_sizes` always wins. Otherwise, when the config has a
+    `token_budget` (prompt + completion tokens per request) and the average entry
+    size is known, as many entries as fit into the budget are batched together.
+    """
+    explicit = config.get("batch_sizes", {}).get(column)
+    if explicit:
+        return max(1, int(explicit))
+
+    token_budget = config.get("token_budget")
+    if token_budget and avg_entry_chars:
+        # ~4 characters per token
+        per_entry = avg_entry_chars / 4 + COMPLETION_TOKENS_PER_ENTRY
+        return max(1, int((int(token_budget) - PROMPT_OVERHEAD_TOKENS) // per_entry))
+
+    return DEFAULT_BATCH_SIZE
+
+
+def dependency_stages(columns: List[str], column_context: Dict[str, List[str]]) -> List[List[str]]:
+    """Group columns into stages so each column runs after the enhanced columns it reads
+
+    Columns are enhanced in configuration order, so a column depends on an
+    earlier enhanced column that is part of its context.
+    """
+    stage_of: Dict[str, int] = {}
+    for position, column in enumerate(columns):
+        earlier = [stage_of[c] for c in columns[:position] if c in column_context.get(column, [])]
+        stage_of[column] = max(earlier) + 1 if earlier else 0
+    stages: List[List[str]] = [[] for _ in range(max(stage_of.values()) + 1)] if stage_of else []
+    for column in columns:
+        stages[stage_of[column]].append(column)
+    return stages
+
+
+def _stage_numbers(columns: List[str], config: Dict[str, Any]) -> Dict[str, int]:
+    stages = dependency_stages(columns, config.get("column_context", {}))
+    return {column: number for number, stage in enumerate(stages) for column in stage}
+
+
+def _column_units(column: str, pending: Sequence[bool], batch_size: int, rows_per_unit: int,
+                  stage: int = 0) -> List[Dict[str, Any]]:
+    units = []
+    for start in range(0, len(pending), rows_per_unit):
+        stop = min(start + rows_per_unit, len(pending))
+        count = int(sum(pending[start:stop]))
+        if count:
+            units.append({
+                "column": column,
+                "start": start,
+                "stop": stop,
+                "pending": count,
+                "batch_size": batch_size,
+                "stage": stage,
+            })
+    return units
+
+
+def plan_units(df: "pd.DataFrame", config: Dict[str, Any], rows_per_unit: int = DEFAULT_UNIT_ROWS) -> List[Dict[str, Any]]:
+    """Split a job into batch units of one column and a range of row positions
+
+    Ranges without any pending rows (or rows matching the column's row
+    filter) are left out, so a unit is only created where there is work to do.
+    Units of a column that reads another enhanced column get a later `stage`
+    (see `dependency_stages`) and must only run once the earlier stages are done.
+    """
+    filters = parse_row_filters(config)
+    columns = [column for column in config.get("column_context", {}) if column in df.columns]
+    stages = _stage_numbers(columns, config)
+    units = []
+    for column in columns:
+        mask = pending_mask(df, column, config).to_numpy()
+        if column in filters:
+            mask = mask & filters[column].mask(df).to_numpy()
+        batch_size = batch_size_for(column, config, average_entry_chars(df, column, config))
+        units.extend(_column_units(column, mask, batch_size, rows_per_unit, stages[column]))
+    return units
+
+
+def plan_csv(path: str, config: Dict[str, Any], rows_per_unit: int = DEFAULT_UNIT_ROWS,
+             profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Plan a job straight from a CSV file without loading it into pandas
+
+    Returns the units and per-column totals (rows to send, batch size, number
+    of requests and estimated prompt tokens). Empty cells are treated as
+    missing values, so counts can differ slightly from pandas' NA detection.
+    With the file's upload `profile`, columns it shows to be complete are not
+    scanned and are listed under `complete_columns`.
+    """
+    targets = list(config.get("column_context", {}))
+    complete = [c for c in targets if is_complete(c, config, profile)]
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        positions = {name: i for i, name in enumerate(header)}
+        columns = [c for c in targets if c in positions and c not in complete]
+
+        fields = {c: [positions[f] for f in config["column_context"][c] if f in positions] + [positions[c]]
+                  for c in columns}
+        filters = {c: f.row_predicate() for c, f in parse_row_filters(config).items() if c in columns}
+        # Context values are measured after their limits
+        limits = parse_context_limits(config)
+        limited = {c: {positions[f]: limits[f] for f in config["column_context"][c]
+                       if f in positions and f in limits and f != c} for c in columns}
+        pending = {c: [] for c in columns}
+        chars = {c: 0 for c in columns}
+        rows = 0
+
+        for row in reader:
+            rows += 1
+            values = dict(zip(header, row)) if filters else None
+            for column in columns:
+                is_pending = (not config.get("ignore_valued_columns", {}).get(column, False)
+                              or row[positions[column]] == "")
+                if is_pending and column in filters:
+                    is_pending = filters[column](values)
+                pending[column].append(is_pending)
+                if is_pending:
+                    chars[column] += sum(len(limited[column][i].apply_text(row[i]) if i in limited[column] else row[i])
+                                         + len(header[i]) + 5 for i in fields[column])
+
+    stages = _stage_numbers(columns, config)
+    units = []
+    totals = {}
+    for column in columns:
+        count = sum(pending[column])
+        avg_chars = chars[column] / count + _entry_overhead(column) if count else 0.0
+        batch_size = batch_size_for(column, config, avg_chars)
+        requests = -(-count // batch_size)
+        units.extend(_column_units(column, pending[column], batch_size, rows_per_unit, stages[column]))
+        totals[column] = {
+            "pending_rows": count,
+            "batch_size": batch_size,
+            "requests": requests,
+            "estimated_prompt_tokens": int(count * avg_chars / 4 + requests * PROMPT_OVERHEAD_TOKENS),
+        }
+
+    return {
+        "rows": rows,
+        "columns": totals,
+        "skipped_columns": [c for c in targets if c not in positions],
+        "complete_columns": [c for c in complete if c in positions],
+        "units": units,
+    }
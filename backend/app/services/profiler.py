@@ -0,0 +1,185 @@
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+from backend.app.core.config import PROFILE_DIR
+from backend.app.utils.file_utils import write_json_atomic
+
+# Rows read per chunk while profiling
+PROFILE_CHUNK_ROWS = 50000
+
+# Most frequent values reported per column
+TOP_VALUES = 10
+
+# Candidate values tracked per column for the top values; rarer ones are dropped after each chunk
+TOP_VALUE_CANDIDATES = 1000
+
+# HyperLogLog precision: 2^12 registers, ~1.6% standard error
+HLL_PRECISION = 12
+
+# Pandas and NumPy are imported by the functions that read data, so the
+# module can be imported to look up cached profiles without them
+
+
+class HyperLogLog:
+    """Approximate distinct counter over 64-bit hashes"""
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        import numpy as np
+
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes: Any) -> None:
+        """Add an array of uint64 hashes"""
+        import numpy as np
+
+        if len(hashes) == 0:
+            return
+        p = self.precision
+        buckets = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        # Rank = position of the first 1 bit in the remaining 64 - p bits. Only the top
+        # 53 bits are kept so the float conversion in frexp is exact.
+        rest = (hashes << np.uint64(p)) >> np.uint64(11)
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        ranks = np.minimum(53 - bit_length + 1, 64 - p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def count(self) -> int:
+        import numpy as np
+
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.power(2.0, -self.registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Linear counting is more accurate for small cardinalities
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class _ColumnProfile:
+    """Running statistics of one column"""
+
+    def __init__(self):
+        self.nulls = 0
+        self.empty = 0
+        self.filled = 0
+        self.total_length = 0
+        self.max_length = 0
+        self.distinct = HyperLogLog()
+        self.candidates: Dict[str, int] = {}
+
+    def update(self, values: Any) -> None:
+        import pandas as pd
+
+        missing = values.isna()
+        text = values[~missing]
+        stripped = text.str.strip()
+        filled = text[stripped != ""]
+        self.nulls += int(missing.sum())
+        self.empty += len(text) - len(filled)
+        self.filled += len(filled)
+
+        if len(filled):
+            lengths = filled.str.len()
+            self.total_length += int(lengths.sum())
+            self.max_length = max(self.max_length, int(lengths.max()))
+            self.distinct.add_hashes(pd.util.hash_pandas_object(filled, index=False).to_numpy())
+            for value, count in filled.value_counts().items():
+                self.candidates[value] = self.candidates.get(value, 0) + int(count)
+            if len(self.candidates) > TOP_VALUE_CANDIDATES:
+                kept = sorted(self.candidates.items(), key=lambda item: -item[1])[:TOP_VALUE_CANDIDATES]
+                self.candidates = dict(kept)
+
+    def result(self, rows: int) -> Dict[str, Any]:
+        top = sorted(self.candidates.items(), key=lambda item: -item[1])[:TOP_VALUES]
+        return {
+            "nulls": self.nulls,
+            "empty": self.empty,
+            "filled": self.filled,
+            "fill_rate": self.filled / rows if rows else 0.0,
+            "approx_distinct": min(self.distinct.count(), self.filled),
+            "avg_length": self.total_length / self.filled if self.filled else 0.0,
+            "max_length": self.max_length,
+            "top_values": [[value, count] for value, count in top],
+        }
+
+
+def profile_csv(path: str, chunk_rows: int = PROFILE_CHUNK_ROWS) -> Dict[str, Any]:
+    """Profile every column of a CSV file in one chunked pass
+
+    Values are read as text, so lengths and top values are those of the file.
+    Top values are approximate for columns with many distinct values.
+    """
+    import pandas as pd
+
+    started = time.time()
+    rows = 0
+    columns: Dict[str, _ColumnProfile] = {}
+    with pd.read_csv(path, dtype=str, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            if not columns:
+                columns = {column: _ColumnProfile() for column in chunk.columns}
+            rows += len(chunk)
+            for column, profile in columns.items():
+                profile.update(chunk[column])
+    if not columns:
+        # Header only
+        columns = {column: _ColumnProfile() for column in pd.read_csv(path, nrows=0).columns}
+
+    return {
+        "rows": rows,
+        "columns": {column: profile.result(rows) for column, profile in columns.items()},
+        "elapsed_seconds": time.time() - started,
+    }
+
+
+# Content hashes by (path, size, mtime) so unchanged files are not hashed again
+_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_sha256(path: str) -> str:
+    """Return the SHA-256 of a file's content"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def _profile_path(content_hash: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{content_hash}.json")
+
+
+def cached_profile(content_hash: str) -> Optional[Dict[str, Any]]:
+    """Return the stored profile of a file content, if there is one"""
+    try:
+        with open(_profile_path(content_hash)) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def get_profile(path: str, content_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Return the profile of a CSV file, profiling it only if its content was not seen before"""
+    content_hash = content_hash or file_sha256(path)
+    profile = cached_profile(content_hash)
+    if profile is None:
+        profile = profile_csv(path)
+        profile["content_hash"] = content_hash
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        write_json_atomic(_profile_path(content_hash), profile)
+    return profile
+
+
+def complete_columns(profile: Dict[str, Any]) -> List[str]:
+    """Return the columns without any null or empty value"""
+    return [column for column, stats in profile["columns"].items() if stats["filled"] == profile["rows"]]
@@ -0,0 +1,187 @@
+import json
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+# Providers cache the longest previously seen prompt prefix, so every batch
+# prompt starts with text that never changes within a job: first the general
+# task, then what is specific to the column (instructions, answer format).
+# Only the user message with the entries differs from batch to batch.
+
+TASK_PREFIX = """You are cleaning and enhancing a dataset. Each entry has various attributes that may need validation or filling in.
+You get a numbered list of entries. Each entry shows its context values and the current value of the column to correct ("Missing" when it is empty). An entry may also say why a previous value was rejected; give a value that fixes this.
+Answer every entry you can.
+"""
+
+COLUMN_SECTION = """
+Your task is to assess and correct the {column} values using the given context.
+{instruction}{confidence_note}
+{reply_instructions}"""
+
+CONFIDENCE_NOTE = "\nFor each entry, also give your confidence that the value is correct, from 0 to 1.\n"
+
+# How the model is asked to answer:
+#   objects      [{"Index": 1, "<column>": "<value>"}, ...] (the original format)
+#   positional   ["<value of entry 1>", "<value of entry 2>", ...]
+#   json_schema  {"values": [...]}, enforced by the API's structured outputs
+# The compact formats don't repeat the index and column name for every entry,
+# which saves output tokens.
+REPLY_FORMATS = ("objects", "positional", "json_schema")
+DEFAULT_REPLY_FORMAT = "objects"
+
+OBJECTS_REPLY = """Keep the entry numbers as the "Index" of your answers and respond in the following format (not JSON):
+[
+  {answer_format},
+  {{"Index": 2, ...}}
+]
+"""
+
+POSITIONAL_REPLY = """Respond with only a JSON array with one value per entry, in the order of the entries, and null for entries you cannot answer:
+{answer_format}
+"""
+
+SCHEMA_REPLY = """Respond with the {column} value of every entry in "values", in the order of the entries, and null for entries you cannot answer.{confidences}
+"""
+
+
+class PromptTemplate:
+    """Batch prompt of one column: a byte-stable system message and the entries as the user message"""
+
+    def __init__(self, column: str, instruction: str = "", ask_confidence: bool = False,
+                 reply_format: str = DEFAULT_REPLY_FORMAT):
+        self.column = column
+        self.ask_confidence = ask_confidence
+        self.reply_format = reply_format
+        # Extra request parameters (the schema of structured outputs)
+        self.request_options: Dict[str, Any] = {}
+
+        if reply_format == "positional":
+            answer_format = '["<value of entry 1>", "<value of entry 2>", ...]'
+            if ask_confidence:
+                answer_format = '[["<value of entry 1>", <confidence 0 to 1>], ["<value of entry 2>", <confidence>], ...]'
+            reply_instructions = POSITIONAL_REPLY.format(answer_format=answer_format)
+        elif reply_format == "json_schema":
+            confidences = " Give your confidences in \"confidences\", in the same order." if ask_confidence else ""
+            reply_instructions = SCHEMA_REPLY.format(column=column, confidences=confidences)
+            self.request_options["response_format"] = reply_schema(ask_confidence)
+        else:
+            answer_format = f'{{"Index": 1, "{column}": "<Corrected Value>"}}'
+            if ask_confidence:
+                answer_format = f'{{"Index": 1, "{column}": "<Corrected Value>", "confidence": <0 to 1>}}'
+            reply_instructions = OBJECTS_REPLY.format(answer_format=answer_format)
+
+        self.system = TASK_PREFIX + COLUMN_SECTION.format(
+            column=column,
+            instruction=f"\n{instruction.strip()}\n" if instruction and instruction.strip() else "",
+            confidence_note=CONFIDENCE_NOTE if ask_confidence else "",
+            reply_instructions=reply_instructions,
+        )
+
+    def user(self, entries: List[str]) -> str:
+        return "Here are multiple entries:\n" + "".join(entries)
+
+    def messages(self, entries: List[str]) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user(entries)},
+        ]
+
+    def load_reply(self, text: str) -> Any:
+        """Parse a reply, taking the compact formats out of any text around them"""
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            if self.reply_format == "objects":
+                raise
+            opening, closing = ("{", "}") if self.reply_format == "json_schema" else ("[", "]")
+            start, end = text.find(opening), text.rfind(closing)
+            if start < 0 or end < start:
+                raise
+            return json.loads(text[start:end + 1])
+
+    def read_reply(self, parsed: Any) -> List[Tuple[int, bool, Any, Optional[float]]]:
+        """Return (entry number, has a value, value, reported confidence) per answer, in reply order"""
+        answers = []
+        if self.reply_format == "objects":
+            for result in parsed:
+                answers.append((result.get("Index"), self.column in result, result.get(self.column),
+                                result.get("confidence")))
+            return answers
+
+        if self.reply_format == "json_schema":
+            values = parsed["values"]
+            confidences = parsed.get("confidences") or []
+        else:
+            values = parsed
+            confidences = []
+            if self.ask_confidence:
+                pairs = [value if isinstance(value, list) else [value, None] for value in values]
+                values = [pair[0] if pair else None for pair in pairs]
+                confidences = [pair[1] if len(pair) > 1 else None for pair in pairs]
+        for number, value in enumerate(values):
+            confidence = confidences[number] if number < len(confidences) else None
+            answers.append((number + 1, value is not None, value, confidence))
+        return answers
+
+
+def reply_schema(ask_confidence: bool) -> Dict[str, Any]:
+    """Return the structured outputs `response_format` of the json_schema reply format"""
+    properties: Dict[str, Any] = {"values": {"type": "array", "items": {"type": ["string", "number", "null"]}}}
+    if ask_confidence:
+        properties["confidences"] = {"type": "array", "items": {"type": "number"}}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "column_values",
+            "strict": True,
+            "schema": {"type": "object", "properties": properties, "required": list(properties),
+                       "additionalProperties": False},
+        },
+    }
+
+
+def cached_tokens(usage: Any) -> int:
+    """Return the prompt tokens a response reports as served from the provider's prompt cache"""
+    if usage is None:
+        return 0
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    value = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return int(value or 0)
+
+
+class PromptCacheStats:
+    """Prompt tokens billed vs. served from the provider's prefix cache over a job's requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.requests_with_hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefix_tokens = 0
+
+    def record(self, usage: Any, prefix_chars: int) -> None:
+        if usage is None:
+            return
+        prompt_tokens = usage.get("prompt_tokens") if isinstance(usage, dict) else getattr(usage, "prompt_tokens", 0)
+        cached = cached_tokens(usage)
+        with self._lock:
+            self.requests += 1
+            self.requests_with_hits += 1 if cached else 0
+            self.prompt_tokens += prompt_tokens or 0
+            self.cached_tokens += cached
+            # Rough estimate (~4 characters per token) of the static part of the prompts
+            self.prefix_tokens += prefix_chars // 4
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "requests_with_hits": self.requests_with_hits,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                # Share of prompt tokens read from the cache, and of the static prefixes that were
+                "hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "prefix_hit_rate": min(1.0, self.cached_tokens / self.prefix_tokens) if self.prefix_tokens else 0.0,
+            }
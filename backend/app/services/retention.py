@@ -0,0 +1,256 @@
+import gzip
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Set
+
+from backend.app.core.config import (
+    UPLOAD_DIR, RESULT_DIR, COLUMN_STORE_DIR, STORAGE_MAX_BYTES, STORAGE_MAX_AGE_HOURS, RETENTION_INTERVAL_SECONDS
+)
+from backend.app.services.output_writer import partial_path_for
+
+# Results are kept compressed at rest under this suffix
+COMPRESSED_SUFFIX = ".gz"
+
+# Files kept next to a result that belong to it (and are removed with it)
+COMPANION_SUFFIXES = (COMPRESSED_SUFFIX, ".partial", ".progress.json")
+
+# Files used this recently are not compressed by a sweep or evicted for the size
+# quota (e.g. an upload that is about to be processed or a result being downloaded)
+MIN_IDLE_SECONDS = 600
+
+# Parquet files are compressed already
+PARQUET_MAGIC = b"PAR1"
+
+COPY_CHUNK_BYTES = 1 << 20
+
+
+def compressed_path_for(path: str) -> str:
+    return f"{path}{COMPRESSED_SUFFIX}"
+
+
+def touch(path: str) -> None:
+    """Mark a stored file as used now, for least-recently-used eviction"""
+    try:
+        stat = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def compress_file(path: str) -> int:
+    """Replace a file with a gzip-compressed copy and return the bytes saved (0 if left as is)"""
+    with open(path, "rb") as f:
+        if f.read(len(PARQUET_MAGIC)) == PARQUET_MAGIC:
+            return 0
+    stat = os.stat(path)
+    target = compressed_path_for(path)
+    with open(path, "rb") as src, gzip.open(f"{target}.tmp", "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+    # Keep the times, so compressing doesn't count as a use
+    os.utime(f"{target}.tmp", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(f"{target}.tmp", target)
+    os.remove(path)
+    return stat.st_size - os.path.getsize(target)
+
+
+def iter_decompressed(path: str, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    """Yield the content of a gzip-compressed file, for clients that don't accept gzip"""
+    with gzip.open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def _base_path(path: str) -> str:
+    for suffix in COMPANION_SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+class RetentionManager:
+    """Keeps storage directories within size and age quotas
+
+    Files are grouped with their companions (a result with its compressed
+    copy, partial output and progress marker), subdirectories (e.g. the
+    column store of a result) form one group, and a group is kept or removed
+    as a whole. A sweep compresses finished files in the `compressed`
+    directories, removes groups not used for `max_age_seconds` and, while the
+    total size is over `max_bytes`, the least recently used groups (by access
+    time, see `touch`). Groups that `referenced()` returns the path of, i.e.
+    that running jobs need, are never compressed or removed.
+    """
+
+    def __init__(self, directories: Dict[str, str], compressed: Iterable[str] = (), max_bytes: int = 0,
+                 max_age_seconds: float = 0, interval: float = RETENTION_INTERVAL_SECONDS,
+                 referenced: Optional[Callable[[], Set[str]]] = None):
+        self.directories = directories
+        self.compressed = set(compressed)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.interval = interval
+        self.referenced = referenced or set
+        self.last_sweep: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _groups(self) -> List[Dict[str, Any]]:
+        """Return the file groups of all directories"""
+        groups: Dict[str, Dict[str, Any]] = {}
+        for name, directory in self.directories.items():
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    base = os.path.abspath(entry.path)
+                    files = [os.path.join(root, file) for root, _, names in os.walk(base) for file in names]
+                elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(".tmp"):
+                    base = os.path.abspath(_base_path(entry.path))
+                    files = [os.path.abspath(entry.path)]
+                else:
+                    continue
+                group = groups.setdefault(base, {"path": base, "directory": name, "files": [], "bytes": 0,
+                                                 "last_used": 0.0, "is_dir": entry.is_dir(follow_symlinks=False)})
+                for path in files:
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    group["files"].append(path)
+                    group["bytes"] += stat.st_size
+                    group["last_used"] = max(group["last_used"], stat.st_atime, stat.st_mtime)
+        return list(groups.values())
+
+    def usage(self) -> Dict[str, Any]:
+        """Report files, bytes and the oldest last use per directory against the quotas"""
+        now = time.time()
+        directories = {name: {"path": path, "files": 0, "bytes": 0, "oldest_use_seconds": None}
+                       for name, path in self.directories.items()}
+        for group in self._groups():
+            usage = directories[group["directory"]]
+            usage["files"] += len(group["files"])
+            usage["bytes"] += group["bytes"]
+            idle = now - group["last_used"]
+            usage["oldest_use_seconds"] = max(usage["oldest_use_seconds"] or 0.0, idle)
+        total = sum(usage["bytes"] for usage in directories.values())
+        return {
+            "directories": directories,
+            "total_bytes": total,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "quota_used": total / self.max_bytes if self.max_bytes else None,
+            "last_sweep": self.last_sweep,
+        }
+
+    def sweep(self) -> Dict[str, Any]:
+        """Compress finished files and enforce the age and size quotas once"""
+        with self._lock:
+            started = time.time()
+            referenced = {os.path.abspath(path) for path in self.referenced()}
+            report: Dict[str, Any] = {"compressed": 0, "bytes_saved": 0, "removed": [], "bytes_removed": 0}
+
+            for group in self._groups():
+                if group["directory"] not in self.compressed or group["path"] in referenced or group["is_dir"]:
+                    continue
+                # Only finished files that are not compressed yet, not being written and not just downloaded
+                files = group["files"]
+                if group["path"] not in files or partial_path_for(group["path"]) in files:
+                    continue
+                if started - group["last_used"] < MIN_IDLE_SECONDS:
+                    continue
+                try:
+                    saved = compress_file(group["path"])
+                except OSError as e:
+                    print(f"Failed to compress {group['path']}. Reason: {e}")
+                    continue
+                if saved:
+                    report["compressed"] += 1
+                    report["bytes_saved"] += saved
+
+            groups = [group for group in self._groups() if group["path"] not in referenced]
+            groups.sort(key=lambda group: group["last_used"])
+            total = sum(group["bytes"] for group in self._groups())
+            for group in groups:
+                idle = started - group["last_used"]
+                if self.max_age_seconds and idle > self.max_age_seconds:
+                    reason = "age"
+                elif self.max_bytes and total > self.max_bytes and idle > MIN_IDLE_SECONDS:
+                    reason = "size"
+                else:
+                    continue
+                self._remove(group, reason, report)
+                total -= group["bytes"]
+
+            report["total_bytes"] = total
+            report["finished_at"] = time.time()
+            report["elapsed_seconds"] = report["finished_at"] - started
+            self.last_sweep = report
+        if report["removed"] or report["compressed"]:
+            print(f"Retention sweep compressed {report['compressed']} files and removed {len(report['removed'])} "
+                  f"({report['bytes_removed'] / 1e6:.1f} MB); {total / 1e6:.1f} MB in use")
+        return report
+
+    @staticmethod
+    def _remove(group: Dict[str, Any], reason: str, report: Dict[str, Any]) -> None:
+        paths = [group["path"]] if group["is_dir"] else group["files"]
+        for path in paths:
+            try:
+                if group["is_dir"]:
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                print(f"Failed to delete {path}. Reason: {e}")
+        report["removed"].append({"path": group["path"], "bytes": group["bytes"], "reason": reason})
+        report["bytes_removed"] += group["bytes"]
+
+    def start(self) -> None:
+        """Sweep in a background thread every `interval` seconds"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Retention sweep failed. Error: {e}")
+            self._stop.wait(self.interval)
+
+
+def _active_job_files() -> Set[str]:
+    from backend.app.services.jobs import job_registry
+
+    paths = set()
+    for job in job_registry.active():
+        paths.add(os.path.join(UPLOAD_DIR, job["filename"]))
+        paths.add(os.path.join(RESULT_DIR, job["result_file"]))
+        paths.add(os.path.join(COLUMN_STORE_DIR, job["result_file"]))
+    return paths
+
+
+_manager = RetentionManager(
+    {"uploads": UPLOAD_DIR, "results": RESULT_DIR, "columns": COLUMN_STORE_DIR},
+    compressed=("results",),
+    max_bytes=STORAGE_MAX_BYTES,
+    max_age_seconds=STORAGE_MAX_AGE_HOURS * 3600,
+    referenced=_active_job_files,
+)
+
+
+def get_retention_manager() -> RetentionManager:
+    """Return the retention manager of the API's upload and result directories"""
+    return _manager
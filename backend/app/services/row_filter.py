@@ -0,0 +1,252 @@
+import ast
+import io
+import operator
+import re
+import tokenize
+from typing import Dict, Any, Callable, List, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Row filters use a safe subset of pandas query syntax:
+#   Category == 'Electronics' and Price > 100
+#   `Unit Price` >= 10 | ~(Status in ['sold', 'archived'])
+# Only column names, literals (strings, numbers, booleans, lists of them),
+# comparisons, `in` / `not in` and boolean operators (and/or/not, &/|/~) are
+# allowed. The same parsed filter is evaluated vectorized on DataFrames and
+# row by row on the text values of a CSV file (for `plan`).
+
+# Pandas is only imported when filtering a DataFrame, so planning a CSV file
+# from the command line stays fast
+
+_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+_BACKTICK_PATTERN = re.compile(r"`([^`]*)`")
+
+# As in pandas queries, &, | and ~ have the precedence of and, or and not
+_BOOLEAN_TOKENS = {"&": "and", "|": "or", "~": "not"}
+
+
+class RowFilterError(ValueError):
+    """Raised when a row filter is not valid"""
+
+
+class RowFilter:
+    """A parsed, validated row filter expression"""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        # Backtick-quoted names (with spaces etc.) are replaced by placeholders before parsing
+        self._names: Dict[str, str] = {}
+
+        def placeholder(match: "re.Match") -> str:
+            name = f"__column_{len(self._names)}"
+            self._names[name] = match.group(1)
+            return name
+
+        try:
+            source = _boolean_keywords(_BACKTICK_PATTERN.sub(placeholder, expression).strip())
+            tree = ast.parse(source, mode="eval")
+        except (SyntaxError, tokenize.TokenError) as e:
+            raise RowFilterError(f"Invalid row filter '{expression}': {e.args[0]}")
+        self._tree = tree.body
+        self.columns: Set[str] = set()
+        self._check(self._tree)
+
+    def _column(self, node: ast.Name) -> str:
+        return self._names.get(node.id, node.id)
+
+    def _check(self, node: ast.AST) -> None:
+        if isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check(value)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            self._check(node.operand)
+        elif isinstance(node, ast.Compare):
+            for op, operand in zip(node.ops, node.comparators):
+                if type(op) not in _COMPARISONS and not isinstance(op, (ast.In, ast.NotIn)):
+                    raise RowFilterError(f"Unsupported comparison in row filter '{self.expression}'")
+                if isinstance(op, (ast.In, ast.NotIn)) and not isinstance(operand, (ast.List, ast.Tuple)):
+                    raise RowFilterError(f"'in' needs a list of values in row filter '{self.expression}'")
+            for operand in [node.left] + node.comparators:
+                self._check_operand(operand)
+        else:
+            raise RowFilterError(f"Unsupported expression '{ast.unparse(node)}' in row filter '{self.expression}'")
+
+    def _check_operand(self, node: ast.AST) -> None:
+        if isinstance(node, ast.Name):
+            self.columns.add(self._column(node))
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            for element in node.elts:
+                if not _is_literal(element):
+                    raise RowFilterError(f"Lists in row filter '{self.expression}' may only hold literals")
+        elif not _is_literal(node):
+            raise RowFilterError(f"Unsupported value '{ast.unparse(node)}' in row filter '{self.expression}'")
+
+    # Vectorized evaluation
+
+    def mask(self, df: "pd.DataFrame") -> "pd.Series":
+        """Return a boolean Series of the rows of df matching the filter"""
+        missing = self.columns - set(df.columns)
+        if missing:
+            raise RowFilterError(f"Row filter '{self.expression}' uses unknown columns: {', '.join(sorted(missing))}")
+        return self._frame_eval(self._tree, df).fillna(False).astype(bool)
+
+    def _frame_eval(self, node: ast.AST, df: "pd.DataFrame") -> Any:
+        if isinstance(node, ast.BoolOp):
+            results = [self._frame_eval(value, df) for value in node.values]
+            combined = results[0]
+            for result in results[1:]:
+                combined = combined & result if isinstance(node.op, ast.And) else combined | result
+            return combined
+        if isinstance(node, ast.UnaryOp):
+            return ~self._frame_eval(node.operand, df)
+
+        # Comparison, possibly chained (10 < Price <= 100)
+        import pandas as pd
+
+        result = pd.Series(True, index=df.index)
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            result &= self._frame_compare(op, left, right, df)
+            left = right
+        return result
+
+    def _frame_value(self, node: ast.AST, df: "pd.DataFrame", other: ast.AST) -> Any:
+        import pandas as pd
+
+        if not isinstance(node, ast.Name):
+            return _literal(node)
+        series = df[self._column(node)]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        # Text columns compared with numbers are compared numerically
+        literal = _literal(other) if not isinstance(other, ast.Name) else None
+        if _is_number(literal) and not pd.api.types.is_numeric_dtype(series.dtype):
+            series = pd.to_numeric(series, errors="coerce")
+        return series
+
+    def _frame_compare(self, op: ast.cmpop, left: ast.AST, right: ast.AST, df: "pd.DataFrame") -> "pd.Series":
+        import pandas as pd
+
+        if isinstance(op, (ast.In, ast.NotIn)):
+            values = _literal(right)
+            series = self._frame_value(left, df, right.elts[0] if right.elts else right)
+            matches = series.isin(values) if isinstance(series, pd.Series) else pd.Series(series in values, index=df.index)
+            return ~matches if isinstance(op, ast.NotIn) else matches
+        result = _COMPARISONS[type(op)](self._frame_value(left, df, right), self._frame_value(right, df, left))
+        if not isinstance(result, pd.Series):
+            result = pd.Series(bool(result), index=df.index)
+        return result
+
+    # Row by row evaluation on CSV text values
+
+    def row_predicate(self) -> Callable[[Dict[str, str]], bool]:
+        """Return a function testing one CSV row (a dict of column name to text)"""
+        return lambda row: bool(self._row_eval(self._tree, row))
+
+    def _row_eval(self, node: ast.AST, row: Dict[str, str]) -> bool:
+        if isinstance(node, ast.BoolOp):
+            results = (self._row_eval(value, row) for value in node.values)
+            return all(results) if isinstance(node.op, ast.And) else any(results)
+        if isinstance(node, ast.UnaryOp):
+            return not self._row_eval(node.operand, row)
+
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if not self._row_compare(op, left, right, row):
+                return False
+            left = right
+        return True
+
+    def _row_value(self, node: ast.AST, row: Dict[str, str], other: ast.AST) -> Any:
+        if not isinstance(node, ast.Name):
+            return _literal(node)
+        text = row.get(self._column(node), "")
+        if text == "":
+            return None
+        literal = _literal(other) if not isinstance(other, ast.Name) else None
+        if _is_number(literal) or isinstance(other, ast.Name):
+            try:
+                return float(text)
+            except ValueError:
+                return None if _is_number(literal) else text
+        return text
+
+    def _row_compare(self, op: ast.cmpop, left: ast.AST, right: ast.AST, row: Dict[str, str]) -> bool:
+        if isinstance(op, (ast.In, ast.NotIn)):
+            values = _literal(right)
+            value = self._row_value(left, row, right.elts[0] if right.elts else right)
+            found = value is not None and value in values
+            return not found if isinstance(op, ast.NotIn) else found
+        a, b = self._row_value(left, row, right), self._row_value(right, row, left)
+        # Missing values only match `!=`, like NaN in pandas
+        if a is None or b is None:
+            return isinstance(op, ast.NotEq)
+        try:
+            return bool(_COMPARISONS[type(op)](a, b))
+        except TypeError:
+            return isinstance(op, ast.NotEq)
+
+
+def _boolean_keywords(source: str) -> str:
+    """Rewrite the &, | and ~ operators of a query to and, or and not"""
+    tokens = []
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type == tokenize.OP and token.string in _BOOLEAN_TOKENS:
+            token = token._replace(type=tokenize.NAME, string=f" {_BOOLEAN_TOKENS[token.string]} ")
+        tokens.append(token)
+    # A leading ~ would otherwise leave a leading space, which ast.parse rejects as an indent
+    return tokenize.untokenize(tokens).strip()
+
+
+def _is_literal(node: ast.AST) -> bool:
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return isinstance(node.operand, ast.Constant) and _is_number(node.operand.value)
+    return isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float, bool))
+
+
+def _literal(node: ast.AST) -> Any:
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_literal(element) for element in node.elts]
+    return ast.literal_eval(node)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_row_filters(config: Dict[str, Any]) -> Dict[str, RowFilter]:
+    """Parse the `row_filters` of a config, keyed by the column they limit"""
+    return {column: RowFilter(expression) for column, expression in config.get("row_filters", {}).items()}
+
+
+def validate_row_filters(config: Dict[str, Any], columns: List[str] = None) -> List[str]:
+    """Check the `row_filters` of a config and return a list of problems"""
+    filters = config.get("row_filters", {})
+    if not isinstance(filters, dict):
+        return ["'row_filters' must be an object keyed by column"]
+
+    errors = []
+    for column, expression in filters.items():
+        if column not in config.get("column_context", {}):
+            errors.append(f"'row_filters' has an entry for '{column}', which is not in 'column_context'")
+        if not isinstance(expression, str):
+            errors.append(f"'row_filters.{column}' must be a string")
+            continue
+        try:
+            row_filter = RowFilter(expression)
+        except RowFilterError as e:
+            errors.append(str(e))
+            continue
+        if columns is not None:
+            for name in sorted(row_filter.columns - set(columns)):
+                errors.append(f"Row filter of '{column}' uses column '{name}', which is not in the file")
+    return errors
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any
+
+from backend.app.services.planner import pending_mask
+from backend.app.services.row_filter import parse_row_filters
+
+# Columns with more distinct values than this are not used to form strata
+MAX_STRATUM_VALUES = 50
+
+# Number of category columns combined into strata
+MAX_STRATUM_COLUMNS = 2
+
+
+def _category_columns(df: pd.DataFrame, config: Dict[str, Any]) -> List[str]:
+    """Pick low-cardinality columns to stratify by, preferring context columns"""
+    context = {f for fields in config.get("column_context", {}).values() for f in fields}
+    candidates = []
+    for column in df.columns:
+        if column in config.get("column_context", {}):
+            continue
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object or series.dtype == bool:
+            distinct = series.nunique(dropna=False)
+            if 1 < distinct <= MAX_STRATUM_VALUES:
+                candidates.append((column not in context, distinct, column))
+    return [column for _, _, column in sorted(candidates)[:MAX_STRATUM_COLUMNS]]
+
+
+def stratified_sample(df: pd.DataFrame, config: Dict[str, Any], sample_size: int, seed: int = 0) -> pd.DataFrame:
+    """Draw a sample that covers every combination of pending state and category value
+
+    Strata are formed by whether each configured column would be sent to the
+    model (`ignore_valued_columns` and `row_filters`) and by the values of up
+    to two low-cardinality columns. Every stratum gets at least one row while there
+    is room; the rest of the sample is split proportionally to stratum size.
+    """
+    if sample_size >= len(df):
+        return df.copy()
+
+    filters = parse_row_filters(config)
+    keys = []
+    for column in config.get("column_context", {}):
+        if column in df.columns:
+            pending = pending_mask(df, column, config)
+            if column in filters:
+                pending = pending & filters[column].mask(df)
+            keys.append(pending.rename(f"pending:{column}"))
+    keys += [df[column].astype(object).where(df[column].notna(), None) for column in _category_columns(df, config)]
+    if not keys:
+        return df.sample(n=sample_size, random_state=seed)
+
+    strata = pd.concat(keys, axis=1).astype(str).agg("|".join, axis=1)
+    positions = {key: np.asarray(rows) for key, rows in strata.groupby(strata.to_numpy()).indices.items()}
+    ordered = sorted(positions, key=lambda key: -len(positions[key]))
+
+    # One row per stratum (largest first), then proportional shares of what is left
+    allocation = {key: 0 for key in ordered}
+    for key in ordered[:sample_size]:
+        allocation[key] = 1
+    remaining = sample_size - sum(allocation.values())
+    if remaining > 0:
+        spare = {key: len(positions[key]) - allocation[key] for key in ordered}
+        total_spare = sum(spare.values())
+        for key in ordered:
+            extra = min(spare[key], int(remaining * spare[key] / total_spare))
+            allocation[key] += extra
+        # Hand out rounding leftovers to the largest strata with rows to spare
+        leftover = sample_size - sum(allocation.values())
+        for key in ordered:
+            if leftover <= 0:
+                break
+            if allocation[key] < len(positions[key]):
+                allocation[key] += 1
+                leftover -= 1
+
+    rng = np.random.default_rng(seed)
+    chosen = [rng.choice(positions[key], size=count, replace=False) for key, count in allocation.items() if count]
+    return df.iloc[np.sort(np.concatenate(chosen))].copy()
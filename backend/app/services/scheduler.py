@@ -0,0 +1,323 @@
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
+
+from backend.app.core.config import (
+    MAX_CONCURRENT_REQUESTS,
+    REQUESTS_PER_MINUTE,
+    TOKENS_PER_MINUTE,
+    TENANT_MAX_CONCURRENCY,
+)
+
+# Lower value wins; interactive work (previews) always goes ahead of bulk jobs
+PRIORITY_CLASSES = {"interactive": 0, "bulk": 1}
+
+# Number of finished jobs whose stats are kept around for the API
+FINISHED_JOBS_TO_KEEP = 200
+
+
+class SlotUnavailable(Exception):
+    """Raised when a non-blocking slot request finds no idle capacity"""
+
+
+class _TokenBucket:
+    """Per-minute budget that refills continuously"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # A single request larger than the whole budget only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self.level -= min(amount, self.capacity)
+
+
+class _Ticket:
+    """A single request waiting for a dispatch slot"""
+
+    def __init__(self, cost: float):
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class _JobState:
+    """Queue and accounting for one job registered with the scheduler"""
+
+    def __init__(self, job_id: str, tenant: str, priority: str, weight: float,
+                 virtual_time: float, total_cost_at_start: float):
+        self.job_id = job_id
+        self.tenant = tenant
+        self.priority = priority
+        self.weight = weight
+        self.waiting = deque()
+        self.in_flight = 0
+        self.granted = 0
+        self.completed = 0
+        self.cost_granted = 0.0
+        self.virtual_time = virtual_time
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_cost_at_start = total_cost_at_start
+        self.total_cost_at_end = None
+        self.registered_at = time.time()
+        self.finished_at = None
+
+
+class FairShareScheduler:
+    """Global scheduler that shares model request capacity fairly across jobs
+
+    Every request an enhancement job wants to send first takes a slot from this
+    scheduler. Waiting requests are kept in per-job queues; when a slot frees up
+    the job with the best priority class and then the lowest weighted virtual
+    time (cost granted so far divided by weight) is served next. Slots are
+    bounded by a global concurrency limit, per-tenant concurrency caps and
+    requests/tokens per minute budgets.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                 requests_per_minute: int = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = TOKENS_PER_MINUTE,
+                 tenant_max_concurrency: int = TENANT_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.tenant_max_concurrency = tenant_max_concurrency
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._jobs: Dict[str, _JobState] = {}
+        self._finished: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tenant_in_flight: Dict[str, int] = {}
+        self._in_flight = 0
+        self._total_cost = 0.0
+        self._retry_after: Optional[float] = None
+
+    # Job registration
+
+    def register_job(self, job_id: str, tenant: str = "default", priority: str = "bulk",
+                     weight: float = 1.0) -> None:
+        """Register a job so its requests can be scheduled"""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority '{priority}'. Expected one of: {', '.join(PRIORITY_CLASSES)}")
+        if weight <= 0:
+            raise ValueError("Job weight must be positive")
+
+        with self._cond:
+            if job_id in self._jobs:
+                return
+            # New jobs start at the current virtual time so they can't claim
+            # the capacity that other jobs used before they arrived
+            active = [job.virtual_time for job in self._jobs.values() if job.waiting or job.in_flight]
+            self._jobs[job_id] = _JobState(job_id, tenant, priority, weight,
+                                           min(active) if active else 0.0, self._total_cost)
+
+    def unregister_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Remove a finished job and return its final stats"""
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return self._finished.get(job_id)
+
+            job.finished_at = time.time()
+            job.total_cost_at_end = self._total_cost
+            job.waiting.clear()
+            stats = self._job_stats(job)
+            stats["finished"] = True
+
+            self._finished[job_id] = stats
+            while len(self._finished) > FINISHED_JOBS_TO_KEEP:
+                self._finished.popitem(last=False)
+
+            self._dispatch()
+            self._cond.notify_all()
+            return stats
+
+    # Slots
+
+    @contextmanager
+    def slot(self, job_id: str, cost: float = 1.0, nowait: bool = False,
+             cancel: Optional[threading.Event] = None):
+        """Wait for a dispatch slot for one request of `job_id`
+
+        `cost` is the estimated number of tokens of the request; it is charged
+        against the tokens per minute budget and the job's fair share. With
+        `nowait`, the slot is only granted from idle capacity (nothing else is
+        queued) and SlotUnavailable is raised otherwise; this is used for
+        optional extra requests such as hedges. SlotUnavailable is also raised
+        when `cancel` is set while the request is still queued.
+        """
+        ticket = _Ticket(cost)
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise KeyError(f"Job '{job_id}' is not registered with the scheduler")
+            if nowait:
+                if not self._grant_idle(job, ticket):
+                    raise SlotUnavailable(f"No idle capacity for job '{job_id}'")
+            else:
+                job.waiting.append(ticket)
+            try:
+                while not ticket.granted:
+                    if self._jobs.get(job_id) is not job:
+                        raise RuntimeError(f"Job '{job_id}' was unregistered while waiting for a slot")
+                    if cancel is not None and cancel.is_set():
+                        raise SlotUnavailable(f"Request of job '{job_id}' was cancelled while queued")
+                    self._dispatch()
+                    if ticket.granted:
+                        break
+                    self._cond.wait(self._retry_after)
+            except BaseException:
+                if not ticket.granted and ticket in job.waiting:
+                    job.waiting.remove(ticket)
+                raise
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    def _release(self, job: _JobState) -> None:
+        with self._cond:
+            job.in_flight -= 1
+            job.completed += 1
+            self._in_flight -= 1
+            self._tenant_in_flight[job.tenant] -= 1
+            self._dispatch()
+            self._cond.notify_all()
+
+    def _tenant_has_room(self, tenant: str) -> bool:
+        if self.tenant_max_concurrency <= 0:
+            return True
+        return self._tenant_in_flight.get(tenant, 0) < self.tenant_max_concurrency
+
+    def _grant_idle(self, job: _JobState, ticket: _Ticket) -> bool:
+        """Grant a slot right away if capacity is idle (lock held)"""
+        if any(other.waiting for other in self._jobs.values()):
+            return False
+        if self.max_concurrency > 0 and self._in_flight >= self.max_concurrency:
+            return False
+        if not self._tenant_has_room(job.tenant):
+            return False
+        now = time.monotonic()
+        if self._requests.wait_time(1, now) > 0 or self._tokens.wait_time(ticket.cost, now) > 0:
+            return False
+        self._grant(job, ticket, now)
+        return True
+
+    def _grant(self, job: _JobState, ticket: _Ticket, now: float) -> None:
+        """Charge a granted request to the budgets and the job (lock held)"""
+        self._requests.take(1)
+        self._tokens.take(ticket.cost)
+        ticket.granted = True
+
+        queued_for = now - ticket.enqueued
+        job.total_wait += queued_for
+        job.max_wait = max(job.max_wait, queued_for)
+        job.granted += 1
+        job.in_flight += 1
+        job.cost_granted += ticket.cost
+        job.virtual_time += ticket.cost / job.weight
+        self._in_flight += 1
+        self._total_cost += ticket.cost
+        self._tenant_in_flight[job.tenant] = self._tenant_in_flight.get(job.tenant, 0) + 1
+
+    def _dispatch(self) -> None:
+        """Grant slots to waiting requests while capacity is available (lock held)"""
+        self._retry_after = None
+        granted_any = False
+
+        while self.max_concurrency <= 0 or self._in_flight < self.max_concurrency:
+            candidates = [job for job in self._jobs.values()
+                          if job.waiting and self._tenant_has_room(job.tenant)]
+            if not candidates:
+                break
+
+            job = min(candidates, key=lambda j: (PRIORITY_CLASSES[j.priority], j.virtual_time))
+            ticket = job.waiting[0]
+
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(ticket.cost, now))
+            if wait > 0:
+                self._retry_after = wait
+                break
+
+            job.waiting.popleft()
+            self._grant(job, ticket, now)
+            granted_any = True
+
+        if granted_any:
+            self._cond.notify_all()
+
+    # Stats
+
+    def _job_stats(self, job: _JobState) -> Dict[str, Any]:
+        total_end = job.total_cost_at_end if job.total_cost_at_end is not None else self._total_cost
+        total_during_job = total_end - job.total_cost_at_start
+        return {
+            "job_id": job.job_id,
+            "tenant": job.tenant,
+            "priority": job.priority,
+            "weight": job.weight,
+            "queued": len(job.waiting),
+            "in_flight": job.in_flight,
+            "granted": job.granted,
+            "completed": job.completed,
+            "avg_queue_delay": job.total_wait / job.granted if job.granted else 0.0,
+            "max_queue_delay": job.max_wait,
+            # Fraction of all capacity granted while this job was registered
+            "share": job.cost_granted / total_during_job if total_during_job > 0 else 0.0,
+            "finished": False,
+        }
+
+    def job_stats(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return queueing stats for a running or recently finished job"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._job_stats(job)
+            return self._finished.get(job_id)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the global scheduler state and the stats of every active job"""
+        with self._cond:
+            jobs: List[Dict[str, Any]] = [self._job_stats(job) for job in self._jobs.values()]
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "tenant_in_flight": dict(self._tenant_in_flight),
+                "jobs": jobs,
+            }
+
+
+_scheduler: Optional[FairShareScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairShareScheduler:
+    """Return the process-wide scheduler, creating it on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairShareScheduler()
+        return _scheduler
@@ -0,0 +1,18 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from backend.app.core.config import API_MODEL_WORKERS, API_DATA_WORKERS
+
+# Separate pools, so slow model calls can't hold up uploads and previews (and the other way round)
+_executors = {
+    "model": ThreadPoolExecutor(max_workers=API_MODEL_WORKERS, thread_name_prefix="api-model"),
+    "data": ThreadPoolExecutor(max_workers=API_DATA_WORKERS, thread_name_prefix="api-data"),
+}
+
+
+async def run_blocking(pool: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking call on one of the bounded API pools ("model" or "data") without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executors[pool], functools.partial(func, *args, **kwargs))
@@ -1,8 +1,14 @@
+import json
 import os
 import shutil
-from typing import List
+import tempfile
+from typing import Any, Callable, List, Optional
 from pathlib import Path
 
+# Temporary files are created readable by their owner only; files moved into place get the usual permissions
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 def ensure_dir_exists(dir_path: str) -> None:
     """Ensure a directory exists, create it if it doesn't"""
     os.makedirs(dir_path, exist_ok=True)
@@ -19,6 +25,24 @@ def clean_directory(dir_path: str) -> None:
         except Exception as e:
             print(f'Failed to delete {file_path}. Reason: {e}')
 
+def write_json_atomic(path: str, data: Any, default: Optional[Callable[[Any], Any]] = None) -> None:
+    """Write JSON to a uniquely named temporary file next to `path` and move it into place
+
+    Readers never see a half-written file, and concurrent writers of the same
+    path don't share a temporary file; the last one to finish wins.
+    """
+    f = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path) or ".",
+                                    prefix=f"{os.path.basename(path)}.", suffix=".tmp", delete=False)
+    try:
+        with f:
+            json.dump(data, f, default=default)
+        os.chmod(f.name, 0o666 & ~_UMASK)
+        os.replace(f.name, path)
+    except BaseException:
+        if os.path.exists(f.name):
+            os.remove(f.name)
+        raise
+
 def get_file_extension(filename: str) -> str:
     """Get the extension of a file"""
     return os.path.splitext(filename)[1].lower()
@@ -0,0 +1,67 @@
+import pandas as pd
+from typing import Dict, Iterable, Tuple
+
+# Text columns whose distinct values make up at most this share of their rows become categorical
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+try:
+    import pyarrow  # noqa: F401
+    ARROW_STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    ARROW_STRING_DTYPE = None
+
+
+def memory_usage_bytes(df: pd.DataFrame) -> int:
+    """Return the deep memory usage of a DataFrame in bytes"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def compact_dtypes(df: pd.DataFrame, exclude: Iterable[str] = ()) -> pd.DataFrame:
+    """Convert columns in place to compact dtypes that write back to CSV unchanged
+
+    - integer columns are downcast to the smallest integer type
+    - low-cardinality text columns become categorical
+    - other text columns become Arrow-backed strings (when pyarrow is installed)
+
+    Floats are left alone since a narrower float type changes how values are
+    written, and columns holding anything other than strings are skipped.
+    Columns that will be written to (e.g. the columns being enhanced) should be
+    excluded, as categorical and string columns only accept certain values.
+    """
+    excluded = set(exclude)
+    for column in df.columns:
+        if column in excluded:
+            continue
+        series = df[column]
+
+        if pd.api.types.is_integer_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast="integer")
+        elif series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string":
+            non_null = series.count()
+            if non_null and series.nunique() <= non_null * CATEGORY_MAX_UNIQUE_RATIO:
+                df[column] = series.astype("category")
+            elif ARROW_STRING_DTYPE:
+                df[column] = series.astype(ARROW_STRING_DTYPE)
+    return df
+
+
+def read_csv_compact(path: str, exclude: Iterable[str] = (), compact: bool = True) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """Read a CSV file and convert it to compact dtypes, reporting memory before and after"""
+    # Round-trip float parsing so floats are written back exactly as they were read
+    df = pd.read_csv(path, float_precision="round_trip")
+    before = memory_usage_bytes(df)
+    if compact:
+        compact_dtypes(df, exclude)
+    return df, {"before_bytes": before, "after_bytes": memory_usage_bytes(df)}
+
+
+def write_frame(df: pd.DataFrame, path: str, output_format: str = "csv") -> None:
+    """Write a DataFrame as CSV, JSON lines or Parquet"""
+    if output_format == "csv":
+        df.to_csv(path, index=False)
+    elif output_format == "jsonl":
+        df.to_json(path, orient="records", lines=True, force_ascii=False)
+    elif output_format == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unsupported output format '{output_format}'")
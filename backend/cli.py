@@ -0,0 +1,164 @@
+"""Command line interface for batch enhancement jobs
+
+Only the standard library is imported at module level. Pandas, the OpenAI client
+and the application settings are imported by the commands that need them, so
+`--help`, `validate` and `plan` start quickly.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Any, Optional
+
+
+def _load_config(path: str, what: str = "configuration") -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise SystemExit(f"Could not read {what} '{path}': {e}")
+
+
+def _read_header(path: str) -> List[str]:
+    import csv
+
+    with open(path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), [])
+
+
+def _check_config(config: Dict[str, Any], input_path: Optional[str] = None) -> None:
+    from backend.app.services.config_validation import validate_config
+
+    errors = validate_config(config, _read_header(input_path) if input_path else None)
+    if errors:
+        for error in errors:
+            print(f"error: {error}", file=sys.stderr)
+        raise SystemExit(1)
+
+
+def cmd_validate(args: argparse.Namespace) -> None:
+    config = _load_config(args.config)
+    _check_config(config, args.input)
+    print("Configuration is valid")
+
+
+def cmd_plan(args: argparse.Namespace) -> None:
+    from backend.app.services.planner import plan_csv
+
+    config = _load_config(args.config)
+    _check_config(config, args.input)
+    profile = _load_config(args.profile, "profile") if args.profile else None
+    plan = plan_csv(args.input, config, args.rows_per_unit, profile)
+
+    if args.json:
+        print(json.dumps(plan, indent=2))
+        return
+
+    print(f"{plan['rows']} rows, {len(plan['units'])} units")
+    for column, totals in plan["columns"].items():
+        print(f"  {column}: {totals['pending_rows']} rows to send in {totals['requests']} requests "
+              f"of up to {totals['batch_size']} (~{totals['estimated_prompt_tokens']} prompt tokens)")
+    for column in plan["skipped_columns"]:
+        print(f"  {column}: not in the file, skipped")
+    for column in plan["complete_columns"]:
+        print(f"  {column}: no missing values, skipped")
+
+
+def cmd_profile(args: argparse.Namespace) -> None:
+    from backend.app.services.profiler import get_profile
+
+    print(json.dumps(get_profile(args.input), indent=2))
+
+
+def cmd_run(args: argparse.Namespace) -> None:
+    config = _load_config(args.config)
+    if args.concurrency:
+        config["concurrency"] = args.concurrency
+    if args.format:
+        config["output_format"] = args.format
+    # pstats for .prof/.pstats files, collapsed stacks otherwise
+    profile_format = None
+    if args.profile_output:
+        profile_format = "pstats" if args.profile_output.endswith((".prof", ".pstats")) else "collapsed"
+        config["profiling"] = args.profiler
+        if args.profiler == "cprofile" and profile_format != "pstats":
+            raise SystemExit("cProfile profiles can only be written as pstats (.prof or .pstats)")
+    _check_config(config, args.input)
+
+    from backend.app.services.csv_enhancer import CSVEnhancer
+
+    enhancer = CSVEnhancer(config, priority=args.priority)
+    if args.batch:
+        if args.resume:
+            raise SystemExit("--resume is not supported with --batch")
+        summary = enhancer.process_file_batch(args.input, args.output)
+    else:
+        summary = enhancer.process_file(args.input, args.output, resume=args.resume)
+    if profile_format:
+        from backend.app.services.job_profiler import profile_registry
+
+        with open(args.profile_output, "wb") as f:
+            f.write(profile_registry.get(enhancer.job_id).export(profile_format))
+        print(f"Saved the {args.profiler} profile as '{args.profile_output}'")
+    print(json.dumps(summary, indent=2, default=str))
+
+
+def cmd_worker(args: argparse.Namespace) -> None:
+    from backend.app.services.leasing import main as leasing_main
+
+    leasing_main(["worker", "--db", args.db] + (["--exit-when-idle"] if args.exit_when_idle else []))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="data-smith", description="Enhance CSV files with AI in batch")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Enhance a file")
+    run_parser.add_argument("input", help="Input CSV file")
+    run_parser.add_argument("output", help="Output file")
+    run_parser.add_argument("-c", "--config", required=True, help="Configuration JSON file")
+    run_parser.add_argument("--concurrency", type=int, help="Requests in flight at once for this job")
+    run_parser.add_argument("--format", choices=("csv", "jsonl", "parquet"), help="Output format (default: csv)")
+    run_parser.add_argument("--resume", action="store_true",
+                            help="Continue an interrupted run after the rows it already wrote")
+    run_parser.add_argument("--priority", choices=("interactive", "bulk"), default="bulk",
+                            help="Scheduling priority of the job")
+    run_parser.add_argument("--batch", action="store_true",
+                            help="Send the requests through the offline batch backend (cheaper, not interactive)")
+    run_parser.add_argument("--profile-output", metavar="PATH",
+                            help="Profile the run and write it to PATH (pstats for .prof, else collapsed stacks)")
+    run_parser.add_argument("--profiler", choices=("sampling", "cprofile"), default="sampling",
+                            help="Profiler used with --profile-output (default: sampling)")
+    run_parser.set_defaults(func=cmd_run)
+
+    plan_parser = subparsers.add_parser("plan", help="Show the batches a run would send without calling the model")
+    plan_parser.add_argument("input", help="Input CSV file")
+    plan_parser.add_argument("-c", "--config", required=True, help="Configuration JSON file")
+    plan_parser.add_argument("--rows-per-unit", type=int, default=1000, help="Rows per batch unit")
+    plan_parser.add_argument("--json", action="store_true", help="Print the full plan as JSON")
+    plan_parser.add_argument("--profile", help="Profile JSON of the file (see 'profile') to skip complete columns")
+    plan_parser.set_defaults(func=cmd_plan)
+
+    profile_parser = subparsers.add_parser("profile", help="Print per-column statistics of a file")
+    profile_parser.add_argument("input", help="Input CSV file")
+    profile_parser.set_defaults(func=cmd_profile)
+
+    validate_parser = subparsers.add_parser("validate", help="Check a configuration file")
+    validate_parser.add_argument("config", help="Configuration JSON file")
+    validate_parser.add_argument("--input", help="CSV file to check the configured columns against")
+    validate_parser.set_defaults(func=cmd_validate)
+
+    worker_parser = subparsers.add_parser("worker", help="Process batch units from a shared lease table")
+    worker_parser.add_argument("--db", required=True, help="Path of the lease database")
+    worker_parser.add_argument("--exit-when-idle", action="store_true", help="Exit when no unit is left")
+    worker_parser.set_defaults(func=cmd_worker)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
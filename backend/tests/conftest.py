@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# Set before backend.app.core.config is imported: the tests run against the local
+# fake model backend, without rate limits and with their own data directory
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["FAKE_LLM_LATENCY_MS"] = "0"
+os.environ["FAKE_LLM_SLOW_RATE"] = "0"
+os.environ["FAKE_LLM_PROSE_RATE"] = "0"
+os.environ["REQUESTS_PER_MINUTE"] = "0"
+os.environ["TOKENS_PER_MINUTE"] = "0"
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="data-smith-tests-")
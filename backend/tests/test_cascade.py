@@ -0,0 +1,67 @@
+import math
+
+import pandas as pd
+import pytest
+
+from backend.app.services.cascade import logprob_confidences
+from backend.app.services.csv_enhancer import CSVEnhancer
+
+
+def tokens(*pieces):
+    return [{"token": token, "logprob": math.log(probability)} for token, probability in pieces]
+
+
+def test_confidence_is_the_least_likely_token_of_each_item():
+    pieces = [('[{"Index": 1, ', 0.8), ('"C": "a"}', 0.5), (", ", 0.1), ('{"Index": 2, "C": "b"}', 0.9), ("]", 0.1)]
+    text = "".join(piece for piece, _ in pieces)
+    assert logprob_confidences(text, tokens(*pieces)) == pytest.approx([0.5, 0.9])
+
+
+def test_confidences_ignore_text_around_the_array():
+    pieces = [("Here you go:\n", 0.01), ('["a"', 0.6), (', "b"]', 0.7), ("\nDone.", 0.01)]
+    text = "".join(piece for piece, _ in pieces)
+    assert logprob_confidences(text, tokens(*pieces)) == pytest.approx([0.6, 0.7])
+
+
+def test_confidences_of_a_keyed_array():
+    pieces = [('{"values": [', 0.2), ('"a", ', 0.4), ('"b"]', 0.8), (', "confidences": [0.1, 0.1]}', 0.2)]
+    text = "".join(piece for piece, _ in pieces)
+    assert logprob_confidences(text, tokens(*pieces), key="values") == pytest.approx([0.4, 0.8])
+
+
+def run_cascade(tmp_path, min_confidence, confidence="self"):
+    input_path = tmp_path / "input.csv"
+    pd.DataFrame({"Name": [f"item{number}" for number in range(40)], "Category": [""] * 40}).to_csv(input_path, index=False)
+    config = {
+        "column_context": {"Category": ["Name"]},
+        "batch_sizes": {"Category": 10},
+        "use_cache": False,
+        "model_cascade": [{"model": "small", "min_confidence": min_confidence, "confidence": confidence},
+                          {"model": "large"}],
+    }
+    summary = CSVEnhancer(config).process_file(str(input_path), str(tmp_path / "output.csv"))
+    output = pd.read_csv(tmp_path / "output.csv")
+    assert output["Category"].tolist() == [f"Category for item{number}" for number in range(40)]
+    return summary["cascade"]
+
+
+@pytest.mark.parametrize("confidence", ["self", "logprobs"])
+def test_entries_below_the_threshold_escalate(tmp_path, confidence):
+    # The fake backend answers one entry in four with confidence 0.3, the others with 0.9
+    small, large = run_cascade(tmp_path, 0.5, confidence)
+    assert small["entries"] == 40
+    assert 0 < small["escalated"] < 40
+    assert large["entries"] == small["escalated"]
+    assert large["escalated"] == 0
+
+
+def test_confidence_at_the_threshold_is_accepted(tmp_path):
+    small, large = run_cascade(tmp_path, 0.3)
+    assert small["escalated"] == 0
+    assert large["requests"] == 0
+
+
+def test_everything_escalates_above_all_confidences(tmp_path):
+    small, large = run_cascade(tmp_path, 0.95)
+    assert small["escalated"] == 40
+    assert large["entries"] == 40
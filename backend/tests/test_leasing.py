@@ -0,0 +1,57 @@
+import pytest
+
+from backend.app.services import leasing
+from backend.app.services.leasing import LeaseStore
+
+UNITS = [
+    {"column": "Category", "stage": 0, "start": 0, "stop": 10},
+    {"column": "Description", "stage": 1, "start": 0, "stop": 10},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LeaseStore(str(tmp_path / "jobs.db"))
+    store.create_job("job", "input.csv", "output.csv", str(tmp_path), {"column_context": {}}, UNITS)
+    return store
+
+
+def test_live_lease_is_not_handed_out_again(store):
+    assert store.claim("a")["unit_id"] == 0
+    assert store.claim("b") is None
+
+
+def test_expired_lease_is_reclaimed(store):
+    # A negative lease is expired as soon as it is taken, like a worker that died right after claiming
+    assert store.claim("a", lease_seconds=-1)["unit_id"] == 0
+    unit = store.claim("b")
+    assert unit["unit_id"] == 0
+
+    # The first worker lost the unit: its heartbeats and results are refused
+    assert not store.heartbeat("job", 0, "a")
+    assert not store.complete("job", 0, "a", "a.json")
+    assert store.complete("job", 0, "b", "b.json")
+    assert store.units("job")[0]["attempts"] == 2
+    assert store.progress("job")["done"] == 1
+
+
+def test_unit_fails_after_too_many_expired_leases(store):
+    for attempt in range(leasing.MAX_ATTEMPTS):
+        assert store.claim(f"worker-{attempt}", lease_seconds=-1)["unit_id"] == 0
+
+    # The next claim gives up on the unit instead of handing it out again, which unblocks the next stage
+    assert store.claim("last")["unit_id"] == 1
+    unit = store.units("job")[0]
+    assert unit["status"] == "failed"
+    assert unit["error"] == "lease expired too often"
+
+
+def test_later_stage_waits_for_earlier_stages(store):
+    store.claim("a", lease_seconds=-1)
+    # The expired first-stage unit is handed out again before the second stage
+    assert store.claim("b")["unit_id"] == 0
+    assert store.claim("c") is None
+
+    store.complete("job", 0, "b", "b.json")
+    assert store.claim("c")["unit_id"] == 1
+    assert store.open_units() == 1
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from backend.app.services.csv_enhancer import CSVEnhancer
+from backend.app.services.fake_llm import FakeChatClient
+
+
+def test_system_prefix_is_identical_across_batches(tmp_path, monkeypatch):
+    requests = []
+    create = FakeChatClient.create
+
+    def recording_create(self, model, messages, **kwargs):
+        requests.append(messages)
+        return create(self, model, messages, **kwargs)
+
+    monkeypatch.setattr(FakeChatClient, "create", recording_create)
+
+    input_path = tmp_path / "input.csv"
+    pd.DataFrame({"Name": [f"item{number}" for number in range(30)], "Status": [""] * 30}).to_csv(input_path, index=False)
+    config = {
+        "column_context": {"Status": ["Name"]},
+        "batch_sizes": {"Status": 10},
+        "transformation_instructions": {"Status": "Use lowercase."},
+        # The fake's first answers break the constraint, so every row is asked again with the reason
+        "output_constraints": {"Status": {"enum": ["new", "used"]}},
+        "use_cache": False,
+    }
+    summary = CSVEnhancer(config).process_file(str(input_path), str(tmp_path / "output.csv"))
+
+    assert len(requests) == 6
+    systems = {messages[0]["content"].encode("utf-8") for messages in requests}
+    assert len(systems) == 1
+    system = systems.pop().decode("utf-8")
+    assert "Use lowercase." in system
+    assert "item" not in system
+
+    # Only the entries vary, in the user message
+    users = [messages[1]["content"] for messages in requests]
+    assert len(set(users)) == len(users)
+    assert "Rejected because" in users[-1]
+
+    # The fake backend caches system messages it has seen, like a provider's prefix cache
+    assert summary["prompt_cache"]["requests"] == 6
+    assert summary["prompt_cache"]["requests_with_hits"] == 5
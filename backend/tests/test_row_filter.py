@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from backend.app.services.row_filter import RowFilter, RowFilterError
+
+
+def test_leading_negation_parses():
+    row_filter = RowFilter("~(Status in ['sold'])")
+    df = pd.DataFrame({"Status": ["sold", "new", None]})
+    assert row_filter.mask(df).tolist() == [False, True, True]
+    predicate = row_filter.row_predicate()
+    assert [predicate({"Status": status}) for status in ["sold", "new", ""]] == [False, True, True]
+
+
+def test_symbol_operators_match_keywords():
+    df = pd.DataFrame({"Unit Price": [5, 20, 5], "Status": ["new", "sold", "sold"]})
+    symbols = RowFilter("`Unit Price` >= 10 | ~(Status in ['sold', 'archived'])")
+    keywords = RowFilter("`Unit Price` >= 10 or not (Status in ['sold', 'archived'])")
+    assert symbols.mask(df).tolist() == keywords.mask(df).tolist() == [True, True, False]
+
+
+def test_rejects_calls():
+    with pytest.raises(RowFilterError):
+        RowFilter("__import__('os').system('true')")
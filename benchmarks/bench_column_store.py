@@ -0,0 +1,86 @@
+"""Re-running one column: whole-file output vs. the column store
+
+Builds a wide synthetic file, enhances one column with the fake LLM backend
+twice (once writing the whole output file as the CLI does, once writing only
+the column to a ColumnStore as API jobs do) and reports the time and bytes
+each run writes, plus the time to merge the stored result on its first
+download.
+
+    python benchmarks/bench_column_store.py [--rows 200000] [--columns 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def write_input(path, rows, columns):
+    with open(path, "w") as f:
+        f.write(",".join(["Title"] + [f"Field{number}" for number in range(columns)] + ["Popularity"]) + "\n")
+        for row in range(rows):
+            fields = ",".join(f"value {row * column % 9973} of field {column}" for column in range(columns))
+            # Every 50th row is missing its popularity
+            f.write(f"Item {row},{fields},{'' if row % 50 == 0 else row % 100}\n")
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--columns", type=int, default=20, help="extra text columns that are not enhanced")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Must be set before the enhancer (and its config) is imported
+        os.environ["LLM_BACKEND"] = "fake"
+        os.environ["REQUESTS_PER_MINUTE"] = "0"
+        os.environ["TOKENS_PER_MINUTE"] = "0"
+        os.environ["DATA_DIR"] = directory
+        from backend.app.services.column_store import ColumnStore
+        from backend.app.services.csv_enhancer import CSVEnhancer
+
+        input_path = os.path.join(directory, "input.csv")
+        write_input(input_path, args.rows, args.columns)
+        config = {
+            "column_context": {"Popularity": ["Title"]},
+            "ignore_valued_columns": {"Popularity": True},
+            "batch_sizes": {"Popularity": 50},
+            "concurrency": 4,
+            "use_cache": False,
+        }
+
+        whole_path = os.path.join(directory, "whole.csv")
+        started = time.perf_counter()
+        CSVEnhancer(config).process_file(input_path, whole_path)
+        whole_seconds = time.perf_counter() - started
+        whole_bytes = os.path.getsize(whole_path)
+
+        store = ColumnStore("stored.csv", os.path.join(directory, "columns"))
+        stored_path = os.path.join(directory, "stored.csv")
+        started = time.perf_counter()
+        CSVEnhancer(config).process_file(input_path, stored_path, store=store)
+        store_seconds = time.perf_counter() - started
+        store_bytes = directory_bytes(store.directory)
+
+        started = time.perf_counter()
+        merged_bytes = sum(len(data) for data in store.materialize(stored_path))
+        merge_seconds = time.perf_counter() - started
+        with open(whole_path, "rb") as whole, open(stored_path, "rb") as stored:
+            identical = whole.read() == stored.read()
+
+    print(f"\n{args.rows} rows, {args.columns + 2} columns ({whole_bytes / 1e6:.1f} MB output)")
+    print(f"  whole file:   {whole_seconds:6.2f} s, {whole_bytes / 1e6:8.2f} MB written")
+    print(f"  column store: {store_seconds:6.2f} s, {store_bytes / 1e6:8.2f} MB written")
+    print(f"  first download merge: {merge_seconds:.2f} s for {merged_bytes / 1e6:.1f} MB "
+          f"({'identical to' if identical else 'DIFFERENT from'} the whole-file output)")
+
+
+if __name__ == "__main__":
+    main()
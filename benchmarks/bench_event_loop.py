@@ -0,0 +1,107 @@
+"""Event loop responsiveness check for the API
+
+Sends a steady stream of light requests (job list, scheduler state and a
+result download) to the app in-process, first on its own and then while
+`--users` clients keep config generation requests in flight against the fake
+LLM backend. Any blocking call on the event loop shows up as a jump in the
+light requests' latency; the check fails when their p99 under load exceeds
+`--max-p99-ms`.
+
+    python benchmarks/bench_event_loop.py [--users 20] [--model-ms 2000] [--probes 200]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROBE_FILE = "bench_event_loop_probe.csv"
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+async def probe(client, count, interval):
+    """Time `count` light requests, one after the other"""
+    paths = ["/api/jobs", "/api/scheduler", f"/api/download/{PROBE_FILE}"]
+    timings = []
+    for number in range(count):
+        start = time.perf_counter()
+        response = await client.get(paths[number % len(paths)])
+        response.raise_for_status()
+        timings.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+    return timings
+
+
+async def generate_configs(client, stop, columns, completed):
+    while not stop.is_set():
+        response = await client.post("/api/generate-config", json={
+            "description": "Fill in missing categories", "columns": columns})
+        response.raise_for_status()
+        completed.append(1)
+
+
+async def run(args):
+    import httpx
+    from backend.app.core.config import RESULT_DIR, ensure_storage_dirs
+    from backend.app.main import app
+
+    ensure_storage_dirs()
+    probe_path = os.path.join(RESULT_DIR, PROBE_FILE)
+    with open(probe_path, "w") as f:
+        f.write("Title,Category\n" + "".join(f"Item {i},Books\n" for i in range(1000)))
+
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+            idle = await probe(client, args.probes, args.interval_ms / 1000)
+
+            stop = asyncio.Event()
+            completed = []
+            users = [asyncio.create_task(generate_configs(client, stop, ["Title", "Category"], completed))
+                     for _ in range(args.users)]
+            # Let the config requests pile up before measuring
+            await asyncio.sleep(args.model_ms / 2000)
+            loaded = await probe(client, args.probes, args.interval_ms / 1000)
+            stop.set()
+            await asyncio.gather(*users)
+    finally:
+        os.remove(probe_path)
+
+    return idle, loaded, len(completed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="concurrent config generation clients")
+    parser.add_argument("--model-ms", type=float, default=2000, help="fake model latency")
+    parser.add_argument("--probes", type=int, default=200, help="light requests per phase")
+    parser.add_argument("--interval-ms", type=float, default=10, help="pause between light requests")
+    parser.add_argument("--max-p99-ms", type=float, default=100, help="p99 budget of light requests under load")
+    args = parser.parse_args()
+
+    # Must be set before the app (and its config) is imported
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.model_ms)
+
+    idle, loaded, completed = asyncio.run(run(args))
+    idle_stats, loaded_stats = percentiles(idle), percentiles(loaded)
+    for name, stats in (("idle", idle_stats), ("loaded", loaded_stats)):
+        print(f"{name:>7}: " + "  ".join(f"{key} {value:7.1f} ms" for key, value in stats.items()))
+    print(f"Config generations completed during the loaded phase: {completed}")
+    print(f"Median latency change under load: {statistics.median(loaded) - statistics.median(idle):+.1f} ms")
+
+    ok = loaded_stats["p99"] <= args.max_p99_ms
+    print(f"p99 under load {loaded_stats['p99']:.1f} ms (budget {args.max_p99_ms:.0f} ms) {'OK' if ok else 'FAIL'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
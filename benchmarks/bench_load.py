@@ -0,0 +1,338 @@
+"""End-to-end load test of the API against the fake LLM backend
+
+Starts one uvicorn worker running `backend.app.main:app` with the fake LLM
+backend and a temporary data directory, then runs `--sessions` user sessions,
+`--concurrency` at a time. Each session uploads a generated CSV file, asks
+for a configuration, processes the file, polls the job until it finishes and
+downloads the result. File sizes are drawn from `--rows` (e.g.
+`1000:6,20000:3,100000:1` for mostly small files with weights).
+
+Reported: session throughput, rows per second, latency percentiles and error
+rates per endpoint, session duration and the server's peak RSS and CPU use.
+With `--output`, the report is written as JSON together with the commit and
+parameters; `--compare` prints the changes against such an earlier report.
+
+    python benchmarks/bench_load.py [--sessions 40] [--concurrency 10] [--rows 1000:6,20000:3,100000:1]
+        [--model-ms 200] [--output run.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLUMNS = ["Title", "Brand", "Price", "Category"]
+CATEGORIES = ["Books", "Electronics", "Garden", "Toys", "Kitchen"]
+
+# Share of rows with an empty Category (the column the generated config fills)
+MISSING_RATE = 0.3
+
+JOB_POLL_SECONDS = 0.2
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": ordered[-1]}
+
+
+def parse_rows_mix(text):
+    mix = []
+    for part in text.split(","):
+        rows, _, weight = part.partition(":")
+        mix.append((int(rows), float(weight or 1)))
+    return mix
+
+
+def make_csv(rows, seed):
+    """Return the content of a product CSV file with some categories missing"""
+    rng = random.Random(seed)
+    lines = [",".join(COLUMNS)]
+    for i in range(rows):
+        category = "" if rng.random() < MISSING_RATE else rng.choice(CATEGORIES)
+        lines.append(f"Product {seed}-{i},Brand {rng.randint(1, 50)},{rng.uniform(1, 500):.2f},{category}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ProcessMonitor:
+    """Samples RSS and CPU time of a process from /proc"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ticks = os.sysconf("SC_CLK_TCK")
+        self._page = os.sysconf("SC_PAGE_SIZE")
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+        rss = int(fields[21]) * self._page
+        return cpu_seconds, rss
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                cpu, rss = self._read()
+            except (OSError, IndexError):
+                break
+            self.samples.append((time.monotonic(), cpu, rss))
+            self.peak_rss = max(self.peak_rss, rss)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self, start, end):
+        window = [sample for sample in self.samples if start <= sample[0] <= end]
+        if len(window) < 2:
+            return {"peak_rss_mb": self.peak_rss / 1e6}
+        (t0, cpu0, _), (t1, cpu1, _) = window[0], window[-1]
+        return {
+            "peak_rss_mb": self.peak_rss / 1e6,
+            "avg_rss_mb": sum(sample[2] for sample in window) / len(window) / 1e6,
+            "avg_cpu_percent": 100 * (cpu1 - cpu0) / (t1 - t0),
+        }
+
+
+def start_server(port, data_dir, model_ms, extra_env):
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY_MS": str(model_ms),
+        "DATA_DIR": data_dir,
+        # The server is measured, not the request rate limits
+        "REQUESTS_PER_MINUTE": "0",
+        "TOKENS_PER_MINUTE": "0",
+        "PYTHONPATH": ROOT,
+    })
+    env.update(extra_env)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", "1", "--log-level", "warning"],
+        # The server's progress output would drown the report
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server did not start within 30s")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.sessions = []
+        self.failed_sessions = 0
+        self.rows = 0
+
+    async def call(self, name, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.latencies.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            raise RuntimeError(f"{name} failed: {response.status_code if response is not None else 'no response'}")
+        return response
+
+
+async def session(client, recorder, number, rows):
+    started = time.perf_counter()
+    filename = f"load_{number}.csv"
+    columns = (await recorder.call("upload", client.post(
+        "/api/upload", files={"file": (filename, make_csv(rows, number), "text/csv")}))).json()["columns"]
+    config = (await recorder.call("generate-config", client.post("/api/generate-config", json={
+        "description": "Fill in the missing categories", "columns": columns, "filename": filename}))).json()["config"]
+    job = (await recorder.call("process", client.post(
+        "/api/process", json={"filename": filename, "config": config}))).json()
+
+    while True:
+        status = (await recorder.call("jobs", client.get(f"/api/jobs/{job['job_id']}"))).json()
+        if status["status"] in ("completed", "failed"):
+            break
+        await asyncio.sleep(JOB_POLL_SECONDS)
+    if status["status"] != "completed":
+        recorder.errors["job"] = recorder.errors.get("job", 0) + 1
+        raise RuntimeError(f"Job {job['job_id']} failed: {status.get('error')}")
+
+    download = await recorder.call("download", client.get(f"/api/download/{job['result_file']}"))
+    if download.content.count(b"\n") != rows + 1:
+        recorder.errors["download"] = recorder.errors.get("download", 0) + 1
+        raise RuntimeError(f"Download of {job['result_file']} is incomplete")
+    recorder.sessions.append((time.perf_counter() - started) * 1000)
+    recorder.rows += rows
+
+
+async def drive(base_url, args, recorder):
+    import httpx
+
+    mix = parse_rows_mix(args.rows)
+    rng = random.Random(args.seed)
+    sizes = rng.choices([rows for rows, _ in mix], weights=[weight for _, weight in mix], k=args.sessions)
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def run(number, rows):
+        async with limit:
+            try:
+                await session(client, recorder, number, rows)
+            except Exception as e:
+                recorder.failed_sessions += 1
+                print(f"Session {number} failed: {e}")
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(run(number, rows) for number, rows in enumerate(sizes)))
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    totals = report["totals"]
+    print(f"Sessions: {totals['sessions_ok']} ok, {totals['sessions_failed']} failed in {totals['seconds']:.1f}s "
+          f"({totals['sessions_per_second']:.2f}/s, {totals['rows_per_second']:.0f} rows/s)")
+    print(f"{'endpoint':>16} {'count':>6} {'errors':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:>16} {stats['count']:>6} {stats['errors']:>6} "
+              + " ".join(f"{stats.get(key, 0):7.1f}ms" for key in ("p50", "p90", "p99", "max")))
+    session = report["session_ms"]
+    if session:
+        print(f"{'session':>16} {totals['sessions_ok']:>6} {totals['sessions_failed']:>6} "
+              + " ".join(f"{session[key]:7.1f}ms" for key in ("p50", "p90", "p99", "max")))
+    server = report["server"]
+    print(f"Server: peak RSS {server['peak_rss_mb']:.0f} MB"
+          + (f", avg RSS {server['avg_rss_mb']:.0f} MB, avg CPU {server['avg_cpu_percent']:.0f}%"
+             if "avg_cpu_percent" in server else ""))
+
+
+def print_comparison(report, baseline):
+    print(f"Compared with {baseline.get('commit')} (same parameters: "
+          f"{baseline.get('parameters') == report['parameters']})")
+
+    def change(name, new, old, lower_is_better=True):
+        if not old:
+            return
+        delta = (new - old) / old * 100
+        better = delta < 0 if lower_is_better else delta > 0
+        print(f"  {name:>28}: {old:9.1f} -> {new:9.1f} ({delta:+.1f}%{'' if abs(delta) < 5 else ' better' if better else ' worse'})")
+
+    change("sessions/s", report["totals"]["sessions_per_second"], baseline["totals"]["sessions_per_second"], False)
+    change("rows/s", report["totals"]["rows_per_second"], baseline["totals"]["rows_per_second"], False)
+    for name, stats in report["endpoints"].items():
+        old = baseline["endpoints"].get(name, {})
+        for key in ("p50", "p99"):
+            if key in stats and key in old:
+                change(f"{name} {key} ms", stats[key], old[key])
+    change("session p99 ms", report["session_ms"].get("p99", 0), baseline["session_ms"].get("p99", 0))
+    change("peak RSS MB", report["server"]["peak_rss_mb"], baseline["server"]["peak_rss_mb"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=40, help="user sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions running at once")
+    parser.add_argument("--rows", default="1000:6,20000:3,100000:1", help="rows per file as size:weight,...")
+    parser.add_argument("--model-ms", type=float, default=200, help="fake model latency")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the file sizes and contents")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout in seconds")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment variable for the server (repeatable)")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+    args = parser.parse_args()
+    extra_env = dict(item.split("=", 1) for item in args.server_env)
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = start_server(port, data_dir, args.model_ms, extra_env)
+        monitor = ProcessMonitor(server.pid)
+        monitor.start()
+        recorder = Recorder()
+        try:
+            started = time.monotonic()
+            asyncio.run(drive(f"http://127.0.0.1:{port}", args, recorder))
+            finished = time.monotonic()
+        finally:
+            monitor.stop()
+            server.terminate()
+            server.wait(timeout=30)
+
+    seconds = finished - started
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": {key: getattr(args, key) for key in
+                       ("sessions", "concurrency", "rows", "model_ms", "seed", "server_env")},
+        "totals": {
+            "seconds": seconds,
+            "sessions_ok": len(recorder.sessions),
+            "sessions_failed": recorder.failed_sessions,
+            "sessions_per_second": len(recorder.sessions) / seconds,
+            "rows_per_second": recorder.rows / seconds,
+        },
+        "endpoints": {
+            name: {"count": len(samples), "errors": recorder.errors.get(name, 0),
+                   "error_rate": recorder.errors.get(name, 0) / len(samples), **percentiles(samples)}
+            for name, samples in recorder.latencies.items()
+        },
+        "session_ms": percentiles(recorder.sessions),
+        "server": monitor.summary(started, finished),
+    }
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    sys.exit(1 if recorder.failed_sessions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Reply format comparison with the fake LLM backend
+
+Enhances the same synthetic file once per `reply_format` (objects,
+positional, json_schema) and reports the completion tokens, replies that
+failed to parse, rows answered and time spent in the parse stage. Set
+`--prose-rate` to have the fake wrap that fraction of the replies not
+enforced by a schema in prose, as models do with free-text format
+instructions. With `--cascade`, a two-tier model cascade also asks for
+confidences.
+
+    python benchmarks/bench_reply_format.py [--rows 5000] [--batch-size 20] [--prose-rate 0.1] [--cascade]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FORMATS = ("objects", "positional", "json_schema")
+
+
+def write_input(path, rows):
+    with open(path, "w") as f:
+        f.write("Title,Author,Category\n")
+        for number in range(rows):
+            # Half of the categories are missing and have to be filled in
+            category = "" if number % 2 else "Books"
+            f.write(f"Item {number},Author {number % 97},{category}\n")
+
+
+def run(args, reply_format, input_path, output_dir):
+    import pandas as pd
+    from backend.app.services.csv_enhancer import CSVEnhancer
+
+    config = {
+        "column_context": {"Category": ["Title", "Author"]},
+        "batch_sizes": {"Category": args.batch_size},
+        "concurrency": args.concurrency,
+        "use_cache": False,
+        "reply_format": reply_format,
+    }
+    if args.cascade:
+        config["model_cascade"] = [{"model": "small", "min_confidence": 0.7}, {"model": "large"}]
+    output_path = os.path.join(output_dir, f"{reply_format}.csv")
+    started = time.perf_counter()
+    summary = CSVEnhancer(config).process_file(input_path, output_path)
+    elapsed = time.perf_counter() - started
+
+    result = pd.read_csv(output_path)
+    parse = summary["pipeline"]["stages"].get("parse", {})
+    return {
+        "seconds": elapsed,
+        "requests": sum(tier["requests"] for tier in summary["cascade"]),
+        "completion_tokens": sum(tier["completion_tokens"] for tier in summary["cascade"]),
+        "parse_errors": summary["stats"]["parse_errors"],
+        "answered": int(result["Category"].notna().sum()),
+        "parse_ms": parse.get("busy_seconds", 0.0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--prose-rate", type=float, default=0.1, help="fraction of replies wrapped in prose")
+    parser.add_argument("--cascade", action="store_true", help="ask a two-tier cascade for confidences")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Must be set before the enhancer (and its config) is imported
+        os.environ["LLM_BACKEND"] = "fake"
+        os.environ["FAKE_LLM_PROSE_RATE"] = str(args.prose_rate)
+        os.environ["REQUESTS_PER_MINUTE"] = "0"
+        os.environ["TOKENS_PER_MINUTE"] = "0"
+        os.environ["DATA_DIR"] = directory
+
+        input_path = os.path.join(directory, "input.csv")
+        write_input(input_path, args.rows)
+        reports = {reply_format: run(args, reply_format, input_path, directory) for reply_format in FORMATS}
+
+    print(f"\n{args.rows} rows, batches of {args.batch_size}, prose rate {args.prose_rate:.0%}"
+          f"{', model cascade' if args.cascade else ''}")
+    print(f"{'format':>12} {'requests':>9} {'completion tokens':>18} {'parse errors':>13} {'answered':>9} "
+          f"{'parse ms':>9} {'seconds':>8}")
+    for reply_format, report in reports.items():
+        print(f"{reply_format:>12} {report['requests']:>9} {report['completion_tokens']:>18} "
+              f"{report['parse_errors']:>13} {report['answered']:>9} {report['parse_ms']:>9.1f} "
+              f"{report['seconds']:>8.2f}")
+    baseline = reports["objects"]["completion_tokens"]
+    for reply_format in FORMATS[1:]:
+        tokens = reports[reply_format]["completion_tokens"]
+        if baseline:
+            print(f"{reply_format}: {1 - tokens / baseline:.0%} fewer completion tokens than objects")
+
+
+if __name__ == "__main__":
+    main()
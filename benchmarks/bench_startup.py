@@ -0,0 +1,95 @@
+"""Startup-time guard for the data-smith command line
+
+Runs `--help`, `validate` and `plan` in fresh interpreters and fails when a
+command takes longer than the budget or imports a heavy module. The time
+measured starts at the first import of `backend.cli`, so interpreter and site
+startup (which depends on the environment) is reported separately.
+
+    python benchmarks/bench_startup.py [--runs 10] [--budget-ms 100]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported by the fast commands
+HEAVY_MODULES = ["pandas", "numpy", "openai", "dotenv", "fastapi", "backend.app.core.config"]
+
+PROBE = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+from backend.cli import main
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        main(sys.argv[1:])
+    except SystemExit as e:
+        if e.code not in (0, None):
+            raise
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(argv, runs):
+    timings, heavy = [], set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE] + argv, cwd=ROOT, capture_output=True,
+                             text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        heavy.update(result["heavy"])
+    return statistics.median(timings), sorted(heavy)
+
+
+def interpreter_startup_ms(runs):
+    import time
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "column_context": {"Description": ["Title", "Category"]},
+                "batch_sizes": {"Description": 5},
+                "ignore_valued_columns": {"Description": True},
+            }, f)
+        sample = os.path.join(ROOT, "sample_data.csv")
+
+        commands = {
+            "--help": ["--help"],
+            "validate": ["validate", config_path, "--input", sample],
+            "plan": ["plan", sample, "--config", config_path],
+        }
+
+        print(f"Interpreter startup: {interpreter_startup_ms(args.runs):.1f} ms (not counted)")
+        failed = False
+        for name, argv in commands.items():
+            median_ms, heavy = measure(argv, args.runs)
+            ok = median_ms <= args.budget_ms and not heavy
+            failed = failed or not ok
+            note = f" imports {', '.join(heavy)}" if heavy else ""
+            print(f"{name:>10}: {median_ms:6.1f} ms median{note} {'OK' if ok else 'FAIL'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()